@@ -1,9 +1,26 @@
 import pandas as pd
 import numpy as np
 import os
+import re
 import sys
 import time
 
+# Moduli condivisi tra le pipeline (scripts/common)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.anni import NOME_FILE as FILE_ANNI
+from common.anni import configure as configure_anni
+from common.anni import conform_registry, register_years, years_path
+from common.arrow_ipc import read_sidecar, sidecar_path, write_sidecar
+from common.cache import StageCache
+from common.cli import is_interactive, relocate, run_cli
+from common.dag import ESEGUITO, SALTATO, STATE_FILE, DagExecutor, Step
+from common.ingest import read_typed
+from common.instrument import Instrumenter, record_read, record_write
+from common.keys import KeyRegistry, lookup_ids, unpivot_codes
+from common.parquet_export import PartitionedWriter, metadata_path
+from common.parquet_export import enabled as parquet_enabled
+from common.profiler import print_profile, profile_file, save_profile
+
 # --- CONFIGURAZIONE ---
 FILE_INPUT_DATI = 'DNF.csv'
 DELIMITATORE = ';'
@@ -15,6 +32,28 @@ FILE_OUTPUT_ANNO = 'anno_export.csv'
 FILE_OUTPUT_REGIONE = 'regione_export.csv'
 FILE_OUTPUT_ATECO = 'ateco_export.csv'
 FILE_OUTPUT_AZIENDE = 'aziende_export.csv'
+FILE_OUTPUT_PROFILO = 'profilo_dnf.json'
+FILE_STATO_PIPELINE = STATE_FILE
+FILE_REPORT_ESECUZIONE = 'run_report.json'
+
+# Export Parquet della fact table (--parquet): parquet/report_dnf/fonte=DNF/anno=<anno>/
+DIR_PARQUET = 'parquet'
+FONTE_PARQUET = 'DNF'
+
+# Anno di riferimento: ricavato dal nome del file sorgente (es. DNF_2020.csv), altrimenti ANNO_DEFAULT
+ANNO_DEFAULT = 2019
+
+# Registro persistente delle chiavi: gli id restano stabili tra i caricamenti annuali
+# e per ogni export viene scritto anche un file *_delta.csv con le sole righe nuove/modificate
+DIR_REGISTRO = 'registro_chiavi'
+# tabella -> (colonna id, chiave naturale, attributi confrontati per rilevare modifiche)
+SCHEMA_REGISTRO = {
+    'anno': ('id_anno', ['valore'], []),
+    'regione': ('id_regione', ['nome'], []),
+    'ateco': ('id_ateco', ['settore'], []),
+    'aziende': ('id_azienda', ['nome'], ['cod_ateco', 'cod_regione']),
+    'report': ('id_report', ['cod_azienda', 'cod_anno', 'nome'], ['valore']),
+}
 
 COLONNE_GENDER_GAP = [
     'Aziende_nel_Database',
@@ -33,6 +72,27 @@ COLONNE_GENDER_GAP = [
     'Membri_del_CdA_con_eta_50_per'
 ]
 
+VALORI_NULLI = ['N.A.', 'n.d.', 'ND', '-', '..', 'n.q.', 'N/A', 'NaN', 'None', '', ' ']
+VALORI_NON_RILEVATI = ['', 'N.R.']
+AZIENDE_ESCLUSE = ['KIKO SPA', 'COFIDE ']
+
+# Tipi applicati in lettura: categorie per le dimensioni, float32 per le metriche
+DTYPE_DNF = {'Regioni': 'category', 'Settore': 'category'}
+DTYPE_DNF.update({col: 'float32' for col in COLONNE_GENDER_GAP[1:]})
+
+# Colonne lette da ciascuno step (projection pushdown): il resto di DNF.csv non viene parsato
+COLONNE_STEP = {
+    'clean_gender_gap_wide': COLONNE_GENDER_GAP,
+    'generate_dimensions': ['Regioni', 'Settore'],
+    'generate_companies': ['Aziende_nel_Database', 'Settore', 'Regioni'],
+    'generate_fact_table': COLONNE_GENDER_GAP,
+}
+
+# Cache dei DataFrame condivisa tra gli step: DNF.csv e le lookup vengono
+# parsati una sola volta per sessione e riletti solo se il file cambia.
+CACHE = StageCache()
+REGISTRO = None
+
 # --- COLORI ANSI ---
 class Colors:
     HEADER = '\033[95m'
@@ -54,6 +114,7 @@ def save_csv(df, filename):
     """
     try:
         df.to_csv(filename, index=False, lineterminator='\n')
+        record_write(filename, len(df))
         print(f"{Colors.GREEN}✅ File salvato correttamente: {filename} ({len(df)} righe){Colors.ENDC}")
         return True
     except Exception as e:
@@ -80,113 +141,241 @@ def check_file_exists(filename):
 def print_header(title):
     print("\n" + f"{Colors.HEADER}{Colors.BOLD}--- {title} ---{Colors.ENDC}")
 
+def save_parquet(df, tabella, anni, dizionario=()):
+    """
+    Export Parquet di una fact table (solo con --parquet): le partizioni degli anni di
+    `df` vengono sostituite, gli anni caricati in precedenza restano.
+    """
+    if not parquet_enabled():
+        return True
+    cartella = os.path.join(DIR_PARQUET, tabella)
+    try:
+        with PartitionedWriter(cartella, FONTE_PARQUET, dizionario) as scrittore:
+            scrittore.write(df, anni)
+        print(f"{Colors.GREEN}✅ Parquet salvato: {cartella} ({len(df)} righe){Colors.ENDC}")
+        return True
+    except Exception as e:
+        print(f"{Colors.FAIL}❌ ERRORE durante l'export Parquet in {cartella}: {e}{Colors.ENDC}")
+        return False
+
+def save_lookup(df, filename):
+    """
+    Salva una tabella di lookup (CSV di export + copia Arrow per gli step successivi)
+    e la lascia in cache.
+    """
+    if not save_csv(df, filename):
+        return False
+    write_sidecar(df, filename)
+    CACHE.put(('lookup', filename), df, [filename])
+    return True
+
+def delta_filename(filename):
+    root, ext = os.path.splitext(filename)
+    return f"{root}_delta{ext}"
+
+def anno_dnf():
+    """Anno del file DNF in lavorazione (dal nome del file, es. DNF_2020.csv)."""
+    m = re.search(r'(?<!\d)((?:19|20)\d{2})(?!\d)', os.path.basename(FILE_INPUT_DATI))
+    return int(m.group(1)) if m else ANNO_DEFAULT
+
+# --- REGISTRO CHIAVI ---
+
+def export_files():
+    """File di export associato a ciascuna tabella del registro."""
+    return {
+        'anno': FILE_OUTPUT_ANNO,
+        'regione': FILE_OUTPUT_REGIONE,
+        'ateco': FILE_OUTPUT_ATECO,
+        'aziende': FILE_OUTPUT_AZIENDE,
+        'report': FILE_OUTPUT_REPORT,
+    }
+
+def get_registry():
+    """
+    Registro chiavi della sessione. Alla prima esecuzione viene inizializzato dagli
+    export gia' presenti, cosi' gli id pubblicati finora vengono mantenuti, e gli anni
+    vengono allineati al registro condiviso (ValueError se un id_anno e' in conflitto).
+    """
+    global REGISTRO
+    if REGISTRO is None:
+        registro = KeyRegistry(DIR_REGISTRO)
+        for tabella, filename in export_files().items():
+            if registro.table(tabella) is None and os.path.exists(filename):
+                export = pd.read_csv(filename)
+                record_read(filename, len(export))
+                registro.seed(tabella, export)
+        conform_registry(registro)
+        REGISTRO = registro
+    return REGISTRO
+
+def register_members(tabella, df):
+    """
+    Registra i membri di una dimensione e salva l'export completo (tutti i membri,
+    id stabili) piu' il file delta con i soli membri nuovi o modificati.
+    """
+    id_col, key_cols, attr_cols = SCHEMA_REGISTRO[tabella]
+    registro = get_registry()
+    ids, stato = registro.upsert(tabella, df, id_col, key_cols, attr_cols)
+    registro.save()
+
+    membri = registro.members(tabella)
+    membri = membri.astype({c: 'Int64' for c in attr_cols if c.startswith('cod_')})
+    cambiati = ids[stato != KeyRegistry.INVARIATO]
+    print(f"Registro '{tabella}': {int((stato == KeyRegistry.NUOVO).sum())} nuovi, "
+          f"{int((stato == KeyRegistry.MODIFICATO).sum())} modificati, {len(membri)} totali")
+
+    filename = export_files()[tabella]
+    ok = save_lookup(membri, filename)
+    return save_csv(membri[membri[id_col].isin(cambiati)], delta_filename(filename)) and ok
+
+# --- CARICAMENTO DATI (CACHE) ---
+
+def report_rejected(report):
+    """Segnala le righe rifiutate dal parser (invece di scartarle in silenzio)."""
+    if not report.rejected_count:
+        return
+    linee = report.rejected_lines()
+    anteprima = ', '.join(str(n) for n in linee[:20]) + (' ...' if len(linee) > 20 else '')
+    print(f"{Colors.WARNING}⚠️  {report.path}: {report.rejected_count} righe malformate rifiutate"
+          f"{' (linee: ' + anteprima + ')' if linee else ''}{Colors.ENDC}")
+
+def load_dnf(colonne):
+    """
+    Colonne richieste di DNF.csv, tipizzate secondo DTYPE_DNF (da non modificare in place).
+    Se la cache contiene gia' un sovrainsieme delle colonne non si rilegge il file;
+    altrimenti si legge l'unione delle colonne e la si lascia in cache per gli step successivi.
+    """
+    chiave = ('dnf', FILE_INPUT_DATI)
+    with CACHE.lock:
+        df = CACHE.get(chiave)
+        if df is not None and set(colonne) <= set(df.columns):
+            return df[list(colonne)]
+
+        da_leggere = list(dict.fromkeys(list(df.columns if df is not None else []) + list(colonne)))
+
+        def _leggi():
+            dtype = {c: t for c, t in DTYPE_DNF.items() if c in da_leggere}
+            df_letto, report = read_typed(FILE_INPUT_DATI, dtype, usecols=da_leggere,
+                                          na_values={c: VALORI_NON_RILEVATI for c in dtype if dtype[c] == 'float32'},
+                                          delimiter=DELIMITATORE)
+            report_rejected(report)
+            return df_letto
+
+        CACHE.invalidate(chiave)
+        return CACHE.load(chiave, [FILE_INPUT_DATI], _leggi)[list(colonne)]
+
+def prefetch_dnf(steps):
+    """Legge in un'unica passata le colonne necessarie a tutti gli step indicati."""
+    colonne = []
+    for step in steps:
+        colonne.extend(COLONNE_STEP[step])
+    load_dnf(list(dict.fromkeys(colonne)))
+
+def load_gender_gap():
+    """Colonne di gender gap gia' filtrate e tipizzate (condivise da step 2 e 5)."""
+    def _prepara():
+        df = load_dnf(COLONNE_GENDER_GAP)
+        return df[~df['Aziende_nel_Database'].isin(AZIENDE_ESCLUSE)].copy()
+
+    return CACHE.load(('gender_gap', FILE_INPUT_DATI), [FILE_INPUT_DATI], _prepara)
+
+def load_lookup(filename):
+    """
+    Tabella di lookup prodotta da uno step precedente: dalla cache se ancora valida,
+    altrimenti dal file Arrow mappato in memoria (CSV solo se manca o non e' aggiornato).
+    """
+    def _leggi():
+        df = read_sidecar(filename)
+        if df is not None:
+            record_read(sidecar_path(filename), len(df))
+            return df
+        df = pd.read_csv(filename)
+        record_read(filename, len(df))
+        return df
+
+    return CACHE.load(('lookup', filename), [filename], _leggi)
+
 # --- LOGICA DI DATA ANALYSIS ---
 
 def analyze_nulls():
-    """Analisi dei valori nulli e del dominio"""
+    """Analisi dei valori nulli e del dominio (profilo a passata singola, a blocchi)"""
     print_header("1. Analisi Valori Nulli e Domini")
-    if not check_file_exists(FILE_INPUT_DATI): return
+    if not check_file_exists(FILE_INPUT_DATI): return False
 
-    valori_nulli = ['N.A.', 'n.d.', 'ND', '-', '..', 'n.q.', 'N/A', 'NaN', 'None', '', ' ']
     try:
-        df = pd.read_csv(
-            FILE_INPUT_DATI,
-            sep='[;,]', 
-            engine='python',
-            on_bad_lines='skip',
-            na_values=valori_nulli
-        )
+        profilo = profile_file(FILE_INPUT_DATI, na_values=VALORI_NULLI)
     except Exception as e:
         print(f"{Colors.FAIL}Errore lettura file: {e}{Colors.ENDC}")
-        return
+        return False
 
-    # Pulizia colonne da caratteri non validi
-    df.columns = df.columns.str.replace('"', '')
-    for col in df.columns:
-        if df[col].dtype == 'object':
-            df[col] = df[col].str.replace('"', '').str.strip()
-    
-    df = df.replace(valori_nulli, np.nan)
-
-    # Analisi NULL
-    print(f"\n{Colors.BOLD}[Analisi NULL]{Colors.ENDC}")
-    null_value = df.isnull().sum()
-    null_value_sorted = null_value[null_value > 0].sort_values(ascending=False)
-    if not null_value_sorted.empty:
-        print(null_value_sorted)
+    print(f"Dialetto rilevato: delimitatore {profilo['delimitatore']!r} (righe lette: {profilo['righe']})")
+    if profilo['righe_rifiutate']:
+        linee = profilo['linee_rifiutate']
+        anteprima = ', '.join(str(n) for n in linee[:20]) + (' ...' if len(linee) > 20 else '')
+        print(f"{Colors.WARNING}⚠️  {profilo['righe_rifiutate']} righe malformate rifiutate"
+              f"{' (linee: ' + anteprima + ')' if linee else ''}{Colors.ENDC}")
     else:
-        print(f"{Colors.GREEN}Nessun valore NULL rilevante trovato nel dataset.{Colors.ENDC}")
-
-    # Analisi DOMINIO
-    print(f"\n{Colors.BOLD}[Analisi Dominio e Range]{Colors.ENDC}")
-    for col in df.columns:
-        val_distinti = df[col].unique()
-        unique_count = len(val_distinti)
-        print(f"• Attributo: {Colors.BOLD}'{col}'{Colors.ENDC} (Distinti: {unique_count})")
-        
-        if 1 < unique_count < 10:
-            print(f"  ↪ Categorie: {val_distinti}")
-        elif pd.api.types.is_numeric_dtype(df[col]):
-            print(f"  ↪ Range: [{df[col].min()} - {df[col].max()}]")
+        print(f"{Colors.GREEN}Nessuna riga malformata.{Colors.ENDC}")
+
+    print_profile(profilo, bold=Colors.BOLD, endc=Colors.ENDC, ok=Colors.GREEN)
+
+    save_profile(profilo, FILE_OUTPUT_PROFILO)
+    print(f"\n{Colors.GREEN}✅ Profilo JSON salvato: {FILE_OUTPUT_PROFILO}{Colors.ENDC}")
+    return True
 
 
 def clean_gender_gap_wide():
     """Pulizia e salvataggio formato Wide"""
     print_header("2. Pulizia Dataset (Formato Wide)")
-    if not check_file_exists(FILE_INPUT_DATI): return
+    if not check_file_exists(FILE_INPUT_DATI): return False
 
     try:
-        df = pd.read_csv(FILE_INPUT_DATI, delimiter=DELIMITATORE, usecols=COLONNE_GENDER_GAP)
+        df_pulito = load_gender_gap()
     except Exception as e:
         print(f"{Colors.FAIL}Errore lettura file: {e}{Colors.ENDC}")
-        return
-
-    df_pulito = df.copy()
-    # Filtri specifici
-    df_pulito = df_pulito[df_pulito['Aziende_nel_Database'] != 'KIKO SPA']
-    df_pulito = df_pulito[df_pulito['Aziende_nel_Database'] != 'COFIDE ']
-
-    colonne_valori = COLONNE_GENDER_GAP[1:]
-    for col in colonne_valori:
-        df_pulito[col] = df_pulito[col].replace(['', 'N.R.'], np.nan)
-        df_pulito[col] = pd.to_numeric(df_pulito[col], errors='coerce')
+        return False
 
-    save_csv(df_pulito, FILE_OUTPUT_WIDE)
+    return save_csv(df_pulito, FILE_OUTPUT_WIDE)
 
 
 def generate_dimensions():
     """Generazione tabelle dimensionali: Anno, Regione, Ateco"""
     print_header("3. Generazione Tabelle Dimensionali")
-    if not check_file_exists(FILE_INPUT_DATI): return
+    if not check_file_exists(FILE_INPUT_DATI): return False
 
     try:
-        df = pd.read_csv(FILE_INPUT_DATI, delimiter=DELIMITATORE)
+        df = load_dnf(COLONNE_STEP['generate_dimensions'])
     except Exception as e:
         print(f"{Colors.FAIL}Errore lettura file: {e}{Colors.ENDC}")
-        return
+        return False
 
     # Anno
-    ANNO = 2019
-    anno_df = pd.DataFrame({'valore': [ANNO]})
-    anno_df['id_anno'] = range(1, len(anno_df) + 1)
-    anno_df = anno_df[['id_anno', 'valore']]
+    anno_df = pd.DataFrame({'valore': [anno_dnf()]})
 
     # Regioni
     regione_df = df[['Regioni']].drop_duplicates().sort_values(by='Regioni').reset_index(drop=True)
     regione_df.columns = ['nome']
-    regione_df['id_regione'] = range(1, len(regione_df) + 1)
-    regione_df = regione_df[['id_regione', 'nome']]
 
     # Ateco
     ateco_df = df[['Settore']].drop_duplicates().sort_values(by='Settore').reset_index(drop=True)
     ateco_df.columns = ['settore']
-    ateco_df['id_ateco'] = range(1, len(ateco_df) + 1)
-    ateco_df = ateco_df[['id_ateco', 'settore']]
 
+    # L'id dell'anno viene dal registro condiviso con MUR ed EUROSTATS
+    try:
+        lookup, nuovi = register_years([anno_dnf()])
+        conform_registry(get_registry(), lookup)
+    except (ValueError, OSError) as e:
+        print(f"{Colors.FAIL}❌ Registro degli anni: {e}{Colors.ENDC}")
+        return False
+    if nuovi:
+        print(f"{Colors.WARNING}⚠️  Anno {anno_dnf()} aggiunto al registro condiviso "
+              f"{os.path.normpath(years_path())} con un id nuovo.{Colors.ENDC}")
+
+    # I membri gia' noti mantengono il loro id, i nuovi vengono accodati
     print(f"Salvataggio dimensioni...")
-    save_csv(anno_df, FILE_OUTPUT_ANNO)
-    save_csv(regione_df, FILE_OUTPUT_REGIONE)
-    save_csv(ateco_df, FILE_OUTPUT_ATECO)
+    esiti = [register_members(tabella, membri)
+             for tabella, membri in (('anno', anno_df), ('regione', regione_df), ('ateco', ateco_df))]
+    return all(esiti)
 
 
 def generate_companies():
@@ -195,34 +384,30 @@ def generate_companies():
     
     needed_files = [FILE_INPUT_DATI, FILE_OUTPUT_REGIONE, FILE_OUTPUT_ATECO]
     for f in needed_files:
-        if not check_file_exists(f): return
+        if not check_file_exists(f): return False
 
     try:
-        df_raw = pd.read_csv(FILE_INPUT_DATI, delimiter=DELIMITATORE)
-        df_raw.rename(columns={'Aziende_nel_Database': 'nome_azienda'}, inplace=True)
+        df_raw = load_dnf(COLONNE_STEP['generate_companies']).rename(columns={'Aziende_nel_Database': 'nome_azienda'})
         
-        regione_df = pd.read_csv(FILE_OUTPUT_REGIONE)
-        ateco_df = pd.read_csv(FILE_OUTPUT_ATECO)
+        regione_df = load_lookup(FILE_OUTPUT_REGIONE)
+        ateco_df = load_lookup(FILE_OUTPUT_ATECO)
+        get_registry()
     except Exception as e:
         print(f"{Colors.FAIL}Errore lettura file: {e}{Colors.ENDC}")
-        return
+        return False
 
     # Filter
     aziende_df = df_raw[['nome_azienda', 'Settore', 'Regioni']].drop_duplicates()
-    aziende_df = aziende_df[aziende_df['nome_azienda'] != 'KIKO SPA']
-    aziende_df = aziende_df[aziende_df['nome_azienda'] != 'COFIDE ']
+    aziende_df = aziende_df[~aziende_df['nome_azienda'].isin(AZIENDE_ESCLUSE)]
 
-    # Merge
-    aziende_df = aziende_df.merge(regione_df, left_on='Regioni', right_on='nome', how='left')
-    aziende_df = aziende_df.merge(ateco_df, left_on='Settore', right_on='settore', how='left')
+    # Foreign keys risolte sui codici delle categorie (nessun merge su stringhe)
+    aziende_df = pd.DataFrame({
+        'nome': aziende_df['nome_azienda'].to_numpy(),
+        'cod_ateco': lookup_ids(aziende_df['Settore'], ateco_df['settore'], ateco_df['id_ateco']),
+        'cod_regione': lookup_ids(aziende_df['Regioni'], regione_df['nome'], regione_df['id_regione']),
+    })
 
-    # Finalize
-    aziende_final_df = aziende_df[['nome_azienda', 'id_ateco', 'id_regione']].copy()
-    aziende_final_df.columns = ['nome', 'cod_ateco', 'cod_regione']
-    aziende_final_df['id_azienda'] = range(1, len(aziende_final_df) + 1)
-    aziende_final_df = aziende_final_df[['id_azienda', 'nome', 'cod_ateco', 'cod_regione']]
-
-    save_csv(aziende_final_df, FILE_OUTPUT_AZIENDE)
+    return register_members('aziende', aziende_df)
 
 
 def generate_fact_table():
@@ -231,60 +416,123 @@ def generate_fact_table():
     
     needed_files = [FILE_INPUT_DATI, FILE_OUTPUT_AZIENDE, FILE_OUTPUT_ANNO]
     for f in needed_files:
-        if not check_file_exists(f): return
+        if not check_file_exists(f): return False
 
     try:
-        df_raw = pd.read_csv(FILE_INPUT_DATI, delimiter=DELIMITATORE)
-        df_raw.rename(columns={'Aziende_nel_Database': 'nome_azienda'}, inplace=True)
-        
-        colonne_gender_target = COLONNE_GENDER_GAP.copy()
-        colonne_gender_target[0] = 'nome_azienda'
+        df_gender = load_gender_gap().rename(columns={'Aziende_nel_Database': 'nome_azienda'})
 
-        aziende_lookup = pd.read_csv(FILE_OUTPUT_AZIENDE)
-        anno_lookup = pd.read_csv(FILE_OUTPUT_ANNO)
+        aziende_lookup = load_lookup(FILE_OUTPUT_AZIENDE)
+        anno_lookup = load_lookup(FILE_OUTPUT_ANNO)
+        registro = get_registry()
     except Exception as e:
         print(f"{Colors.FAIL}Errore lettura file: {e}{Colors.ENDC}")
-        return
+        return False
 
-    # Prepare
-    df_gender = df_raw[colonne_gender_target].copy()
-    df_gender = df_gender[df_gender['nome_azienda'] != 'KIKO SPA']
-    df_gender = df_gender[df_gender['nome_azienda'] != 'COFIDE ']
+    colonne_valori = COLONNE_GENDER_GAP[1:]
 
-    colonne_valori = colonne_gender_target[1:]
-    for col in colonne_valori:
-        df_gender[col] = df_gender[col].replace(['', 'N.R.'], np.nan)
-        df_gender[col] = pd.to_numeric(df_gender[col], errors='coerce')
+    # FK azienda risolta una volta per azienda (formato wide), poi propagata come intero
+    df_gender = df_gender.assign(cod_azienda=lookup_ids(
+        df_gender['nome_azienda'], aziende_lookup['nome'], aziende_lookup['id_azienda']
+    ).astype('Int32'))
 
     # Unpivot
-    df_unpivoted = pd.melt(
-        df_gender,
-        id_vars=['nome_azienda'],
-        value_vars=colonne_valori,
-        var_name='nome_metrica',
-        value_name='valore'
-    )
-    df_unpivoted.dropna(subset=['valore'], inplace=True)
-
-    # Merge FKs
-    df_final = df_unpivoted.merge(
-        aziende_lookup[['id_azienda', 'nome']],
-        left_on='nome_azienda',
-        right_on='nome',
-        how='left',
-        suffixes=('_metrica', '_azienda')
-    )
-
-    id_anno_val = anno_lookup['id_anno'].iloc[0]
-    df_final['cod_anno'] = id_anno_val
+    df_unpivoted = unpivot_codes(df_gender, colonne_valori, ['cod_azienda'])
+    df_unpivoted = df_unpivoted[df_unpivoted['valore'].notna()]
 
     # Finalize
-    report_dnf_final_df = df_final[['nome_metrica', 'id_azienda', 'valore', 'cod_anno']].copy()
-    report_dnf_final_df.columns = ['nome', 'cod_azienda', 'valore', 'cod_anno']
-    report_dnf_final_df['id_report'] = range(1, len(report_dnf_final_df) + 1)
-    report_dnf_final_df = report_dnf_final_df[['id_report', 'nome', 'cod_azienda', 'valore', 'cod_anno']]
+    id_anno = anno_lookup.loc[anno_lookup['valore'] == anno_dnf(), 'id_anno']
+    if id_anno.empty:
+        print(f"{Colors.FAIL}❌ Anno {anno_dnf()} assente in {FILE_OUTPUT_ANNO}: rigenera le dimensioni.{Colors.ENDC}")
+        return False
+    report_dnf_final_df = pd.DataFrame({
+        'nome': df_unpivoted['metrica'].array,
+        'cod_azienda': df_unpivoted['cod_azienda'].array,
+        'valore': df_unpivoted['valore'].to_numpy(),
+        'cod_anno': np.int32(id_anno.iloc[0]),
+    })
+
+    # id_report stabili: (azienda, anno, metrica) gia' esportati mantengono il loro id
+    id_col, key_cols, attr_cols = SCHEMA_REGISTRO['report']
+    ids, stato = registro.upsert('report', report_dnf_final_df, id_col, key_cols, attr_cols)
+    registro.save()
+    report_dnf_final_df.insert(0, 'id_report', ids)
+    colonne = ['id_report', 'nome', 'cod_azienda', 'valore', 'cod_anno']
+    report_dnf_final_df = report_dnf_final_df[colonne]
+    print(f"Registro 'report': {int((stato == KeyRegistry.NUOVO).sum())} nuove righe, "
+          f"{int((stato == KeyRegistry.MODIFICATO).sum())} modificate")
+
+    # Export completo: tutte le righe del registro (anche degli anni caricati in precedenza), come per le dimensioni
+    report_completo = registro.members('report')[colonne].astype({'cod_azienda': 'Int64', 'cod_anno': 'Int64'})
+    ok = save_csv(report_completo, FILE_OUTPUT_REPORT)
+    ok = save_csv(report_dnf_final_df[stato != KeyRegistry.INVARIATO], delta_filename(FILE_OUTPUT_REPORT)) and ok
+    # Metriche codificate a dizionario: i lettori filtrano per nome senza decodificare le stringhe
+    return save_parquet(report_dnf_final_df, 'report_dnf', anno_dnf(), dizionario=['nome']) and ok
+
+
+# --- PIPELINE (GRAFO DEGLI STEP) ---
+
+def build_pipeline():
+    """
+    Grafo degli step con input/output dichiarati: uno step viene saltato se codice e
+    input non sono cambiati dall'ultima esecuzione. Pulizia wide e dimensioni non
+    dipendono l'una dall'altra e possono girare in parallelo.
+    """
+    return [
+        Step('analyze_nulls', analyze_nulls,
+             inputs=[FILE_INPUT_DATI], outputs=[FILE_OUTPUT_PROFILO]),
+        Step('clean_gender_gap_wide', clean_gender_gap_wide,
+             inputs=[FILE_INPUT_DATI], outputs=[FILE_OUTPUT_WIDE]),
+        Step('generate_dimensions', generate_dimensions,
+             inputs=[FILE_INPUT_DATI, years_path()], outputs=[FILE_OUTPUT_ANNO, FILE_OUTPUT_REGIONE, FILE_OUTPUT_ATECO]),
+        Step('generate_companies', generate_companies, deps=['generate_dimensions'],
+             inputs=[FILE_INPUT_DATI, FILE_OUTPUT_REGIONE, FILE_OUTPUT_ATECO], outputs=[FILE_OUTPUT_AZIENDE]),
+        Step('generate_fact_table', generate_fact_table, deps=['generate_companies', 'generate_dimensions'],
+             inputs=[FILE_INPUT_DATI, FILE_OUTPUT_AZIENDE, FILE_OUTPUT_ANNO],
+             outputs=[FILE_OUTPUT_REPORT] + ([metadata_path(os.path.join(DIR_PARQUET, 'report_dnf'))]
+                                             if parquet_enabled() else [])),
+    ]
+
+def run_pipeline(steps=None, force=False, jobs=2):
+    """
+    Esegue la pipeline (o gli step indicati con le loro dipendenze) saltando quelli
+    aggiornati; tempi, memoria e I/O di ogni step finiscono in FILE_REPORT_ESECUZIONE.
+    """
+    strumenti = Instrumenter('DNF', FILE_REPORT_ESECUZIONE)
+    executor = DagExecutor(build_pipeline(), state_file=FILE_STATO_PIPELINE, jobs=jobs, instrument=strumenti)
+    _, _, da_eseguire = executor.plan(steps, force)
+    # Un'unica lettura di DNF.csv per tutti gli step che verranno eseguiti
+    colonne_step = [s for s in da_eseguire if s in COLONNE_STEP]
+    if colonne_step:
+        with strumenti.step('prefetch_dnf'):
+            prefetch_dnf(colonne_step)
+    return executor.run(steps, force)
+
+
+# --- RIGA DI COMANDO ---
 
-    save_csv(report_dnf_final_df, FILE_OUTPUT_REPORT)
+def run_batch(steps=None, force=False, jobs=2):
+    """Esecuzione senza interazione (CLI e run_all.py): restituisce gli esiti per step."""
+    return run_pipeline(steps, force, jobs)
+
+def configura_percorsi(input_path=None, output_dir=None):
+    """
+    Percorsi per l'esecuzione da riga di comando; restituisce il file sorgente.
+    Con `output_dir` anche il registro condiviso degli anni viene tenuto (e creato) li'.
+    """
+    global FILE_INPUT_DATI
+    if input_path:
+        FILE_INPUT_DATI = input_path
+    relocate(globals(), ['FILE_OUTPUT_WIDE', 'FILE_OUTPUT_REPORT', 'FILE_OUTPUT_ANNO', 'FILE_OUTPUT_REGIONE',
+                         'FILE_OUTPUT_ATECO', 'FILE_OUTPUT_AZIENDE', 'FILE_OUTPUT_PROFILO', 'DIR_REGISTRO',
+                         'DIR_PARQUET', 'FILE_STATO_PIPELINE', 'FILE_REPORT_ESECUZIONE'], output_dir)
+    configure_anni(os.path.join(output_dir, FILE_ANNI) if output_dir else None)
+    return FILE_INPUT_DATI
+
+def main_cli(argv=None):
+    """Esecuzione senza menu (es. da cron): python AnalyzeDNF.py --steps 3,4,5 --quiet"""
+    return run_cli(argv, 'AnalyzeDNF.py', "Pipeline ETL del dataset DNF (gender gap aziende).",
+                   [s.name for s in build_pipeline()], FILE_INPUT_DATI, Colors,
+                   configura_percorsi, run_batch)
 
 
 # --- MENU INTERATTIVO ---
@@ -301,7 +549,8 @@ def main_menu():
         print(f"{Colors.BLUE}4.{Colors.ENDC} Genera Tabella Aziende")
         print(f"{Colors.BLUE}5.{Colors.ENDC} Genera Report (Export Fact Table)")
         print("-" * 50)
-        print(f"{Colors.GREEN}9. --> ESEGUI TUTTO (Pipeline Completa){Colors.ENDC}")
+        print(f"{Colors.GREEN}9. --> ESEGUI TUTTO (Pipeline Completa, salta gli step aggiornati){Colors.ENDC}")
+        print(f"{Colors.YELLOW}F. --> ESEGUI TUTTO forzando la rigenerazione{Colors.ENDC}")
         print(f"{Colors.FAIL}0. Esci{Colors.ENDC}")
         
         scelta = input(f"\n{Colors.BOLD}Seleziona un'operazione (0-9):{Colors.ENDC} ")
@@ -331,20 +580,17 @@ def main_menu():
                 generate_fact_table()
                 input(f"\n{Colors.CYAN}Premi INVIO per tornare al menu...{Colors.ENDC}")
         
-        elif scelta == '9':
-            if confirm_action("ESECUZIONE COMPLETA PIPELINE"):
+        elif scelta in ('9', 'f', 'F'):
+            forza = scelta in ('f', 'F')
+            if confirm_action("ESECUZIONE COMPLETA PIPELINE" + (" (forzata)" if forza else "")):
                 print(f"\n{Colors.GOLD if hasattr(Colors, 'GOLD') else Colors.YELLOW}🚀 Avvio pipeline completa...{Colors.ENDC}")
                 try:
-                    analyze_nulls()
-                    print("-" * 30)
-                    clean_gender_gap_wide()
-                    print("-" * 30)
-                    generate_dimensions()
-                    print("-" * 30)
-                    generate_companies()
-                    print("-" * 30)
-                    generate_fact_table()
-                    print(f"\n{Colors.GREEN}{Colors.BOLD}✨ PIPELINE COMPLETATA CON SUCCESSO! ✨{Colors.ENDC}")
+                    esiti = run_pipeline(force=forza)
+                    if all(esito in (ESEGUITO, SALTATO) for esito, _ in esiti.values()):
+                        print(f"\n{Colors.GREEN}{Colors.BOLD}✨ PIPELINE COMPLETATA CON SUCCESSO! ✨{Colors.ENDC}")
+                    else:
+                        falliti = [nome for nome, (esito, _) in esiti.items() if esito not in (ESEGUITO, SALTATO)]
+                        print(f"\n{Colors.FAIL}❌ Step non completati: {', '.join(falliti)}{Colors.ENDC}")
                 except Exception as e:
                     print(f"\n{Colors.FAIL}❌ Errore critico durante la pipeline: {e}{Colors.ENDC}")
                 input(f"\n{Colors.CYAN}Premi INVIO per tornare al menu...{Colors.ENDC}")
@@ -357,4 +603,7 @@ def main_menu():
             time.sleep(1)
 
 if __name__ == "__main__":
-    main_menu()
+    if is_interactive():
+        main_menu()
+    else:
+        sys.exit(main_cli())
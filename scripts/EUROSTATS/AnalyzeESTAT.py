@@ -1,13 +1,65 @@
 import pandas as pd
 import numpy as np
+import multiprocessing
 import os
+import shutil
+import tempfile
 import time
 import sys
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+# Moduli condivisi tra le pipeline (scripts/common)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.anni import NOME_FILE as FILE_ANNI
+from common.anni import configure as configure_anni
+from common.anni import register_years, years_path
+from common.cli import is_interactive, relocate, run_cli
+from common.dag import ESEGUITO, SALTATO, STATE_FILE, DagExecutor, Step
+from common.instrument import Instrumenter, record_read, record_rows, record_write
+from common.keys import lookup_ids
+from common.parquet_export import fact_writer, metadata_path, update_metadata
+from common.parquet_export import enabled as parquet_enabled
+from common.profiler import profile_sdmx, save_profile
+from common.sdmx import is_sdmx_tsv, read_sdmx_tsv
+from common.spill import HAS_PYARROW as SPILL_DISPONIBILE
+from common.spill import SpillStore
 
 # --- Configurazione File ---
 FILE_ESTAT = 'estat.csv'
-FILE_ANNO_LOOKUP = 'anno_export.csv'
-DELIMITATORE_INIZIALE = '\t'
+FILE_OUTPUT_TIPO_MISURA = 'tipo_misura_import_full.csv'
+FILE_OUTPUT_METODO_AGGR = 'metodo_aggr_import_full.csv'
+FILE_OUTPUT_GEO = 'geo_import_full.csv'
+# Anni: id dal registro condiviso con DNF e MUR (common/anni.py); l'export ne e' una copia completa
+FILE_OUTPUT_ANNO = 'anno_import_full.csv'
+FILE_OUTPUT_OBSERVATION = 'observation_import_full.csv'
+# Profilo del file sorgente scritto dallo step 1, uno per dataset (es. profilo_estat.json)
+FILE_OUTPUT_PROFILO = 'profilo_{dataset}.json'
+FILE_STATO_PIPELINE = STATE_FILE
+FILE_REPORT_ESECUZIONE = 'run_report.json'
+
+# --- Scrittura delle osservazioni ---
+RIGHE_PER_BLOCCO = 500_000
+COLONNE_OBSERVATION = ['id_observation', 'cod_geo', 'cod_misura', 'cod_anno', 'cod_aggr', 'valore', 'flag']
+# Colonna 'nome' (geo_misura_aggr) derivata dalle chiavi: solo per consultazione, il fatto usa le FK intere
+INCLUDI_NOME = False
+# Export Parquet (--parquet): parquet/observation/fonte=<dataset>/anno=<anno>/, flag e nome codificati a dizionario
+DIR_PARQUET = 'parquet'
+COLONNE_DIZIONARIO = ['flag', 'nome']
+
+# --- Memoria ---
+# Oltre questo totale (MB) gli intermedi piu' grandi passano su file Feather memory-mapped (richiede pyarrow).
+# None = nessun limite; da riga di comando: --memory-budget MB
+BUDGET_MEMORIA_MB = None
+
+# --- Dimensioni SDMX ---
+# Metodo di aggregazione = freq_unit; tipo misura = tutte le altre dimensioni tranne geo (es. wstatus_age)
+DIMENSIONI_AGGR = ['freq', 'unit']
+DIMENSIONE_GEO = 'geo'
+
+# --- Modalita' multi-dataset (--input <cartella>) ---
+PROCESSI_DATASET = os.cpu_count() or 1
+ESTENSIONI_DATASET = ('.gz', '.bz2', '.xz', '.zst', '.tsv', '.csv', '.txt')
 
 class Colors:
     """Codici ANSI per output colorato nel terminale."""
@@ -21,14 +73,128 @@ class Colors:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
+# --- CHIAVI E OSSERVAZIONI (comuni a dataset singolo e multi-dataset) ---
+
+def series_keys(dims):
+    """
+    Chiavi dimensionali di ogni serie dalle dimensioni SDMX (una riga per serie):
+    tipo_misura_valore, metodo_aggr_nome e geo, con 'NA' al posto dei valori mancanti.
+    """
+    def unisci(colonne):
+        if not colonne:
+            return pd.Series('NA', index=dims.index, dtype=str)
+        valore = dims[colonne[0]].fillna('NA').astype(str)
+        for col in colonne[1:]:
+            valore = valore + '_' + dims[col].fillna('NA').astype(str)
+        return valore
+
+    misura = [c for c in dims.columns if c not in DIMENSIONI_AGGR and c != DIMENSIONE_GEO]
+    return pd.DataFrame({
+        'tipo_misura_valore': unisci(misura),
+        'metodo_aggr_nome': unisci([c for c in DIMENSIONI_AGGR if c in dims.columns]),
+        'geo': unisci([DIMENSIONE_GEO] if DIMENSIONE_GEO in dims.columns else []),
+    })
+
+def conform_years(anni):
+    """
+    Id degli `anni` dal registro condiviso, dove quelli mancanti vengono aggiunti.
+    Restituisce il registro completo (salvato in FILE_OUTPUT_ANNO).
+    """
+    anno_lookup, nuovi = register_years(anni)
+    if nuovi:
+        print(f"{Colors.WARNING}⚠️ Anni aggiunti al registro condiviso {os.path.normpath(years_path())}: "
+              f"{', '.join(map(str, nuovi))}{Colors.ENDC}")
+    anno_lookup.to_csv(FILE_OUTPUT_ANNO, index=False)
+    record_write(FILE_OUTPUT_ANNO, len(anno_lookup))
+    print(f"✅ Salvato '{FILE_OUTPUT_ANNO}' ({len(anno_lookup)} righe)")
+    return anno_lookup
+
+def observation_columns(includi_nome=False):
+    return COLONNE_OBSERVATION[:1] + (['nome'] if includi_nome else []) + COLONNE_OBSERVATION[1:]
+
+def iter_observations(serie_df, valori, flag, cod_anni, primo_id=1, righe_per_blocco=None):
+    """
+    Genera le osservazioni (formato long) a blocchi di al piu' `righe_per_blocco` righe,
+    nell'ordine di pd.melt: un anno dopo l'altro, le serie nell'ordine del file.
+    `serie_df` ha le FK di ogni serie (cod_geo, cod_misura, cod_aggr e, se presente, nome),
+    `valori` e `flag` sono matrici serie x anni, `cod_anni` l'id_anno di ogni colonna.
+    id_observation parte da `primo_id` e prosegue da un blocco all'altro.
+    """
+    righe_per_blocco = righe_per_blocco or RIGHE_PER_BLOCCO
+    n_serie = len(serie_df)
+    prossimo_id = primo_id
+    for j, cod_anno in enumerate(cod_anni):
+        for inizio in range(0, n_serie, righe_per_blocco):
+            fine = min(inizio + righe_per_blocco, n_serie)
+            serie = serie_df.iloc[inizio:fine]
+            blocco = pd.DataFrame({
+                'id_observation': np.arange(prossimo_id, prossimo_id + fine - inizio),
+                'cod_geo': serie['cod_geo'].array,
+                'cod_misura': serie['cod_misura'].array,
+                'cod_anno': np.full(fine - inizio, cod_anno, dtype=np.int64),
+                'cod_aggr': serie['cod_aggr'].array,
+                'valore': valori[inizio:fine, j],
+                'flag': flag[inizio:fine, j],
+            })
+            if 'nome' in serie_df.columns:
+                blocco.insert(1, 'nome', serie['nome'].to_numpy())
+            yield blocco
+            prossimo_id += fine - inizio
+
+def parquet_dir():
+    return os.path.join(DIR_PARQUET, 'observation')
+
+def parquet_outputs():
+    """Output aggiuntivo dello step 4 con --parquet: il `_metadata` del dataset."""
+    return [metadata_path(parquet_dir())] if parquet_enabled() else []
+
+def save_dataset_profile(profilo, nome):
+    """Salva il profilo del dataset `nome` (common/profiler.py) letto dallo step 1."""
+    filename = FILE_OUTPUT_PROFILO.format(dataset=nome)
+    save_profile(profilo, filename)
+    print(f"✅ Profilo salvato: {filename}")
+
+class _Intermedio:
+    """Attributo di EuroStatsETL conservato nello SpillStore dell'istanza (None = assente)."""
+
+    def __set_name__(self, owner, nome):
+        self.nome = nome
+
+    def __get__(self, istanza, owner=None):
+        if istanza is None:
+            return self
+        return istanza.intermedi.get(self.nome)
+
+    def __set__(self, istanza, valore):
+        istanza.intermedi.put(self.nome, valore)
+
 class EuroStatsETL:
+    """
+    Pipeline a dataset singolo. Gli intermedi passano da uno step all'altro attraverso
+    uno SpillStore: oltre BUDGET_MEMORIA_MB i piu' grandi vengono scaricati su file
+    Feather e riletti (memory map) dallo step che ne ha bisogno. Nella pipeline completa
+    ogni step rilascia gli intermedi che nessuno step successivo usa; gli step eseguiti
+    singolarmente dal menu li conservano, cosi' si possono ripetere.
+    """
+    df_all = _Intermedio()
+    tipo_misura_df = _Intermedio()
+    metodo_aggr_df = _Intermedio()
+    geo_df = _Intermedio()
+    serie_df = _Intermedio()
+    valori = _Intermedio()
+    flag = _Intermedio()
+
     def __init__(self):
-        self.df_all = None
-        self.tipo_misura_df = None
-        self.metodo_aggr_df = None
-        self.df_long = None
-        self.observation_df = None
+        self.intermedi = SpillStore(BUDGET_MEMORIA_MB)
         self.colonne_anno = []
+        self.dimensioni = []
+        self.rilascia_intermedi = False
+
+    def _rilascia(self, *nomi):
+        if not self.rilascia_intermedi:
+            return
+        self.intermedi.release(*nomi)
+        print(f"Memoria liberata: {', '.join(nomi)}")
 
     def step_1_load_and_clean(self):
         print(f"{Colors.HEADER}--- 1. Caricamento Dati e Pulizia ---{Colors.ENDC}")
@@ -38,34 +204,30 @@ class EuroStatsETL:
                  return False
 
             print(f"Leggendo {FILE_ESTAT}...")
-            df = pd.read_csv(FILE_ESTAT, delimiter=DELIMITATORE_INIZIALE, encoding='latin1')
-            
-            # Gestione colonne composite
-            composite_col = df.columns[0]
-            df.rename(columns={composite_col: 'DIM_COMPOSITA'}, inplace=True)
-            
-            print("Separazione colonne composite...")
-            df[['freq', 'wstatus', 'age', 'unit', 'geo']] = df['DIM_COMPOSITA'].str.split(',', expand=True)
-            self.df_all = df.drop(columns=['DIM_COMPOSITA']).copy()
-            self.df_all['geo'] = self.df_all['geo'].str.replace(r'\\TIME_PERIOD', '', regex=True)
-            
-            # Pulizia Header
-            self.df_all.columns = self.df_all.columns.str.strip()
-            
+            # Chiave composita, valori e flag separati in un solo passaggio vettoriale (common/sdmx.py)
+            tabella = read_sdmx_tsv(FILE_ESTAT)
+            self.dimensioni = list(tabella.dims.columns)
+
             # Identificazione colonne anno
-            self.colonne_anno = [str(col) for col in self.df_all.columns if str(col).isdigit() and len(str(col)) == 4]
+            indici_anno = [i for i, p in enumerate(tabella.periodi) if p.isdigit() and len(p) == 4]
+            self.colonne_anno = [tabella.periodi[i] for i in indici_anno]
+            flag = tabella.flag[:, indici_anno]
             print(f"✅ Trovate {len(self.colonne_anno)} colonne anno.")
-            
-            # Pulizia dati
-            print("Pulizia dati numerici e rimozione flag...")
-            for col in self.colonne_anno:
-                # Rimuovi codici errore 'b', 'u'
-                self.df_all[col] = self.df_all[col].astype(str).str.replace(r'\s+[bu]', '', regex=True)
-                # Sostituisci ':' con NaN
-                self.df_all[col] = self.df_all[col].replace(':', np.nan)
-                # Conversione a numerico
-                self.df_all[col] = pd.to_numeric(self.df_all[col], errors='coerce')
-                
+
+            # Flag di osservazione (b, u, e, p, ...): conservati in una colonna a parte
+            codici, conteggi = np.unique(flag[flag != ''], return_counts=True)
+            if len(codici):
+                print("Flag di osservazione: " + ', '.join(f"{f}={n}" for f, n in zip(codici, conteggi)))
+            if tabella.non_numerici:
+                print(f"{Colors.WARNING}⚠️ {tabella.non_numerici} valori non numerici trattati come mancanti.{Colors.ENDC}")
+            # Profilo (nulli, range, distinti, flag) dalla tabella gia' letta: nessuna seconda lettura
+            save_dataset_profile(profile_sdmx(tabella, FILE_ESTAT), dataset_name(FILE_ESTAT))
+
+            # Dimensioni in un DataFrame (una riga per serie); valori e flag restano matrici serie x anni
+            self.df_all = tabella.dims
+            self.valori = tabella.valori[:, indici_anno]
+            self.flag = flag
+            record_rows(righe_out=len(tabella))
             print(f"{Colors.GREEN}✅ Step 1 Completato con successo.{Colors.ENDC}")
             return True
             
@@ -74,29 +236,52 @@ class EuroStatsETL:
             return False
 
     def step_2_prepare_dimensions(self):
-        if self.df_all is None:
+        df_all = self.df_all
+        if df_all is None:
              print(f"{Colors.WARNING}⚠️ Esegui prima lo Step 1.{Colors.ENDC}")
              return False
              
         print(f"\n{Colors.HEADER}--- 2. Preparazione Tabelle Dimensionali ---{Colors.ENDC}")
         
         try:
+            chiavi = series_keys(df_all[self.dimensioni])
+
             # Tipo Misura
-            self.df_all['tipo_misura_valore'] = self.df_all['wstatus'].fillna('NA').astype(str) + '_' + self.df_all['age'].fillna('NA').astype(str)
-            self.tipo_misura_df = self.df_all[['tipo_misura_valore']].drop_duplicates().reset_index(drop=True)
-            self.tipo_misura_df.columns = ['valore']
-            self.tipo_misura_df['id_misura'] = range(1, len(self.tipo_misura_df) + 1)
-            self.tipo_misura_df.to_csv('tipo_misura_import_full.csv', index=False)
-            print(f"✅ Salvato 'tipo_misura_import_full.csv'")
+            df_all['tipo_misura_valore'] = chiavi['tipo_misura_valore']
+            tipo_misura_df = df_all[['tipo_misura_valore']].drop_duplicates().reset_index(drop=True)
+            tipo_misura_df.columns = ['valore']
+            tipo_misura_df['id_misura'] = range(1, len(tipo_misura_df) + 1)
+            # Stesso schema della modalita' multi-dataset: il tipo misura e' identificato da (dataset, valore)
+            tipo_misura_df['dataset'] = dataset_name(FILE_ESTAT)
+            tipo_misura_df.to_csv(FILE_OUTPUT_TIPO_MISURA, index=False)
+            record_write(FILE_OUTPUT_TIPO_MISURA, len(tipo_misura_df))
+            print(f"✅ Salvato '{FILE_OUTPUT_TIPO_MISURA}'")
 
             # Metodo Aggr
-            self.df_all['metodo_aggr_nome'] = self.df_all['freq'].fillna('NA').astype(str) + '_' + self.df_all['unit'].fillna('NA').astype(str)
-            self.metodo_aggr_df = self.df_all[['metodo_aggr_nome']].drop_duplicates().reset_index(drop=True)
-            self.metodo_aggr_df.columns = ['nome']
-            self.metodo_aggr_df['id_aggr'] = range(1, len(self.metodo_aggr_df) + 1)
-            self.metodo_aggr_df.to_csv('metodo_aggr_import_full.csv', index=False)
-            print(f"✅ Salvato 'metodo_aggr_import_full.csv'")
-            
+            df_all['metodo_aggr_nome'] = chiavi['metodo_aggr_nome']
+            metodo_aggr_df = df_all[['metodo_aggr_nome']].drop_duplicates().reset_index(drop=True)
+            metodo_aggr_df.columns = ['nome']
+            metodo_aggr_df['id_aggr'] = range(1, len(metodo_aggr_df) + 1)
+            metodo_aggr_df.to_csv(FILE_OUTPUT_METODO_AGGR, index=False)
+            record_write(FILE_OUTPUT_METODO_AGGR, len(metodo_aggr_df))
+            print(f"✅ Salvato '{FILE_OUTPUT_METODO_AGGR}'")
+
+            # Geo (paese / area)
+            df_all['geo_codice'] = chiavi['geo']
+            geo_df = df_all[['geo_codice']].drop_duplicates().reset_index(drop=True)
+            geo_df.columns = ['codice']
+            geo_df['id_geo'] = range(1, len(geo_df) + 1)
+            geo_df = geo_df[['id_geo', 'codice']]
+            geo_df.to_csv(FILE_OUTPUT_GEO, index=False)
+            record_write(FILE_OUTPUT_GEO, len(geo_df))
+            record_rows(righe_in=len(df_all))
+            print(f"✅ Salvato '{FILE_OUTPUT_GEO}'")
+
+            # Le dimensioni originali restano: lo step si puo' ripetere, lo step 3 le rilascia
+            self.df_all = df_all
+            self.tipo_misura_df = tipo_misura_df
+            self.metodo_aggr_df = metodo_aggr_df
+            self.geo_df = geo_df
             print(f"{Colors.GREEN}✅ Step 2 Completato.{Colors.ENDC}")
             return True
         except Exception as e:
@@ -104,72 +289,435 @@ class EuroStatsETL:
             return False
 
     def step_3_unpivot(self):
-        if self.df_all is None:
+        """
+        Prepara l'unpivot: le chiavi (FK di geo, misura e aggregazione) vengono risolte una
+        volta per serie, non per osservazione. Le righe long vengono generate a blocchi
+        nello step 4 (iter_observations) e scritte man mano, senza tenere in memoria la
+        tabella long completa.
+        """
+        df_all, geo_df = self.df_all, self.geo_df
+        if df_all is None or geo_df is None:
              print(f"{Colors.WARNING}⚠️ Esegui prima gli step precedenti.{Colors.ENDC}")
              return False
 
         print(f"\n{Colors.HEADER}--- 3. Esecuzione Unpivot (Wide -> Long) ---{Colors.ENDC}")
-        colonne_id = ['geo', 'tipo_misura_valore', 'metodo_aggr_nome']
         
         try:
-            print("Esecuzione melt...")
-            self.df_long = pd.melt(
-                self.df_all,
-                id_vars=colonne_id,
-                value_vars=self.colonne_anno,
-                var_name='ANNO_valore',
-                value_name='valore_misurato'
-            )
-            self.df_long.dropna(subset=['tipo_misura_valore', 'metodo_aggr_nome'], inplace=True)
-            print(f"{Colors.GREEN}✅ Step 3 Completato. Righe ottenute: {len(self.df_long)}{Colors.ENDC}")
+            print("Codifica delle chiavi per serie...")
+            tipo_misura_df, metodo_aggr_df = self.tipo_misura_df, self.metodo_aggr_df
+            serie_df = pd.DataFrame({
+                'cod_geo': lookup_ids(df_all['geo_codice'], geo_df['codice'], geo_df['id_geo']),
+                'cod_misura': lookup_ids(df_all['tipo_misura_valore'], tipo_misura_df['valore'],
+                                         tipo_misura_df['id_misura']),
+                'cod_aggr': lookup_ids(df_all['metodo_aggr_nome'], metodo_aggr_df['nome'],
+                                       metodo_aggr_df['id_aggr']),
+            })
+            if INCLUDI_NOME:
+                serie_df.insert(0, 'nome', (df_all['geo_codice'] + '_' + df_all['tipo_misura_valore']
+                                            + '_' + df_all['metodo_aggr_nome']).to_numpy(dtype=object))
+            righe = len(serie_df) * len(self.colonne_anno)
+            record_rows(righe_in=len(df_all))
+            self.serie_df = serie_df
+            # Le dimensioni sono gia' su file e lo step 4 usa solo le FK delle serie
+            del df_all, geo_df, tipo_misura_df, metodo_aggr_df
+            self._rilascia('df_all', 'tipo_misura_df', 'metodo_aggr_df', 'geo_df')
+            print(f"{Colors.GREEN}✅ Step 3 Completato. Righe da generare: {righe}{Colors.ENDC}")
             return True
         except Exception as e:
             print(f"{Colors.FAIL}❌ ERRORE durante l'unpivot: {e}{Colors.ENDC}")
             return False
 
     def step_4_generate_observation(self):
-        if self.df_long is None:
+        serie_df = self.serie_df
+        if serie_df is None:
              print(f"{Colors.WARNING}⚠️ Esegui prima lo Step 3.{Colors.ENDC}")
              return False
-        if self.tipo_misura_df is None or self.metodo_aggr_df is None:
-             print(f"{Colors.WARNING}⚠️ Esegui prima lo Step 2.{Colors.ENDC}")
-             return False
 
         print(f"\n{Colors.HEADER}--- 4. Generazione Tabella OBSERVATION ---{Colors.ENDC}")
-        
+
         try:
-            if not os.path.exists(FILE_ANNO_LOOKUP):
-                 print(f"{Colors.FAIL}❌ ERRORE: Il file {FILE_ANNO_LOOKUP} non esiste.{Colors.ENDC}")
-                 return False
+            # Join intero sull'anno; gli anni del file assenti dal registro condiviso ricevono li' un id nuovo
+            anni = [int(a) for a in self.colonne_anno]
+            anno_lookup = conform_years(anni)
+        except Exception as e:
+            print(f"{Colors.FAIL}❌ ERRORE GRAVE nel caricamento degli anni: {e}{Colors.ENDC}")
+            return False
+
+        try:
+            cod_anni = lookup_ids(pd.Series(anni), anno_lookup['valore'], anno_lookup['id_anno']).to_numpy(dtype=np.int64)
+            print(f"Scrittura a blocchi di {RIGHE_PER_BLOCCO} righe...")
+            # File temporaneo: un errore a meta' non lascia un output troncato al posto del precedente
+            temporaneo = FILE_OUTPUT_OBSERVATION + '.tmp'
+            righe = 0
+            anno_per_cod = dict(zip(cod_anni.tolist(), anni))
+            # Con --parquet le partizioni del dataset vengono sostituite tutte (anche gli anni spariti)
+            parquet = fact_writer(parquet_dir(), dataset_name(FILE_ESTAT), COLONNE_DIZIONARIO, sostituisci_fonte=True)
+            with open(temporaneo, 'w', encoding='utf-8', newline='') as f, parquet:
+                f.write(','.join(observation_columns(INCLUDI_NOME)) + os.linesep)
+                # Matrici scaricate su disco: iter_observations ne legge una colonna (anno) alla volta
+                for blocco in iter_observations(serie_df, self.valori, self.flag, cod_anni):
+                    blocco.to_csv(f, header=False, index=False)
+                    # Ogni blocco contiene un solo anno
+                    parquet.write(blocco, anno_per_cod[int(blocco['cod_anno'].iat[0])])
+                    righe += len(blocco)
+            os.replace(temporaneo, FILE_OUTPUT_OBSERVATION)
 
-            anno_lookup = pd.read_csv(FILE_ANNO_LOOKUP)
-            anno_lookup['valore'] = anno_lookup['valore'].astype(str)
+            record_rows(righe_in=righe)
+            record_write(FILE_OUTPUT_OBSERVATION, righe)
+            # Ultimo step: nessun intermedio serve piu'
+            del serie_df
+            self._rilascia('serie_df', 'valori', 'flag')
+            print(f"✅ Salvato '{FILE_OUTPUT_OBSERVATION}'")
+            if parquet_enabled():
+                print(f"✅ Salvato Parquet '{parquet_dir()}'")
+            print(f"{Colors.GREEN}✅ Step 4 Completato. Righe Totali: {righe}{Colors.ENDC}")
+            return True
         except Exception as e:
-            print(f"{Colors.FAIL}❌ ERRORE GRAVE nel caricamento lookup: {e}{Colors.ENDC}")
+            print(f"{Colors.FAIL}❌ ERRORE durante la generazione observation: {e}{Colors.ENDC}")
             return False
 
+    def build_pipeline(self):
+        """
+        Grafo degli step. Caricamento, dimensioni e unpivot preparano dati in memoria
+        (in_memory): vengono rieseguiti solo se serve rigenerare un output a valle.
+        """
+        return [
+            Step('step_1_load_and_clean', self.step_1_load_and_clean,
+                 inputs=[FILE_ESTAT], in_memory=True),
+            Step('step_2_prepare_dimensions', self.step_2_prepare_dimensions, deps=['step_1_load_and_clean'],
+                 outputs=[FILE_OUTPUT_TIPO_MISURA, FILE_OUTPUT_METODO_AGGR, FILE_OUTPUT_GEO], in_memory=True),
+            Step('step_3_unpivot', self.step_3_unpivot, deps=['step_2_prepare_dimensions'], in_memory=True),
+            Step('step_4_generate_observation', self.step_4_generate_observation,
+                 deps=['step_3_unpivot', 'step_2_prepare_dimensions'],
+                 inputs=[years_path()], outputs=[FILE_OUTPUT_ANNO, FILE_OUTPUT_OBSERVATION] + parquet_outputs()),
+        ]
+
+    def run_pipeline(self, force=False, jobs=1, steps=None):
+        """
+        Pipeline completa (o gli step indicati): se estat.csv, registro degli anni e codice non
+        cambiano non rielabora nulla. Restituisce gli esiti per step.
+        """
+        executor = DagExecutor(self.build_pipeline(), state_file=FILE_STATO_PIPELINE, jobs=jobs,
+                               instrument=Instrumenter('EUROSTATS', FILE_REPORT_ESECUZIONE))
+        self.rilascia_intermedi = True
         try:
-            print("Merging con tabelle di lookup...")
-            df_final = self.df_long.merge(anno_lookup[['id_anno', 'valore']], left_on='ANNO_valore', right_on='valore', how='left')
-            df_final = df_final.merge(self.tipo_misura_df, left_on='tipo_misura_valore', right_on='valore', how='left')
-            df_final = df_final.merge(self.metodo_aggr_df, left_on='metodo_aggr_nome', right_on='nome', how='left')
+            return executor.run(steps, force)
+        finally:
+            self.rilascia_intermedi = False
 
-            df_final['observation_name'] = df_final['geo'].fillna('NA') + '_' + df_final['tipo_misura_valore'] + '_' + df_final['metodo_aggr_nome']
+# --- MODALITA' MULTI-DATASET ---
 
-            self.observation_df = df_final[['observation_name', 'id_misura', 'id_aggr', 'id_anno', 'valore_misurato']].copy()
-            self.observation_df.columns = ['nome', 'cod_misura', 'cod_aggr', 'cod_anno', 'valore']
-            
-            self.observation_df['id_observation'] = range(1, len(self.observation_df) + 1)
-            self.observation_df = self.observation_df[['id_observation', 'nome', 'cod_misura', 'cod_anno', 'cod_aggr', 'valore']]
-            
-            self.observation_df.to_csv('observation_import_full.csv', index=False)
-            print(f"✅ Salvato 'observation_import_full.csv'")
-            print(f"{Colors.GREEN}✅ Step 4 Completato. Righe Totali: {len(self.observation_df)}{Colors.ENDC}")
+def dataset_name(path):
+    """Nome del dataset dal file: 'lfsa_ergan.tsv.gz' -> 'lfsa_ergan'."""
+    nome = os.path.basename(path)
+    while True:
+        radice, estensione = os.path.splitext(nome)
+        if estensione.lower() not in ESTENSIONI_DATASET:
+            return nome
+        nome = radice
+
+def list_datasets(cartella):
+    """File SDMX-TSV di `cartella` (anche compressi), in ordine di nome: l'intestazione contiene '\\TIME_PERIOD'."""
+    trovati = []
+    for nome in sorted(os.listdir(cartella)):
+        path = os.path.join(cartella, nome)
+        if not os.path.isfile(path):
+            continue
+        try:
+            if is_sdmx_tsv(path):
+                trovati.append(path)
+        except (OSError, EOFError, ImportError):
+            continue
+    return trovati
+
+def _parse_dataset(indice, path, cartella_lavoro):
+    """
+    Legge un dataset (eseguita nei processi del pool): chiavi delle serie codificate sulle
+    categorie locali del dataset, valori e codici dei flag salvati in `cartella_lavoro`
+    (.npz). Restituisce un dict con le categorie locali e i conteggi, da conformare,
+    e il profilo del file (common/profiler.py).
+    """
+    tabella = read_sdmx_tsv(path)
+    indici_anno = [i for i, p in enumerate(tabella.periodi) if p.isdigit() and len(p) == 4]
+    chiavi = series_keys(tabella.dims)
+    codici, categorie = {}, {}
+    for col in chiavi.columns:
+        # Categorie nell'ordine di prima apparizione (come drop_duplicates nella modalita' singola)
+        codici[col], cat = pd.factorize(chiavi[col])
+        categorie[col] = list(cat)
+    flag, codici_flag = np.unique(tabella.flag[:, indici_anno], return_inverse=True)
+
+    nome = dataset_name(path)
+    intermedio = os.path.join(cartella_lavoro, f"{indice}_{nome}.npz")
+    np.savez(intermedio, valori=tabella.valori[:, indici_anno],
+             flag=codici_flag.reshape(len(tabella), len(indici_anno)).astype(np.int32),
+             tipo=codici['tipo_misura_valore'], aggr=codici['metodo_aggr_nome'], geo=codici['geo'])
+    return {
+        'dataset': nome,
+        'path': path,
+        'intermedio': intermedio,
+        'serie': len(tabella),
+        'anni': [int(tabella.periodi[i]) for i in indici_anno],
+        'non_numerici': tabella.non_numerici,
+        'categorie': categorie,
+        'flag': list(flag),
+        'profilo': profile_sdmx(tabella, path),
+    }
+
+def _write_dataset(letto, mappe, cod_anni, primo_id, parte, includi_nome, cartella_parquet=None):
+    """
+    Scrive in `parte` (CSV senza intestazione) le osservazioni di un dataset letto da
+    _parse_dataset, con le FK conformate: `mappe` associa ai codici locali gli id globali.
+    Con `cartella_parquet` le scrive anche nelle partizioni Parquet del dataset (fonte).
+    Eseguita nei processi del pool; restituisce le righe scritte.
+    """
+    with np.load(letto['intermedio']) as dati:
+        serie_df = pd.DataFrame({
+            'cod_geo': mappe['geo'][dati['geo']],
+            'cod_misura': mappe['tipo_misura_valore'][dati['tipo']],
+            'cod_aggr': mappe['metodo_aggr_nome'][dati['aggr']],
+        })
+        if includi_nome:
+            categorie = {k: np.asarray(v, dtype=object) for k, v in letto['categorie'].items()}
+            serie_df.insert(0, 'nome', categorie['geo'][dati['geo']] + '_' + categorie['tipo_misura_valore'][dati['tipo']]
+                            + '_' + categorie['metodo_aggr_nome'][dati['aggr']])
+        valori = dati['valori']
+        flag = np.asarray(letto['flag'] or [''], dtype=object)[dati['flag']]
+    righe = 0
+    anno_per_cod = dict(zip(np.asarray(cod_anni).tolist(), letto['anni']))
+    # _metadata viene scritto dal processo principale, dopo tutti i dataset
+    parquet = fact_writer(cartella_parquet, letto['dataset'], COLONNE_DIZIONARIO, sostituisci_fonte=True,
+                          metadati=False, attivo=cartella_parquet is not None)
+    with open(parte, 'w', encoding='utf-8', newline='') as f, parquet:
+        for blocco in iter_observations(serie_df, valori, flag, cod_anni, primo_id):
+            blocco.to_csv(f, header=False, index=False)
+            parquet.write(blocco, anno_per_cod[int(blocco['cod_anno'].iat[0])])
+            righe += len(blocco)
+    return righe
+
+def _run_pool(funzione, *argomenti):
+    """map di `funzione` sugli argomenti in un pool di processi (nel processo corrente se basta uno)."""
+    n = len(argomenti[0])
+    processi = min(PROCESSI_DATASET, n)
+    if processi <= 1:
+        return list(map(funzione, *argomenti))
+    contesto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processi, mp_context=contesto) as pool:
+        # map mantiene l'ordine dei dataset: id deterministici
+        return list(pool.map(funzione, *argomenti))
+
+class EuroStatsBatchETL:
+    """
+    Modalita' multi-dataset: tutti i file SDMX-TSV di una cartella (anche compressi)
+    producono un unico insieme di dimensioni conformate (tipo misura, metodo di
+    aggregazione, geo, anno, con id senza duplicati) e un'unica tabella observation.
+
+    Lettura e scrittura dei dataset avvengono in un pool di processi (PROCESSI_DATASET):
+    ogni processo legge un file e ne salva valori e chiavi codificate su disco; il
+    processo principale unisce solo le categorie delle dimensioni, poi ogni processo
+    scrive la sua parte di observation, concatenate alla fine nell'ordine dei file.
+    Gli step hanno gli stessi nomi della modalita' a dataset singolo.
+    """
+
+    def __init__(self, cartella):
+        self.cartella = cartella
+        self.datasets = list_datasets(cartella)
+        self.letti = None
+        self.mappe = None
+        self.cod_anni = None
+        self.primi_id = None
+        self.cartella_lavoro = tempfile.mkdtemp(prefix='estat_')
+        # La cartella di lavoro viene rimossa anche se la pipeline si ferma prima dello step 4
+        self._pulizia = weakref.finalize(self, shutil.rmtree, self.cartella_lavoro, True)
+
+    def step_1_load_and_clean(self):
+        print(f"{Colors.HEADER}--- 1. Caricamento Dataset ({len(self.datasets)}) ---{Colors.ENDC}")
+        if not self.datasets:
+            print(f"{Colors.FAIL}❌ ERRORE: Nessun file SDMX-TSV in {self.cartella}.{Colors.ENDC}")
+            return False
+        try:
+            print(f"Lettura in parallelo su {min(PROCESSI_DATASET, len(self.datasets))} processi...")
+            self.letti = _run_pool(_parse_dataset, range(len(self.datasets)), self.datasets,
+                                   [self.cartella_lavoro] * len(self.datasets))
+            for letto in self.letti:
+                record_read(letto['path'], letto['serie'])
+                print(f"✅ {letto['dataset']}: {letto['serie']} serie, {len(letto['anni'])} anni")
+                if letto['non_numerici']:
+                    print(f"{Colors.WARNING}⚠️ {letto['dataset']}: {letto['non_numerici']} valori non numerici "
+                          f"trattati come mancanti.{Colors.ENDC}")
+                save_dataset_profile(letto.pop('profilo'), letto['dataset'])
+            print(f"{Colors.GREEN}✅ Step 1 Completato con successo.{Colors.ENDC}")
+            return True
+        except Exception as e:
+            print(f"{Colors.FAIL}❌ ERRORE durante il caricamento: {e}{Colors.ENDC}")
+            return False
+
+    def step_2_prepare_dimensions(self):
+        if self.letti is None:
+             print(f"{Colors.WARNING}⚠️ Esegui prima lo Step 1.{Colors.ENDC}")
+             return False
+
+        print(f"\n{Colors.HEADER}--- 2. Dimensioni Conformate ---{Colors.ENDC}")
+        try:
+            anno_lookup = conform_years([a for l in self.letti for a in l['anni']])
+        except Exception as e:
+            print(f"{Colors.FAIL}❌ ERRORE GRAVE nel caricamento degli anni: {e}{Colors.ENDC}")
+            return False
+
+        try:
+            # Membri nell'ordine di prima apparizione, un dataset dopo l'altro.
+            # Il tipo misura e' specifico del dataset (stesse dimensioni, indicatori diversi)
+            tipo = pd.DataFrame([(l['dataset'], v) for l in self.letti for v in l['categorie']['tipo_misura_valore']],
+                                columns=['dataset', 'valore']).drop_duplicates(ignore_index=True)
+            tipo['id_misura'] = range(1, len(tipo) + 1)
+            aggr = pd.Series([v for l in self.letti for v in l['categorie']['metodo_aggr_nome']]).drop_duplicates(ignore_index=True)
+            geo = pd.Series([v for l in self.letti for v in l['categorie']['geo']]).drop_duplicates(ignore_index=True)
+
+            tipo_misura_df = tipo[['valore', 'id_misura', 'dataset']]
+            metodo_aggr_df = pd.DataFrame({'nome': aggr, 'id_aggr': range(1, len(aggr) + 1)})
+            geo_df = pd.DataFrame({'id_geo': range(1, len(geo) + 1), 'codice': geo})
+            for df, filename in ((tipo_misura_df, FILE_OUTPUT_TIPO_MISURA), (metodo_aggr_df, FILE_OUTPUT_METODO_AGGR),
+                                 (geo_df, FILE_OUTPUT_GEO)):
+                df.to_csv(filename, index=False)
+                record_write(filename, len(df))
+                print(f"✅ Salvato '{filename}' ({len(df)} righe)")
+
+            # Codici locali di ogni dataset -> id conformati
+            self.mappe, self.cod_anni = [], []
+            for letto in self.letti:
+                cat = letto['categorie']
+                tipo_locale = tipo[tipo['dataset'] == letto['dataset']]
+                self.mappe.append({
+                    'tipo_misura_valore': lookup_ids(pd.Series(cat['tipo_misura_valore'], dtype=str), tipo_locale['valore'],
+                                                     tipo_locale['id_misura']).to_numpy(dtype=np.int64),
+                    'metodo_aggr_nome': lookup_ids(pd.Series(cat['metodo_aggr_nome'], dtype=str), metodo_aggr_df['nome'],
+                                                   metodo_aggr_df['id_aggr']).to_numpy(dtype=np.int64),
+                    'geo': lookup_ids(pd.Series(cat['geo'], dtype=str), geo_df['codice'], geo_df['id_geo']).to_numpy(dtype=np.int64),
+                })
+                self.cod_anni.append(lookup_ids(pd.Series(letto['anni'], dtype='int64'), anno_lookup['valore'],
+                                                anno_lookup['id_anno']).to_numpy(dtype=np.int64))
+            print(f"{Colors.GREEN}✅ Step 2 Completato.{Colors.ENDC}")
+            return True
+        except Exception as e:
+            print(f"{Colors.FAIL}❌ ERRORE durante la preparazione dimensioni: {e}{Colors.ENDC}")
+            return False
+
+    def step_3_unpivot(self):
+        if self.mappe is None:
+             print(f"{Colors.WARNING}⚠️ Esegui prima gli step precedenti.{Colors.ENDC}")
+             return False
+
+        print(f"\n{Colors.HEADER}--- 3. Esecuzione Unpivot (Wide -> Long) ---{Colors.ENDC}")
+        # id_observation consecutivi tra i dataset: ogni dataset parte dopo le righe dei precedenti
+        righe = [letto['serie'] * len(letto['anni']) for letto in self.letti]
+        self.primi_id = list(np.cumsum([1] + righe[:-1]))
+        record_rows(righe_in=sum(letto['serie'] for letto in self.letti))
+        print(f"{Colors.GREEN}✅ Step 3 Completato. Righe da generare: {sum(righe)}{Colors.ENDC}")
+        return True
+
+    def step_4_generate_observation(self):
+        if self.primi_id is None:
+             print(f"{Colors.WARNING}⚠️ Esegui prima lo Step 3.{Colors.ENDC}")
+             return False
+
+        print(f"\n{Colors.HEADER}--- 4. Generazione Tabella OBSERVATION ---{Colors.ENDC}")
+        try:
+            n = len(self.letti)
+            parti = [os.path.join(self.cartella_lavoro, f"observation_{i}.csv") for i in range(n)]
+            print(f"Scrittura in parallelo su {min(PROCESSI_DATASET, n)} processi...")
+            cartella_parquet = parquet_dir() if parquet_enabled() else None
+            righe = _run_pool(_write_dataset, self.letti, self.mappe, self.cod_anni, [int(i) for i in self.primi_id],
+                              parti, [INCLUDI_NOME] * n, [cartella_parquet] * n)
+            if cartella_parquet is not None:
+                update_metadata(cartella_parquet)
+                print(f"✅ Salvato Parquet '{cartella_parquet}'")
+
+            # Parti concatenate nell'ordine dei dataset, poi rinomina (nessun output troncato)
+            temporaneo = FILE_OUTPUT_OBSERVATION + '.tmp'
+            with open(temporaneo, 'wb') as f:
+                f.write((','.join(observation_columns(INCLUDI_NOME)) + os.linesep).encode('utf-8'))
+                for parte in parti:
+                    with open(parte, 'rb') as p:
+                        shutil.copyfileobj(p, f, 1024 * 1024)
+                    os.remove(parte)
+            os.replace(temporaneo, FILE_OUTPUT_OBSERVATION)
+
+            record_rows(righe_in=sum(righe))
+            record_write(FILE_OUTPUT_OBSERVATION, sum(righe))
+            print(f"✅ Salvato '{FILE_OUTPUT_OBSERVATION}'")
+            print(f"{Colors.GREEN}✅ Step 4 Completato. Righe Totali: {sum(righe)}{Colors.ENDC}")
             return True
         except Exception as e:
             print(f"{Colors.FAIL}❌ ERRORE durante la generazione observation: {e}{Colors.ENDC}")
             return False
 
+    def build_pipeline(self):
+        return [
+            Step('step_1_load_and_clean', self.step_1_load_and_clean, inputs=list(self.datasets), in_memory=True,
+                 params=['PROCESSI_DATASET']),
+            Step('step_2_prepare_dimensions', self.step_2_prepare_dimensions, deps=['step_1_load_and_clean'],
+                 inputs=[years_path()],
+                 outputs=[FILE_OUTPUT_TIPO_MISURA, FILE_OUTPUT_METODO_AGGR, FILE_OUTPUT_GEO, FILE_OUTPUT_ANNO],
+                 in_memory=True),
+            Step('step_3_unpivot', self.step_3_unpivot, deps=['step_2_prepare_dimensions'], in_memory=True),
+            Step('step_4_generate_observation', self.step_4_generate_observation,
+                 deps=['step_3_unpivot', 'step_2_prepare_dimensions'],
+                 outputs=[FILE_OUTPUT_OBSERVATION] + parquet_outputs(), params=['PROCESSI_DATASET']),
+        ]
+
+    def run_pipeline(self, force=False, jobs=1, steps=None):
+        executor = DagExecutor(self.build_pipeline(), state_file=FILE_STATO_PIPELINE, jobs=jobs,
+                               instrument=Instrumenter('EUROSTATS', FILE_REPORT_ESECUZIONE))
+        self.rilascia_intermedi = True
+        try:
+            return executor.run(steps, force)
+        finally:
+            self.rilascia_intermedi = False
+
+def run_batch(steps=None, force=False, jobs=1):
+    """
+    Esecuzione senza interazione (CLI e run_all.py): restituisce gli esiti per step.
+    Se l'input e' una cartella si elaborano tutti i dataset che contiene (EuroStatsBatchETL).
+    """
+    if os.path.isdir(FILE_ESTAT):
+        return EuroStatsBatchETL(FILE_ESTAT).run_pipeline(force, jobs, steps)
+    return EuroStatsETL().run_pipeline(force, jobs, steps)
+
+def configura_percorsi(input_path=None, output_dir=None):
+    """
+    Percorsi per l'esecuzione da riga di comando; restituisce il file sorgente.
+    Con `output_dir` anche il registro condiviso degli anni viene tenuto (e creato) li'.
+    """
+    global FILE_ESTAT
+    if input_path:
+        FILE_ESTAT = input_path
+    configure_anni(os.path.join(output_dir, FILE_ANNI) if output_dir else None)
+    relocate(globals(), ['FILE_OUTPUT_TIPO_MISURA', 'FILE_OUTPUT_METODO_AGGR', 'FILE_OUTPUT_GEO', 'FILE_OUTPUT_ANNO',
+                         'FILE_OUTPUT_OBSERVATION', 'FILE_OUTPUT_PROFILO', 'DIR_PARQUET',
+                         'FILE_STATO_PIPELINE', 'FILE_REPORT_ESECUZIONE'], output_dir)
+    return FILE_ESTAT
+
+def aggiungi_opzioni(parser):
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help="memoria massima (MB) per gli intermedi: oltre, i piu' grandi passano su file "
+                             "Feather memory-mapped (richiede pyarrow). Default: nessun limite")
+
+def applica_opzioni(parser, args):
+    global BUDGET_MEMORIA_MB
+    if args.memory_budget is None:
+        return
+    if args.memory_budget <= 0:
+        parser.error("--memory-budget deve essere maggiore di 0")
+    if not SPILL_DISPONIBILE:
+        parser.error("--memory-budget: modulo non installato (pip install pyarrow)")
+    BUDGET_MEMORIA_MB = args.memory_budget
+
+def main_cli(argv=None):
+    """Esecuzione senza menu (es. da cron): python AnalyzeESTAT.py --output-dir out --quiet"""
+    return run_cli(argv, 'AnalyzeESTAT.py', "Pipeline ETL del dataset Eurostat (observation).",
+                   [s.name for s in EuroStatsETL().build_pipeline()], FILE_ESTAT, Colors, configura_percorsi,
+                   run_batch, aggiungi_opzioni, applica_opzioni)
+
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
@@ -183,7 +731,8 @@ def main_menu():
         print(f"{Colors.BLUE}3.{Colors.ENDC} Unpivot Dati")
         print(f"{Colors.BLUE}4.{Colors.ENDC} Generazione Tabella Observation")
         print("-----------------------------------")
-        print(f"{Colors.CYAN}9.{Colors.ENDC} {Colors.BOLD}Esegui Pipeline Completa (1-4){Colors.ENDC}")
+        print(f"{Colors.CYAN}9.{Colors.ENDC} {Colors.BOLD}Esegui Pipeline Completa (1-4){Colors.ENDC} (salta se invariata)")
+        print(f"{Colors.CYAN}F.{Colors.ENDC} Esegui Pipeline Completa forzando la rigenerazione")
         print(f"{Colors.FAIL}0. Esci{Colors.ENDC}")
         
         choice = input(f"\n{Colors.WARNING}Seleziona un'opzione: {Colors.ENDC}")
@@ -207,10 +756,12 @@ def main_menu():
         elif choice == '9':
             clear_screen()
             print(f"{Colors.BOLD}Avvio pipeline completa...{Colors.ENDC}\n")
-            if etl.step_1_load_and_clean():
-                if etl.step_2_prepare_dimensions():
-                    if etl.step_3_unpivot():
-                        etl.step_4_generate_observation()
+            etl.run_pipeline()
+            input("\nPremere Invio per continuare...")
+        elif choice in ('f', 'F'):
+            clear_screen()
+            print(f"{Colors.BOLD}Avvio pipeline completa (forzata)...{Colors.ENDC}\n")
+            etl.run_pipeline(force=True)
             input("\nPremere Invio per continuare...")
         elif choice == '0':
             print(f"\n{Colors.GREEN}Uscita... A presto! 👋{Colors.ENDC}")
@@ -220,6 +771,8 @@ def main_menu():
              time.sleep(1)
 
 if __name__ == "__main__":
+    if not is_interactive():
+        sys.exit(main_cli())
     try:
         main_menu()
     except KeyboardInterrupt:
@@ -1,21 +1,102 @@
 import pandas as pd
 import numpy as np
+import json
+import multiprocessing
 import os
 import re
 import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# Moduli condivisi tra le pipeline (scripts/common)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.anni import NOME_FILE as FILE_ANNI
+from common.anni import configure as configure_anni
+from common.anni import conform_registry, register_years, years_path
+from common.arrow_ipc import read_sidecar, sidecar_path, write_sidecar
+from common.cli import is_interactive, relocate, run_cli
+from common.cache import StageCache
+from common.dag import ESEGUITO, SALTATO, STATE_FILE, DagExecutor, Step
+from common.ingest import IngestReport, byte_ranges, iter_delimited, read_range
+from common.instrument import Instrumenter, record_read, record_write
+from common.keys import KeyRegistry, encode, lookup_ids
+from common.parquet_export import PartitionedWriter, metadata_path
+from common.parquet_export import enabled as parquet_enabled
+from common.profiler import Profiler, save_profile
 
 # --- CONFIGURAZIONE ---
 FILE_ISCRITTI = 'bdg_serie_iscritti.csv'
 FILE_OUTPUT_ANNO = 'anno_export.csv'
 FILE_OUTPUT_FACOLTA = 'facolta_export.csv'
 FILE_OUTPUT_ANALISI = 'analisi_export.csv'
+FILE_OUTPUT_ATENEO = 'ateneo_export.csv'
+FILE_OUTPUT_ANALISI_ATENEO = 'analisi_ateneo_export.csv'
+DIR_REGISTRO = 'registro_chiavi'
+FILE_WATERMARK = 'mur_watermark.json'
+# Profilo delle colonne lette da FILE_ISCRITTI (tutte le righe), costruito durante la scansione
+FILE_OUTPUT_PROFILO = 'profilo_mur.json'
+FILE_STATO_PIPELINE = STATE_FILE
+FILE_REPORT_ESECUZIONE = 'run_report.json'
+
+# Export Parquet delle tabelle di analisi (--parquet): parquet/<tabella>/fonte=MUR/anno=<anno>/
+DIR_PARQUET = 'parquet'
+FONTE_PARQUET = 'MUR'
 
 DELIMITATORE = ';'
 ENCODING_INPUT = 'latin-1'
 
-# Anno base per inizializzazione (se non presente)
-ANNO_BASE_DF = pd.DataFrame({'id_anno': [1], 'valore': [2019]})
+# Lettura a blocchi del file iscritti: si tengono solo le righe del totale nazionale
+# e le colonne usate dagli step (nomi alternativi compresi)
+RIGHE_PER_BLOCCO = 200_000
+ATENEO_TOTALE = 'TOTALE ATENEI'
+COLONNE_FACOLTA = ['DESC_FoET2013', 'nome_facolta']
+COLONNE_SESSO = ['SEX', 'Sesso', 'Genere', 'sesso', 'sesso_agg']
+# Misure MUR (colonna di output -> nomi possibili nel file): gli iscritti sono obbligatori,
+# immatricolati e laureati vengono elaborati solo se presenti. Ogni misura esce divisa per sesso.
+MISURE = {
+    'num_iscritti': ['ISC', 'num_iscritti'],
+    'num_immatricolati': ['IMM', 'num_immatricolati'],
+    'num_laureati': ['LAU', 'num_laureati'],
+}
+SESSI = ['M', 'F']
+COLONNE_LETTE = ['ANNO', 'AteneoNOME'] + COLONNE_FACOLTA + COLONNE_SESSO + [c for v in MISURE.values() for c in v]
+
+# Analisi per ateneo: il file viene diviso in partizioni di BYTE_PER_PARTIZIONE byte
+# aggregate in parallelo da PROCESSI_ATENEI processi (da riga di comando al piu' --jobs). Richiede una seconda scansione completa
+# del file, quindi gli step 4-5 fanno parte della pipeline solo con INCLUDI_ATENEI (--atenei)
+# oppure se indicati esplicitamente (--steps 4,5, menu).
+INCLUDI_ATENEI = False
+STEP_ATENEI = ['step_4_generazione_atenei', 'step_5_generazione_analisi_atenei']
+COLONNE_ATENEO = ['AteneoCOD', 'AteneoNOME']
+BYTE_PER_PARTIZIONE = 64 * 1024 * 1024
+PROCESSI_ATENEI = os.cpu_count() or 1
+
+# Le righe filtrate (e gli aggregati per ateneo) vengono letti una sola volta e condivisi dagli step
+CACHE = StageCache()
+
+# Registro persistente degli id: anni, facolta' e atenei gia' pubblicati mantengono il proprio,
+# i membri nuovi ricevono id successivi. Il watermark (FILE_WATERMARK) tiene gli anni gia'
+# caricati nelle tabelle di analisi: alle esecuzioni successive si accodano solo gli anni nuovi.
+# Con la rigenerazione forzata (--force, opzione F del menu) il watermark viene ignorato e riscritto.
+REGISTRO = None
+_LOCK_REGISTRO = threading.RLock()
+RIGENERA_TUTTO = False
+SCHEMA_REGISTRO = {
+    # tabella: (colonna id, chiave naturale, attributi)
+    'anno': ('id_anno', ['valore'], []),
+    'facolta': ('id_facolta', ['nome'], []),
+    'ateneo': ('id_ateneo', ['codice'], ['nome']),
+    'analisi': ('id_analisi', ['cod_anno', 'cod_facolta'], [f"{m}_{s.lower()}" for m in MISURE for s in SESSI]),
+    'analisi_ateneo': ('id_analisi_ateneo', ['cod_ateneo', 'cod_anno', 'cod_facolta'],
+                       [f"{m}_{s.lower()}" for m in MISURE for s in SESSI]),
+}
+
+# Anno accademico: si usa l'anno di inizio ("2019/2020" -> 2019)
+RE_ANNO = re.compile(r'^\s*(\d{4})')
+# Cache per processo: stringa ANNO -> anno (None se non riconosciuta)
+_CACHE_ANNI = {}
 
 class Colors:
     HEADER = '\033[95m'
@@ -63,22 +144,343 @@ def confirm_action(prompt):
             return False
 
 def save_csv(df, filename):
+    """Scrive su un file temporaneo e lo sostituisce: chi legge in parallelo vede sempre un file completo."""
     try:
-        df.to_csv(filename, index=False, lineterminator='\n')
+        temporaneo = filename + '.tmp'
+        df.to_csv(temporaneo, index=False, lineterminator='\n')
+        os.replace(temporaneo, filename)
+        record_write(filename, len(df))
         print_success(f"File salvato correttamente: {filename} ({len(df)} righe)")
         return True
     except Exception as e:
         print_error(f"Errore durante il salvataggio di {filename}: {e}")
         return False
 
-def load_data(filepath, encoding=ENCODING_INPUT, delimiter=DELIMITATORE):
-    print_info(f"Caricamento dati da {filepath}...")
-    try:
-        df = pd.read_csv(filepath, delimiter=delimiter, encoding=encoding)
+def save_lookup(df, filename):
+    """Salva una tabella di lookup: CSV di export piu' la copia Arrow letta dagli step successivi."""
+    if not save_csv(df, filename):
+        return False
+    write_sidecar(df, filename)
+    return True
+
+def load_lookup(filename, dtype=None):
+    """
+    Tabella di lookup prodotta da uno step precedente: dal file Arrow mappato in memoria
+    (tipi gia' quelli dello step che l'ha scritta), dal CSV se manca o non e' aggiornato.
+    """
+    df = read_sidecar(filename)
+    if df is not None:
+        record_read(sidecar_path(filename), len(df))
         return df
+    df = pd.read_csv(filename, dtype=dtype)
+    record_read(filename, len(df))
+    return df
+
+def load_totali():
+    """
+    Righe 'TOTALE ATENEI' di FILE_ISCRITTI con le sole colonne usate dagli step.
+    Il file viene letto a blocchi di RIGHE_PER_BLOCCO righe e filtrato blocco per blocco:
+    la memoria dipende dalla dimensione del blocco e non dallo storico per ateneo.
+    Il risultato resta in cache, quindi i tre step condividono un'unica scansione
+    (da non modificare in place). Durante la stessa scansione viene costruito il
+    profilo delle colonne lette (FILE_OUTPUT_PROFILO).
+    """
+    def _scansione():
+        print_info(f"Lettura a blocchi di {FILE_ISCRITTI} (solo '{ATENEO_TOTALE}')...")
+        report = IngestReport(FILE_ISCRITTI, DELIMITATORE, '"', 'c')
+        profilo = Profiler()
+        parti = []
+        try:
+            for blocco in iter_delimited(FILE_ISCRITTI, chunksize=RIGHE_PER_BLOCCO, encoding=ENCODING_INPUT,
+                                         delimiter=DELIMITATORE, usecols=lambda c: c.strip() in COLONNE_LETTE,
+                                         report=report):
+                profilo.update(blocco)
+                parti.append(blocco[blocco['AteneoNOME'] == ATENEO_TOTALE])
+        except Exception as e:
+            print_error(f"Impossibile leggere il file {FILE_ISCRITTI}. Dettagli: {e}")
+            return None
+        if report.rejected_count:
+            print_warning(f"{report.rejected_count} righe malformate scartate da {FILE_ISCRITTI}.")
+        if not parti:
+            print_error(f"Nessuna riga dati in {FILE_ISCRITTI}.")
+            return None
+        totali = pd.concat(parti, ignore_index=True)
+        print_info(f"Righe lette: {report.rows}, righe '{ATENEO_TOTALE}': {len(totali)}")
+        save_profile(profilo.to_dict(FILE_ISCRITTI, report), FILE_OUTPUT_PROFILO)
+        print_info(f"Profilo salvato: {FILE_OUTPUT_PROFILO}")
+        return totali
+
+    return CACHE.load(('totali', FILE_ISCRITTI), [FILE_ISCRITTI], _scansione)
+
+def export_files():
+    return {
+        'anno': FILE_OUTPUT_ANNO,
+        'facolta': FILE_OUTPUT_FACOLTA,
+        'ateneo': FILE_OUTPUT_ATENEO,
+        'analisi': FILE_OUTPUT_ANALISI,
+        'analisi_ateneo': FILE_OUTPUT_ANALISI_ATENEO,
+    }
+
+def get_registry():
+    """
+    Registro chiavi della sessione. Alla prima esecuzione viene inizializzato dagli
+    export gia' presenti, cosi' gli id pubblicati finora vengono mantenuti. Gli anni
+    vengono poi allineati al registro condiviso con DNF ed EUROSTATS (step 1).
+    """
+    global REGISTRO
+    with _LOCK_REGISTRO:
+        if REGISTRO is None or REGISTRO.directory != DIR_REGISTRO:
+            REGISTRO = KeyRegistry(DIR_REGISTRO, dtypes={'ateneo': {'codice': str}})
+            for tabella, filename in export_files().items():
+                if REGISTRO.table(tabella) is None and os.path.exists(filename):
+                    export = pd.read_csv(filename, dtype=REGISTRO.dtypes.get(tabella))
+                    record_read(filename, len(export))
+                    REGISTRO.seed(tabella, export)
+        return REGISTRO
+
+def registry_members(tabella):
+    """Membri registrati di `tabella`, letti sotto il lock: gli step paralleli aggiornano il registro."""
+    with _LOCK_REGISTRO:
+        return get_registry().members(tabella).copy()
+
+def register_members(tabella, df):
+    """Assegna gli id (stabili tra le esecuzioni) alle righe di `df` e salva il registro."""
+    id_col, key_cols, attr_cols = SCHEMA_REGISTRO[tabella]
+    # Le misure opzionali assenti dal file non sono attributi
+    attr_cols = [c for c in attr_cols if c in df.columns]
+    with _LOCK_REGISTRO:
+        registro = get_registry()
+        ids, stato = registro.upsert(tabella, df, id_col, key_cols, attr_cols)
+        registro.save()
+    print_info(f"Registro '{tabella}': {int((stato == KeyRegistry.NUOVO).sum())} nuovi, "
+               f"{int((stato == KeyRegistry.MODIFICATO).sum())} modificati, {len(registro.members(tabella))} totali")
+    return ids
+
+def load_watermark():
+    """Anni gia' caricati per tabella di analisi (vuoto alla prima esecuzione)."""
+    if not os.path.exists(FILE_WATERMARK):
+        return {'anni': {}}
+    with open(FILE_WATERMARK, encoding='utf-8') as f:
+        watermark = json.load(f)
+    record_read(FILE_WATERMARK)
+    return watermark
+
+def anni_da_caricare(tabella, filename, anni):
+    """
+    Anni di `anni` non ancora caricati in `filename` secondo il watermark.
+    Restituisce (anni nuovi, accoda): se l'output manca, o la rigenerazione e' forzata,
+    si ricarica tutto da capo (con gli id del registro, quindi invariati).
+    """
+    if RIGENERA_TUTTO:
+        print_info(f"Rigenerazione forzata: watermark '{tabella}' ignorato, {filename} viene riscritto.")
+        return sorted(int(a) for a in set(anni)), False
+    with _LOCK_REGISTRO:
+        caricati = set(load_watermark()['anni'].get(tabella, [])) if os.path.exists(filename) else set()
+    nuovi = sorted(int(a) for a in set(anni) - caricati)
+    if caricati:
+        print_info(f"Watermark '{tabella}': {len(caricati)} anni gia' caricati (fino al {max(caricati)}), "
+                   f"{len(nuovi)} nuovi")
+    return nuovi, bool(caricati)
+
+def save_incrementale(tabella, df, filename, anni, accoda):
+    """
+    Scrive `df` in `filename` (o lo accoda, senza riscrivere le righe gia' pubblicate)
+    e registra `anni` nel watermark.
+    """
+    if accoda:
+        intestazione = list(pd.read_csv(filename, nrows=0).columns)
+        if intestazione != list(df.columns):
+            print_error(f"Le colonne di {filename} non corrispondono a quelle nuove ({', '.join(df.columns)}). "
+                        f"Eliminare {FILE_WATERMARK} per ricaricare tutti gli anni.")
+            return False
+        try:
+            df.to_csv(filename, mode='a', header=False, index=False, lineterminator='\n')
+            record_write(filename, len(df))
+            print_success(f"Accodate {len(df)} righe a {filename}")
+        except Exception as e:
+            print_error(f"Errore durante il salvataggio di {filename}: {e}")
+            return False
+    elif not save_csv(df, filename):
+        return False
+
+    with _LOCK_REGISTRO:
+        watermark = load_watermark()
+        precedenti = watermark['anni'].get(tabella, []) if accoda else []
+        watermark['anni'][tabella] = sorted(set(precedenti) | set(anni))
+        watermark.pop('id_max', None)
+        watermark['aggiornato'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(FILE_WATERMARK, 'w', encoding='utf-8') as f:
+            json.dump(watermark, f, indent=2)
+        record_write(FILE_WATERMARK)
+    if accoda and parquet_enabled() and not os.path.exists(metadata_path(parquet_dir(tabella))):
+        # Dataset Parquet ancora assente: si esporta tutto il CSV, non solo gli anni accodati
+        return sync_parquet(tabella, filename)
+    return save_parquet(tabella, df)
+
+def parquet_dir(tabella):
+    return os.path.join(DIR_PARQUET, tabella)
+
+def save_parquet(tabella, df):
+    """
+    Export Parquet di una tabella di analisi (solo con --parquet): una partizione per
+    anno, sostituita se gia' presente. Gli anni vengono ricavati da cod_anno.
+    """
+    if not parquet_enabled():
+        return True
+    try:
+        anno_lookup = load_lookup(FILE_OUTPUT_ANNO)
+        anni = lookup_ids(df['cod_anno'], anno_lookup['id_anno'], anno_lookup['valore'])
+        with PartitionedWriter(parquet_dir(tabella), FONTE_PARQUET) as scrittore:
+            scrittore.write(df, anni)
+        print_success(f"Parquet salvato: {parquet_dir(tabella)} ({len(df)} righe)")
+        return True
     except Exception as e:
-        print_error(f"Impossibile leggere il file {filepath}. Dettagli: {e}")
-        return None
+        print_error(f"Errore durante l'export Parquet in {parquet_dir(tabella)}: {e}")
+        return False
+
+def sync_parquet(tabella, filename):
+    """Con --parquet crea il dataset da tutto il CSV se non esiste ancora (export attivato dopo i primi caricamenti)."""
+    if not parquet_enabled() or os.path.exists(metadata_path(parquet_dir(tabella))):
+        return True
+    df = pd.read_csv(filename)
+    record_read(filename, len(df))
+    return save_parquet(tabella, df)
+
+def _aggrega_partizione(path, inizio, fine, intestazione, colonne):
+    """
+    Iscritti per ateneo x anno x facolta' x sesso nell'intervallo di byte [inizio, fine)
+    di `path`, escluse le righe del totale (eseguita nei processi del pool).
+    `colonne` associa i nomi standard (chiavi e misure presenti) alle colonne reali del file.
+    Restituisce (aggregato, righe lette).
+    """
+    df = read_range(path, inizio, fine, intestazione, sep=DELIMITATORE, encoding=ENCODING_INPUT,
+                    usecols=lambda c: c.strip().strip('"') in colonne.values(),
+                    dtype={c: str for k, c in colonne.items() if k not in MISURE})
+    righe = len(df)
+    df = df.rename(columns={c: k for k, c in colonne.items()})
+    df = df[df['nome_ateneo'] != ATENEO_TOTALE]
+    chiavi = ['cod_ateneo', 'nome_ateneo', 'ANNO', 'nome_facolta', 'sesso_agg']
+    misure = [k for k in colonne if k in MISURE]
+    return df.groupby(chiavi, sort=False, dropna=False)[misure].sum().reset_index(), righe
+
+def load_atenei():
+    """
+    Misure per ateneo x anno x facolta' x sesso (colonne cod_ateneo, nome_ateneo, ANNO,
+    nome_facolta, sesso_agg e le misure di MISURE presenti nel file). Il file viene diviso in partizioni di byte
+    aggregate in parallelo da un pool di processi; gli aggregati parziali vengono poi
+    sommati e ordinati, quindi il risultato non dipende da come e' stato partizionato.
+    Resta in cache come load_totali (da non modificare in place).
+    """
+    def _scansione():
+        intestazione, intervalli = byte_ranges(FILE_ISCRITTI, BYTE_PER_PARTIZIONE)
+        nomi = [c.strip().strip('"') for c in intestazione.decode(ENCODING_INPUT).split(DELIMITATORE)]
+        candidati = {'cod_ateneo': COLONNE_ATENEO[:1], 'nome_ateneo': COLONNE_ATENEO[1:], 'ANNO': ['ANNO'],
+                     'nome_facolta': COLONNE_FACOLTA, 'sesso_agg': COLONNE_SESSO, **MISURE}
+        colonne = {k: next((c for c in v if c in nomi), None) for k, v in candidati.items()}
+        mancanti = [k for k, c in colonne.items() if c is None and k not in list(MISURE)[1:]]
+        if mancanti:
+            print_error(f"Colonne per l'analisi per ateneo non trovate: {', '.join(mancanti)}")
+            print_info(f"Colonne disponibili: {nomi}")
+            return None
+        colonne = {k: c for k, c in colonne.items() if c is not None}
+        if not intervalli:
+            print_error(f"Nessuna riga dati in {FILE_ISCRITTI}.")
+            return None
+
+        processi = min(PROCESSI_ATENEI, len(intervalli))
+        print_info(f"Aggregazione per ateneo: {len(intervalli)} partizioni su {processi} processi...")
+        inizi, fini = zip(*intervalli)
+        argomenti = (repeat(FILE_ISCRITTI), inizi, fini, repeat(intestazione), repeat(colonne))
+        try:
+            if processi == 1:
+                # Una sola partizione (o un solo core): niente costo di avvio dei processi
+                risultati = list(map(_aggrega_partizione, *argomenti))
+            else:
+                contesto = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=processi, mp_context=contesto) as pool:
+                    # map mantiene l'ordine delle partizioni: merge deterministico
+                    risultati = list(pool.map(_aggrega_partizione, *argomenti))
+        except Exception as e:
+            print_error(f"Impossibile leggere il file {FILE_ISCRITTI}. Dettagli: {e}")
+            return None
+
+        parziali = [parziale for parziale, _ in risultati]
+        record_read(FILE_ISCRITTI, sum(righe for _, righe in risultati))
+        chiavi = ['cod_ateneo', 'nome_ateneo', 'ANNO', 'nome_facolta', 'sesso_agg']
+        # Un gruppo puo' essere diviso tra due partizioni: si risommano i parziali
+        misure = [k for k in colonne if k in MISURE]
+        atenei = pd.concat(parziali, ignore_index=True).groupby(chiavi, dropna=False)[misure].sum().reset_index()
+        print_info(f"Atenei: {atenei['cod_ateneo'].nunique()}, combinazioni aggregate: {len(atenei)}")
+        return atenei
+
+    return CACHE.load(('atenei', FILE_ISCRITTI), [FILE_ISCRITTI], _scansione)
+
+def aggrega_per_sesso(df, chiavi, misure, col_sesso='sesso_agg'):
+    """
+    Somma tutte le `misure` per `chiavi` e le separa per sesso in un solo groupby/unstack:
+    una riga per combinazione di chiavi, colonne <misura>_m e <misura>_f (0 se la
+    combinazione manca per quel sesso), ordinate per chiavi come farebbe pivot_table.
+    Chiavi e sesso vengono codificati in interi prima del groupby; le righe con chiave
+    mancante o sesso diverso da M/F vengono escluse.
+    """
+    lavoro = pd.DataFrame(index=range(len(df)))
+    categorie = {}
+    for col in chiavi:
+        lavoro[col], categorie[col] = encode(df[col])
+    lavoro['_sesso'], _ = encode(df[col_sesso].astype(str).str.strip().str.upper(), SESSI)
+    for col in misure:
+        lavoro[col] = df[col].to_numpy()
+
+    sesso_ignoto = int((lavoro['_sesso'] < 0).sum())
+    if sesso_ignoto:
+        print_warning(f"{sesso_ignoto} righe con sesso diverso da {'/'.join(SESSI)} escluse.")
+    for i, sesso in enumerate(SESSI):
+        if not (lavoro['_sesso'] == i).any():
+            print_warning(f"Nessuna riga con sesso {sesso}: le colonne {sesso} valgono 0.")
+    validi = (lavoro[chiavi + ['_sesso']] >= 0).all(axis=1)
+
+    larga = (lavoro[validi].groupby(chiavi + ['_sesso'])[misure].sum()
+             .unstack('_sesso', fill_value=0)
+             .reindex(columns=pd.MultiIndex.from_product([misure, range(len(SESSI))]), fill_value=0))
+    larga.columns = [f"{misura}_{SESSI[i].lower()}" for misura, i in larga.columns]
+    larga = larga.reset_index()
+    # Dai codici ai valori originali
+    for col in chiavi:
+        larga[col] = categorie[col].take(larga[col].to_numpy())
+    return larga
+
+def parse_anni(valori):
+    """
+    Anno di inizio di ogni valore ANNO (es. "2019/2020" -> 2019) come array Int64,
+    <NA> se il valore non e' riconosciuto. Ogni stringa distinta viene analizzata una
+    sola volta (codifica a categorie + cache per processo) e il risultato viene
+    ridistribuito sulle righe con una take sui codici.
+    Restituisce (anni, valori non riconosciuti).
+    """
+    codici, categorie = encode(valori)
+    for valore in categorie:
+        if valore not in _CACHE_ANNI:
+            m = RE_ANNO.match(str(valore))
+            _CACHE_ANNI[valore] = int(m.group(1)) if m else None
+    # Ultima posizione per i valori mancanti (codice -1)
+    tabella = pd.array([_CACHE_ANNI[v] for v in categorie] + [None], dtype='Int64')
+    anni = tabella[np.where(codici >= 0, codici, len(categorie))]
+    non_validi = [str(v) for v in categorie if _CACHE_ANNI[v] is None]
+    if (codici < 0).any():
+        non_validi.append('<vuoto>')
+    return anni, non_validi
+
+def add_anno_valore(df):
+    """
+    Copia di `df` con la colonna ANNO_valore (int); le righe con ANNO non riconosciuto
+    vengono escluse e segnalate invece di interrompere lo step.
+    """
+    anni, non_validi = parse_anni(df['ANNO'])
+    validi = ~anni.isna()
+    if non_validi:
+        print_warning(f"{int((~validi).sum())} righe con ANNO non riconosciuto escluse "
+                      f"(valori: {', '.join(non_validi[:5])}{', ...' if len(non_validi) > 5 else ''})")
+    return df[validi].assign(ANNO_valore=anni[validi].astype('int64'))
 
 # --- FUNZIONI CORE ---
 
@@ -88,41 +490,31 @@ def step_1_generazione_anni():
     if not check_file_exists(FILE_ISCRITTI):
         return False
 
-    df_iscritti = load_data(FILE_ISCRITTI)
-    if df_iscritti is None:
+    df_totali = load_totali()
+    if df_totali is None:
         return False
 
-    # Filtro iniziale
-    df_filtered = df_iscritti[df_iscritti['AteneoNOME'] == 'TOTALE ATENEI'].copy()
-    
     # Estrazione anno
     print_info("Estrazione valori anno...")
+    df_filtered = add_anno_valore(df_totali)
+
+    # Id dal registro condiviso con DNF ed EUROSTATS: gli anni gia' registrati (da qualsiasi
+    # pipeline) mantengono il proprio id, quelli nuovi vengono accodati in ordine cronologico
+    anni = sorted(int(a) for a in df_filtered['ANNO_valore'].unique())
     try:
-        df_filtered['ANNO_valore'] = df_filtered['ANNO'].apply(
-            lambda x: int(re.search(r'^\d{4}', x).group(0))
-        )
-    except Exception as e:
-        print_error(f"Errore durante il parsing degli anni: {e}")
+        lookup, nuovi = register_years(anni)
+        with _LOCK_REGISTRO:
+            registro = get_registry()
+            conform_registry(registro, lookup)
+            registro.save()
+    except (ValueError, OSError) as e:
+        print_error(f"Registro degli anni: {e}")
         return False
+    if nuovi:
+        print_info(f"Anni aggiunti al registro condiviso {os.path.normpath(years_path())}: {', '.join(map(str, nuovi))}")
 
-    # Logica incrementale
-    existing_years = set(ANNO_BASE_DF['valore'])
-    new_years_values = df_filtered['ANNO_valore'].unique()
-    new_years_to_add = sorted([y for y in new_years_values if y not in existing_years])
-
-    if new_years_to_add:
-        print_info(f"Trovati {len(new_years_to_add)} nuovi anni da aggiungere.")
-        max_old_id = ANNO_BASE_DF['id_anno'].max()
-        anno_new_df = pd.DataFrame({'valore': new_years_to_add})
-        anno_new_df['id_anno'] = range(max_old_id + 1, max_old_id + 1 + len(anno_new_df))
-        anno_all_df = pd.concat([ANNO_BASE_DF, anno_new_df], ignore_index=True)
-    else:
-        print_info("Nessun nuovo anno da aggiungere rispetto alla base.")
-        anno_all_df = ANNO_BASE_DF.copy()
-
-    # Ordina per id_anno
-    anno_all_df = anno_all_df.sort_values(by='id_anno')
-    return save_csv(anno_all_df, FILE_OUTPUT_ANNO)
+    anno_all_df = registry_members('anno').sort_values(by='id_anno')
+    return save_lookup(anno_all_df, FILE_OUTPUT_ANNO)
 
 def step_2_generazione_facolta():
     print_header("2. Generazione Tabella FACOLTA'")
@@ -130,33 +522,26 @@ def step_2_generazione_facolta():
     if not check_file_exists(FILE_ISCRITTI):
         return False
 
-    df_iscritti = load_data(FILE_ISCRITTI)
-    if df_iscritti is None:
+    df_filtered = load_totali()
+    if df_filtered is None:
         return False
 
-    df_filtered = df_iscritti[df_iscritti['AteneoNOME'] == 'TOTALE ATENEI'].copy()
-    
     print_info("Estrazione nomi facoltà univoci...")
     # Identificazione colonna facolta
-    col_facolta = None
-    if 'DESC_FoET2013' in df_filtered.columns:
-        col_facolta = 'DESC_FoET2013'
-    elif 'nome_facolta' in df_filtered.columns:
-        col_facolta = 'nome_facolta'
-        
+    col_facolta = next((c for c in COLONNE_FACOLTA if c in df_filtered.columns), None)
+
     if not col_facolta:
         print_error("Colonna facoltà (es. 'DESC_FoET2013') non trovata nel dataset.")
         print_info(f"Colonne disponibili: {list(df_filtered.columns)}")
         return False
 
-    facolta_df = df_filtered[[col_facolta]].drop_duplicates().sort_values(by=col_facolta).reset_index(drop=True)
+    facolta_df = df_filtered[[col_facolta]].dropna().drop_duplicates().sort_values(by=col_facolta).reset_index(drop=True)
     facolta_df.columns = ['nome']
-    
-    # Assegnazione ID
-    facolta_df['id_facolta'] = range(1, len(facolta_df) + 1)
-    facolta_df = facolta_df[['id_facolta', 'nome']]
-    
-    return save_csv(facolta_df, FILE_OUTPUT_FACOLTA)
+
+    # Assegnazione ID: le facolta' gia' registrate mantengono il proprio, le nuove vengono accodate
+    register_members('facolta', facolta_df)
+
+    return save_lookup(registry_members('facolta'), FILE_OUTPUT_FACOLTA)
 
 def step_3_generazione_analisi():
     print_header("3. Generazione Tabella ANALISI (M/F Split)")
@@ -173,71 +558,50 @@ def step_3_generazione_analisi():
         if not step_2_generazione_facolta(): return False
 
     # Caricamento dati
-    df_iscritti = load_data(FILE_ISCRITTI)
-    anno_all_df = pd.read_csv(FILE_OUTPUT_ANNO)
-    facolta_lookup = pd.read_csv(FILE_OUTPUT_FACOLTA)
+    df_iscritti = load_totali()
+    if df_iscritti is None:
+        return False
+    anno_all_df = load_lookup(FILE_OUTPUT_ANNO)
+    facolta_lookup = load_lookup(FILE_OUTPUT_FACOLTA)
     
     # Identificazione colonna sesso
-    colonne_sesso_sospette = ['SEX', 'Sesso', 'Genere', 'sesso', 'sesso_agg']
-    colonna_sesso_reale = None
-    for col in colonne_sesso_sospette:
-        if col in df_iscritti.columns:
-            colonna_sesso_reale = col
-            break
-            
+    colonna_sesso_reale = next((c for c in COLONNE_SESSO if c in df_iscritti.columns), None)
+
     if not colonna_sesso_reale:
         print_error("Impossibile trovare la colonna del Sesso (es. SEX, Sesso).")
         return False
     
     print_info(f"Colonna Sesso identificata: '{colonna_sesso_reale}'")
 
-    # Filtri e Rinomine
-    df_filtered = df_iscritti[df_iscritti['AteneoNOME'] == 'TOTALE ATENEI'].copy()
-    
-    col_facolta_orig = 'DESC_FoET2013' if 'DESC_FoET2013' in df_filtered.columns else 'nome_facolta'
-    col_isc_orig = 'ISC' if 'ISC' in df_filtered.columns else 'num_iscritti'
-    
-    try:
-        df_filtered.rename(columns={
-            col_facolta_orig: 'nome_facolta', 
-            col_isc_orig: 'num_iscritti',
-            colonna_sesso_reale: 'sesso_agg'
-        }, inplace=True)
-        
-        df_filtered['ANNO_valore'] = df_filtered['ANNO'].apply(lambda x: int(re.search(r'^\d{4}', x).group(0)))
-    except KeyError as e:
-        print_error(f"Colonna mancante durante la rinomina: {e}")
+    # Rinomine (le righe sono gia' filtrate sul totale atenei)
+    col_facolta_orig = 'DESC_FoET2013' if 'DESC_FoET2013' in df_iscritti.columns else 'nome_facolta'
+    rinomine = {col_facolta_orig: 'nome_facolta', colonna_sesso_reale: 'sesso_agg'}
+    for misura, candidati in MISURE.items():
+        col = next((c for c in candidati if c in df_iscritti.columns), None)
+        if col:
+            rinomine[col] = misura
+    misure = [m for m in MISURE if m in rinomine.values()]
+    if 'num_iscritti' not in misure:
+        print_error("Colonna iscritti (es. 'ISC') non trovata nel dataset.")
         return False
 
-    # Pivot Data
-    print_info("Esecuzione PIVOT per separare M/F...")
+    df_filtered = add_anno_valore(df_iscritti.rename(columns=rinomine))
+
+    # Solo gli anni non ancora caricati (watermark): la storia pubblicata non viene riscritta
+    anni_nuovi, accoda = anni_da_caricare('analisi', FILE_OUTPUT_ANALISI, df_filtered['ANNO_valore'].unique())
+    if not anni_nuovi:
+        print_info(f"Nessun anno nuovo: {FILE_OUTPUT_ANALISI} e' gia' aggiornato.")
+        return sync_parquet('analisi', FILE_OUTPUT_ANALISI)
+    df_filtered = df_filtered[df_filtered['ANNO_valore'].isin(anni_nuovi)]
+
+    # Aggregazione M/F di tutte le misure in un solo passaggio
+    print_info(f"Aggregazione M/F delle misure: {', '.join(misure)}...")
     try:
-        df_pivot = df_filtered.pivot_table(
-            index=['ANNO_valore', 'nome_facolta'],
-            columns='sesso_agg', 
-            values='num_iscritti',
-            aggfunc='sum'
-        ).reset_index()
+        df_pivot = aggrega_per_sesso(df_filtered, ['ANNO_valore', 'nome_facolta'], misure)
     except Exception as e:
-        print_error(f"Errore durante il pivot: {e}")
+        print_error(f"Errore durante l'aggregazione: {e}")
         return False
-
-    # Standardizzazione colonne pivot (gestione M/F)
-    # Converti colonne in lista per check case-insensitive se necessario, ma qui assumiamo M/F standard
-    for col in df_pivot.columns:
-        if str(col).strip().upper() == 'M':
-            df_pivot.rename(columns={col: 'num_iscritti_m'}, inplace=True)
-        elif str(col).strip().upper() == 'F':
-            df_pivot.rename(columns={col: 'num_iscritti_f'}, inplace=True)
-            
-    if 'num_iscritti_m' not in df_pivot.columns:
-        print_warning("Colonna M non trovata dopo il pivot. Inserisco 0.")
-        df_pivot['num_iscritti_m'] = 0
-    if 'num_iscritti_f' not in df_pivot.columns:
-        print_warning("Colonna F non trovata dopo il pivot. Inserisco 0.")
-        df_pivot['num_iscritti_f'] = 0
-
-    df_pivot[['num_iscritti_m', 'num_iscritti_f']] = df_pivot[['num_iscritti_m', 'num_iscritti_f']].fillna(0)
+    colonne_misure = [c for c in df_pivot.columns if c not in ('ANNO_valore', 'nome_facolta')]
 
     # Merge FK Anno
     anno_all_df['valore'] = anno_all_df['valore'].astype(int)
@@ -260,30 +624,188 @@ def step_3_generazione_analisi():
     )
 
     # Check integrità
-    missing_facolta = df_final[df_final['id_facolta'].isnull()]
-    if not missing_facolta.empty:
-        print_warning(f"{len(missing_facolta)} righe hanno facoltà non mappate!")
+    missing_facolta = df_final['id_facolta'].isnull() | df_final['id_anno'].isnull()
+    if missing_facolta.any():
+        print_warning(f"{int(missing_facolta.sum())} righe hanno facoltà o anno non mappati: escluse.")
+        df_final = df_final[~missing_facolta]
 
     # Selezione finale
-    analisi_final_df = df_final[['num_iscritti_m', 'num_iscritti_f', 'id_facolta', 'id_anno']].copy()
-    analisi_final_df.columns = ['num_iscritti_m', 'num_iscritti_f', 'cod_facolta', 'cod_anno']
+    analisi_final_df = df_final[colonne_misure + ['id_facolta', 'id_anno']].astype({'id_facolta': 'int64', 'id_anno': 'int64'})
+    analisi_final_df.columns = colonne_misure + ['cod_facolta', 'cod_anno']
     
-    # Generazione PK
-    analisi_final_df['id_analisi'] = range(1, len(analisi_final_df) + 1)
+    # Generazione PK: id continui rispetto alle righe gia' pubblicate
+    analisi_final_df['id_analisi'] = register_members('analisi', analisi_final_df)
     
     # Riordino colonne
-    output_cols = ['id_analisi', 'num_iscritti_m', 'num_iscritti_f', 'cod_facolta', 'cod_anno']
+    output_cols = ['id_analisi'] + colonne_misure + ['cod_facolta', 'cod_anno']
     analisi_final_df = analisi_final_df[output_cols]
     
-    return save_csv(analisi_final_df, FILE_OUTPUT_ANALISI)
+    return save_incrementale('analisi', analisi_final_df, FILE_OUTPUT_ANALISI, anni_nuovi, accoda)
+
+def step_4_generazione_atenei():
+    print_header("4. Generazione Tabella ATENEI")
+
+    if not check_file_exists(FILE_ISCRITTI):
+        return False
 
-def run_full_pipeline():
+    df_atenei = load_atenei()
+    if df_atenei is None:
+        return False
+
+    # I nomi degli atenei cambiano nel tempo: si tiene quello dell'anno piu' recente
+    print_info("Estrazione atenei univoci...")
+    atenei_df = (add_anno_valore(df_atenei)
+                 .sort_values(['cod_ateneo', 'ANNO_valore'])
+                 .drop_duplicates('cod_ateneo', keep='last')[['cod_ateneo', 'nome_ateneo']])
+    atenei_df.columns = ['codice', 'nome']
+
+    # Id stabili: gli atenei gia' registrati mantengono il proprio, i nuovi vengono accodati
+    register_members('ateneo', atenei_df.reset_index(drop=True))
+    return save_lookup(registry_members('ateneo'), FILE_OUTPUT_ATENEO)
+
+def step_5_generazione_analisi_atenei():
+    print_header("5. Generazione Tabella ANALISI PER ATENEO (M/F Split)")
+
+    if not check_file_exists(FILE_ISCRITTI): return False
+
+    for filename, step in ((FILE_OUTPUT_ANNO, step_1_generazione_anni),
+                           (FILE_OUTPUT_FACOLTA, step_2_generazione_facolta),
+                           (FILE_OUTPUT_ATENEO, step_4_generazione_atenei)):
+        if not os.path.exists(filename):
+            print_warning(f"File {filename} mancante. Provo a generarlo...")
+            if not step(): return False
+
+    df_atenei = load_atenei()
+    if df_atenei is None:
+        return False
+    anno_all_df = load_lookup(FILE_OUTPUT_ANNO)
+    facolta_lookup = load_lookup(FILE_OUTPUT_FACOLTA)
+    ateneo_lookup = load_lookup(FILE_OUTPUT_ATENEO, dtype={'codice': str})
+
+    df = add_anno_valore(df_atenei)
+    anni_nuovi, accoda = anni_da_caricare('analisi_ateneo', FILE_OUTPUT_ANALISI_ATENEO, df['ANNO_valore'].unique())
+    if not anni_nuovi:
+        print_info(f"Nessun anno nuovo: {FILE_OUTPUT_ANALISI_ATENEO} e' gia' aggiornato.")
+        return sync_parquet('analisi_ateneo', FILE_OUTPUT_ANALISI_ATENEO)
+    df = df[df['ANNO_valore'].isin(anni_nuovi)]
+
+    misure = [c for c in df_atenei.columns if c in MISURE]
+    print_info(f"Aggregazione M/F per ateneo delle misure: {', '.join(misure)}...")
+    df_wide = aggrega_per_sesso(df, ['cod_ateneo', 'ANNO_valore', 'nome_facolta'], misure)
+    colonne_misure = [f"{m}_{s.lower()}" for m in misure for s in SESSI]
+
+    # FK risolte sui codici (lookup vettoriale, senza merge sulle stringhe)
+    df_wide['cod_ateneo'] = lookup_ids(df_wide['cod_ateneo'], ateneo_lookup['codice'], ateneo_lookup['id_ateneo'])
+    df_wide['cod_anno'] = lookup_ids(df_wide['ANNO_valore'], anno_all_df['valore'].astype(int), anno_all_df['id_anno'])
+    df_wide['cod_facolta'] = lookup_ids(df_wide['nome_facolta'].astype(str), facolta_lookup['nome'].astype(str),
+                                        facolta_lookup['id_facolta'])
+
+    fk = ['cod_ateneo', 'cod_anno', 'cod_facolta']
+    non_mappate = df_wide[fk].isna().any(axis=1)
+    if non_mappate.any():
+        print_warning(f"{int(non_mappate.sum())} righe con ateneo, anno o facoltà non mappati: escluse.")
+        df_wide = df_wide[~non_mappate]
+
+    analisi_df = df_wide[colonne_misure + fk].sort_values(fk, ignore_index=True)
+    analisi_df['id_analisi_ateneo'] = register_members('analisi_ateneo', analisi_df)
+
+    output_cols = ['id_analisi_ateneo'] + colonne_misure + ['cod_ateneo', 'cod_facolta', 'cod_anno']
+    return save_incrementale('analisi_ateneo', analisi_df[output_cols], FILE_OUTPUT_ANALISI_ATENEO, anni_nuovi, accoda)
+
+def parquet_outputs(tabella):
+    """Output aggiuntivo dello step con --parquet: il `_metadata` del dataset."""
+    return [metadata_path(parquet_dir(tabella))] if parquet_enabled() else []
+
+def build_pipeline():
+    """
+    Grafo degli step: anni, facolta' e atenei sono indipendenti; l'analisi nazionale
+    dipende da anni e facolta', quella per ateneo anche dagli atenei.
+    """
+    return [
+        Step('step_1_generazione_anni', step_1_generazione_anni,
+             inputs=[FILE_ISCRITTI, years_path()], outputs=[FILE_OUTPUT_ANNO]),
+        Step('step_2_generazione_facolta', step_2_generazione_facolta,
+             inputs=[FILE_ISCRITTI], outputs=[FILE_OUTPUT_FACOLTA]),
+        Step('step_3_generazione_analisi', step_3_generazione_analisi,
+             deps=['step_1_generazione_anni', 'step_2_generazione_facolta'],
+             inputs=[FILE_ISCRITTI, FILE_OUTPUT_ANNO, FILE_OUTPUT_FACOLTA],
+             outputs=[FILE_OUTPUT_ANALISI] + parquet_outputs('analisi'), params=['RIGENERA_TUTTO']),
+        Step('step_4_generazione_atenei', step_4_generazione_atenei,
+             inputs=[FILE_ISCRITTI], outputs=[FILE_OUTPUT_ATENEO], params=['PROCESSI_ATENEI']),
+        Step('step_5_generazione_analisi_atenei', step_5_generazione_analisi_atenei,
+             deps=['step_1_generazione_anni', 'step_2_generazione_facolta', 'step_4_generazione_atenei'],
+             inputs=[FILE_ISCRITTI, FILE_OUTPUT_ANNO, FILE_OUTPUT_FACOLTA, FILE_OUTPUT_ATENEO],
+             outputs=[FILE_OUTPUT_ANALISI_ATENEO] + parquet_outputs('analisi_ateneo'),
+             params=['RIGENERA_TUTTO', 'PROCESSI_ATENEI']),
+    ]
+
+def run_full_pipeline(force=False, jobs=2, steps=None):
+    """
+    Esegue la pipeline (o gli step indicati con le loro dipendenze) saltando gli step
+    il cui codice e i cui input non sono cambiati. Restituisce gli esiti per step.
+    Con `force` anche le tabelle di analisi vengono riscritte per intero, ignorando il watermark.
+    Senza `steps` gli step per ateneo vengono eseguiti solo con INCLUDI_ATENEI.
+    """
+    global RIGENERA_TUTTO
     print_header("ESEGUENDO PIPELINE COMPLETA")
-    if step_1_generazione_anni():
-        time.sleep(1)
-        if step_2_generazione_facolta():
-            time.sleep(1)
-            step_3_generazione_analisi()
+    if not check_file_exists(FILE_ISCRITTI):
+        return {}
+    if steps is None and not INCLUDI_ATENEI:
+        steps = [s.name for s in build_pipeline() if s.name not in STEP_ATENEI]
+    strumenti = Instrumenter('MUR', FILE_REPORT_ESECUZIONE)
+    RIGENERA_TUTTO = force
+    try:
+        esiti = DagExecutor(build_pipeline(), state_file=FILE_STATO_PIPELINE, jobs=jobs, log=print_info,
+                            instrument=strumenti).run(steps, force)
+    finally:
+        RIGENERA_TUTTO = False
+    if all(esito in (ESEGUITO, SALTATO) for esito, _ in esiti.values()):
+        print_success("Pipeline completata.")
+    else:
+        print_error("Pipeline non completata: " + ', '.join(n for n, (e, _) in esiti.items() if e not in (ESEGUITO, SALTATO)))
+    return esiti
+
+# --- RIGA DI COMANDO ---
+
+def run_batch(steps=None, force=False, jobs=2):
+    """
+    Esecuzione senza interazione (CLI e run_all.py): restituisce gli esiti per step.
+    Anche i processi dell'aggregazione per ateneo sono limitati a `jobs`: run_all.py
+    esegue le pipeline in parallelo e ognuna non deve occupare tutte le CPU.
+    """
+    global PROCESSI_ATENEI
+    PROCESSI_ATENEI = max(1, min(PROCESSI_ATENEI, jobs))
+    return run_full_pipeline(force, jobs, steps)
+
+def configura_percorsi(input_path=None, output_dir=None):
+    """
+    Percorsi per l'esecuzione da riga di comando; restituisce il file sorgente.
+    Con `output_dir` anche il registro condiviso degli anni viene tenuto (e creato) li'.
+    """
+    global FILE_ISCRITTI
+    if input_path:
+        FILE_ISCRITTI = input_path
+    configure_anni(os.path.join(output_dir, FILE_ANNI) if output_dir else None)
+    relocate(globals(), ['FILE_OUTPUT_ANNO', 'FILE_OUTPUT_FACOLTA', 'FILE_OUTPUT_ANALISI', 'FILE_OUTPUT_ATENEO',
+                         'FILE_OUTPUT_ANALISI_ATENEO', 'FILE_OUTPUT_PROFILO', 'DIR_REGISTRO', 'DIR_PARQUET', 'FILE_WATERMARK',
+                         'FILE_STATO_PIPELINE', 'FILE_REPORT_ESECUZIONE'], output_dir)
+    return FILE_ISCRITTI
+
+def aggiungi_opzioni(parser):
+    parser.add_argument('--atenei', action='store_true',
+                        help="esegue anche gli step per ateneo (4-5), che richiedono una seconda scansione "
+                             "completa del file sorgente")
+
+def applica_opzioni(parser, args):
+    global INCLUDI_ATENEI
+    if args.atenei:
+        INCLUDI_ATENEI = True
+
+def main_cli(argv=None):
+    """Esecuzione senza menu (es. da cron): python MUR.py --steps 3 --quiet"""
+    return run_cli(argv, 'MUR.py', "Pipeline ETL degli iscritti MUR (anni, facolta', atenei, analisi M/F).",
+                   [s.name for s in build_pipeline()], FILE_ISCRITTI, Colors, configura_percorsi, run_batch,
+                   aggiungi_opzioni, applica_opzioni)
 
 # --- MENU ---
 
@@ -297,8 +819,12 @@ def main_menu():
         print(f" {Colors.CYAN}1.{Colors.ENDC} Genera Tabella ANNI")
         print(f" {Colors.CYAN}2.{Colors.ENDC} Genera Tabella FACOLTA'")
         print(f" {Colors.CYAN}3.{Colors.ENDC} Genera Tabella ANALISI (M/F)")
+        print(f" {Colors.CYAN}4.{Colors.ENDC} Genera Tabella ATENEI")
+        print(f" {Colors.CYAN}5.{Colors.ENDC} Genera Tabella ANALISI PER ATENEO (M/F)")
         print("-" * 38)
-        print(f" {Colors.GREEN}{Colors.BOLD}9. ESEGUI PIPELINE COMPLETA{Colors.ENDC}")
+        print(f" {Colors.GREEN}{Colors.BOLD}9. ESEGUI PIPELINE COMPLETA{Colors.ENDC} (salta gli step aggiornati)")
+        print(f" {Colors.GREEN}A. ESEGUI PIPELINE COMPLETA con le tabelle per ateneo{Colors.ENDC}")
+        print(f" {Colors.WARNING}F. ESEGUI PIPELINE COMPLETA forzando la rigenerazione{Colors.ENDC}")
         print(f" {Colors.FAIL}0. Esci{Colors.ENDC}")
         print("-" * 38)
         
@@ -310,9 +836,17 @@ def main_menu():
             step_2_generazione_facolta()
         elif choice == '3':
             step_3_generazione_analisi()
+        elif choice == '4':
+            step_4_generazione_atenei()
+        elif choice == '5':
+            step_5_generazione_analisi_atenei()
         elif choice == '9':
+            run_full_pipeline()
+        elif choice in ('a', 'A'):
+            run_full_pipeline(steps=[s.name for s in build_pipeline()])
+        elif choice in ('f', 'F'):
             if confirm_action("Sei sicuro di voler rigenerare TUTTI i file?"):
-                run_full_pipeline()
+                run_full_pipeline(force=True)
         elif choice == '0':
             print(f"\n{Colors.CYAN}Chiudo l'applicazione. A presto! 👋{Colors.ENDC}")
             sys.exit()
@@ -322,6 +856,8 @@ def main_menu():
         input(f"\n{Colors.CYAN}Premi INVIO per tornare al menu...{Colors.ENDC}")
 
 if __name__ == "__main__":
+    if not is_interactive():
+        sys.exit(main_cli())
     try:
         main_menu()
     except KeyboardInterrupt:
@@ -0,0 +1 @@
+"""Generatori di dati sintetici e suite di benchmark di scala per le pipeline ETL."""
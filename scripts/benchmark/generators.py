@@ -0,0 +1,169 @@
+"""
+Generatori di file sorgente sintetici con lo stesso schema di quelli reali.
+
+*   DNF.csv: le righe del campione in DNF/DNF.csv vengono replicate; dalla seconda
+    copia in poi il nome azienda riceve un suffisso (" #2", " #3", ...) per restare univoco.
+    Settori e regioni restano quelli reali, come accadrebbe con piu' aziende.
+*   estat.csv: le serie del campione in EUROSTATS/estat.csv vengono replicate con un
+    codice geo derivato (AT -> AT2, AT3, ...); valori e flag Eurostat sono quelli originali.
+*   bdg_serie_iscritti.csv: nessun campione nel repository, il file viene generato da
+    zero (anni accademici x atenei x aree FoET2013 x sesso) con le righe 'TOTALE ATENEI'
+    pari alla somma degli atenei. Con scala 1 ha 20 atenei e 10 anni (4620 righe).
+
+A scala 1 DNF ed Eurostat coincidono con i campioni. I file vengono scritti a blocchi,
+quindi anche le scale piu' grandi (10000x) non richiedono di tenere tutto in memoria.
+
+Uso (dalla cartella scripts/):
+    python -m benchmark.generators dnf --scala 100 --output /tmp/DNF.csv
+"""
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+CARTELLA_SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CAMPIONE_DNF = os.path.join(CARTELLA_SCRIPTS, 'DNF', 'DNF.csv')
+CAMPIONE_ESTAT = os.path.join(CARTELLA_SCRIPTS, 'EUROSTATS', 'estat.csv')
+
+RIGHE_PER_BLOCCO = 50_000
+
+# Parametri del file MUR a scala 1
+MUR_ATENEI = 20
+MUR_ANNI = 10
+MUR_PRIMO_ANNO = 2013
+MUR_AREE_FOET2013 = [
+    'Agriculture, forestry, fisheries and veterinary',
+    'Arts and humanities',
+    'Business, administration and law',
+    'Education',
+    'Engineering, manufacturing and construction',
+    'Generic programmes and qualifications',
+    'Health and welfare',
+    'Information and Communication Technologies',
+    'Natural sciences, mathematics and statistics',
+    'Services',
+    'Social sciences, journalism and information',
+]
+MUR_SESSI = ['M', 'F']
+MUR_TOTALE = 'TOTALE ATENEI'
+
+
+def _blocchi(n, dimensione):
+    for inizio in range(0, n, dimensione):
+        yield inizio, min(inizio + dimensione, n)
+
+
+def generate_dnf(path, scala=1, campione=CAMPIONE_DNF):
+    """Scrive un DNF.csv con circa scala * righe del campione; restituisce il numero di righe."""
+    base = pd.read_csv(campione, sep=';', dtype=str, keep_default_na=False)
+    n_base = len(base)
+    n = max(1, int(round(n_base * scala)))
+    valori = base.to_numpy()
+    col_nome = base.columns.get_loc('Aziende_nel_Database')
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        intestazione = True
+        for inizio, fine in _blocchi(n, RIGHE_PER_BLOCCO):
+            indici = np.arange(inizio, fine)
+            blocco = pd.DataFrame(valori[indici % n_base], columns=base.columns)
+            copia = indici // n_base
+            suffisso = np.where(copia == 0, '', ' #' + (copia + 1).astype(str))
+            blocco.iloc[:, col_nome] = blocco.iloc[:, col_nome] + suffisso
+            blocco.to_csv(f, sep=';', index=False, header=intestazione, quoting=csv.QUOTE_ALL, lineterminator='\n')
+            intestazione = False
+    return n
+
+
+def generate_estat(path, scala=1, campione=CAMPIONE_ESTAT):
+    """Scrive un estat.csv con circa scala * serie del campione; restituisce il numero di serie."""
+    with open(campione, encoding='latin1', newline='') as f:
+        righe = f.read().splitlines(keepends=True)
+    intestazione, serie = righe[0], [r for r in righe[1:] if r.strip()]
+    chiavi, resto = zip(*(r.split('\t', 1) for r in serie))
+    n = max(1, int(round(len(serie) * scala)))
+
+    with open(path, 'w', encoding='latin1', newline='') as f:
+        f.write(intestazione)
+        for inizio, fine in _blocchi(n, RIGHE_PER_BLOCCO):
+            blocco = []
+            for i in range(inizio, fine):
+                copia, j = divmod(i, len(serie))
+                # Il codice geo e' l'ultimo campo della chiave composita
+                chiave = chiavi[j] if copia == 0 else f"{chiavi[j]}{copia + 1}"
+                blocco.append(f"{chiave}\t{resto[j]}")
+            f.writelines(blocco)
+    return n
+
+
+def generate_mur(path, scala=1, seed=0, anni=MUR_ANNI):
+    """Scrive un bdg_serie_iscritti.csv con round(20 * scala) atenei; restituisce il numero di righe."""
+    n_atenei = max(1, int(round(MUR_ATENEI * scala)))
+    etichette_anni = np.array([f"{a}/{a + 1}" for a in range(MUR_PRIMO_ANNO, MUR_PRIMO_ANNO + anni)])
+    n_aree, n_sessi = len(MUR_AREE_FOET2013), len(MUR_SESSI)
+    celle = anni * n_aree * n_sessi
+    aree = np.array(MUR_AREE_FOET2013)
+    sessi = np.array(MUR_SESSI)
+    totali = np.zeros((3, celle), dtype=np.int64)
+    # Combinazioni anno x area x sesso, ripetute per ogni ateneo del blocco
+    anno_idx, area_idx, sesso_idx = (g.ravel() for g in np.meshgrid(
+        np.arange(anni), np.arange(n_aree), np.arange(n_sessi), indexing='ij'))
+
+    def _scrivi(f, k, cod, nome, isc, imm, lau, intestazione):
+        """Scrive k atenei consecutivi (k * celle righe)."""
+        pd.DataFrame({
+            'ANNO': np.tile(etichette_anni[anno_idx], k), 'AteneoCOD': cod, 'AteneoNOME': nome,
+            'DESC_FoET2013': np.tile(aree[area_idx], k), 'SEX': np.tile(sessi[sesso_idx], k),
+            'ISC': isc, 'IMM': imm, 'LAU': lau,
+        }).to_csv(f, sep=';', index=False, header=intestazione, lineterminator='\n')
+
+    atenei_per_blocco = max(1, RIGHE_PER_BLOCCO // celle)
+    righe = 0
+    with open(path, 'w', encoding='latin-1', newline='') as f:
+        for inizio, fine in _blocchi(n_atenei, atenei_per_blocco):
+            rng = np.random.default_rng([seed, inizio])
+            k = fine - inizio
+            # Dimensione dell'ateneo (log-normale) e peso casuale di ogni cella anno x area x sesso
+            dimensione = rng.lognormal(mean=6.0, sigma=1.0, size=(k, 1))
+            isc = rng.poisson(dimensione * rng.uniform(0.2, 1.0, size=(k, celle))).astype(np.int64)
+            imm = rng.binomial(isc, 0.22)
+            lau = rng.binomial(isc, 0.16)
+            totali += np.stack([isc.sum(axis=0), imm.sum(axis=0), lau.sum(axis=0)])
+
+            numeri = np.arange(inizio, fine) + 1
+            cod = np.repeat(np.char.zfill(numeri.astype(str), 5), celle)
+            nome = np.repeat(np.char.add('Università degli Studi n. ', numeri.astype(str)), celle)
+            _scrivi(f, k, cod, nome, isc.ravel(), imm.ravel(), lau.ravel(), righe == 0)
+            righe += k * celle
+
+        _scrivi(f, 1, '00', MUR_TOTALE, totali[0], totali[1], totali[2], False)
+    return righe + celle
+
+
+GENERATORI = {
+    'dnf': (generate_dnf, 'DNF.csv'),
+    'mur': (generate_mur, 'bdg_serie_iscritti.csv'),
+    'estat': (generate_estat, 'estat.csv'),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera file sorgente sintetici per i benchmark di scala.")
+    parser.add_argument('dataset', choices=list(GENERATORI))
+    parser.add_argument('--scala', type=float, default=1, help="moltiplicatore rispetto al campione (1-10000)")
+    parser.add_argument('--output', help="file da scrivere (default: nome del file reale nella cartella corrente)")
+    args = parser.parse_args(argv)
+    if args.scala <= 0:
+        parser.error("--scala deve essere positiva")
+
+    funzione, nome_file = GENERATORI[args.dataset]
+    output = args.output or nome_file
+    righe = funzione(output, args.scala)
+    print(f"{output}: {righe} righe, {os.path.getsize(output) / 1e6:.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
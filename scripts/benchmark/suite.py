@@ -0,0 +1,205 @@
+"""
+Benchmark di scala degli step delle pipeline DNF, MUR ed EUROSTATS.
+
+Per ogni dataset e scala viene generato (una volta, poi riusato) un file sorgente
+sintetico con benchmark.generators; la pipeline viene quindi eseguita step per step
+in un processo nuovo, in una cartella vuota, con le stesse misure del report di
+esecuzione (common.instrument): tempo reale, tempo CPU, picco di RSS, righe e byte
+letti/scritti. I risultati vengono salvati in JSON.
+
+Il picco di RSS per step si misura azzerando VmHWM (/proc/self/clear_refs, Linux);
+dove non e' possibile si riporta il picco del processo fino a quello step
+(`rss_per_step: false` nel JSON).
+
+Uso (dalla cartella scripts/):
+    python -m benchmark.suite --scale 1,10,100 --json benchmark.json
+    python -m benchmark.suite --dataset dnf --scale 1000,10000 --ripetizioni 3
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from benchmark.generators import CARTELLA_SCRIPTS, generate_dnf, generate_estat, generate_mur
+from common.instrument import Instrumenter, peak_rss_mb, reset_peak_rss
+
+# dataset -> (cartella pipeline, modulo, generatore, file sorgente)
+DATASET = {
+    'dnf': ('DNF', 'AnalyzeDNF', generate_dnf, 'DNF.csv'),
+    'mur': ('MUR', 'MUR', generate_mur, 'bdg_serie_iscritti.csv'),
+    'estat': ('EUROSTATS', 'AnalyzeESTAT', generate_estat, 'estat.csv'),
+}
+SCALE_DEFAULT = '1,10,100'
+CARTELLA_LAVORO = os.path.join(tempfile.gettempdir(), 'genderhack_benchmark')
+
+
+# --- ESECUZIONE (NEL PROCESSO FIGLIO) ---
+
+def _steps(dataset, modulo):
+    if dataset == 'estat':
+        return modulo.EuroStatsETL().build_pipeline()
+    return modulo.build_pipeline()
+
+
+def measure_pipeline(dataset, input_path, cartella_run):
+    """Esegue tutti gli step della pipeline in `cartella_run` e ne restituisce le misure."""
+    cartella, nome_modulo, _, _ = DATASET[dataset]
+    cartella = os.path.join(CARTELLA_SCRIPTS, cartella)
+    sys.path.insert(0, cartella)
+    shutil.rmtree(cartella_run, ignore_errors=True)
+    os.makedirs(cartella_run)
+    os.chdir(cartella_run)
+
+    misure = []
+    with open(os.devnull, 'w') as nullo, contextlib.redirect_stdout(nullo):
+        modulo = importlib.import_module(nome_modulo)
+        # Output (e registro degli anni) nella cartella del run: il registro del repository resta intatto
+        modulo.configura_percorsi(input_path, cartella_run)
+        rss_base = peak_rss_mb()
+        per_step = reset_peak_rss()
+        strumenti = Instrumenter(dataset)
+        for step in _steps(dataset, modulo):
+            with strumenti.step(step.name) as metriche:
+                try:
+                    esito = step.func() is not False
+                except Exception:
+                    esito = False
+            misure.append({'step': step.name, 'ok': esito, **metriche.to_dict()})
+        strumenti.finish()
+    return {'rss_import_mb': round(rss_base, 1), 'rss_per_step': per_step, 'steps': misure}
+
+
+# --- SUITE ---
+
+def prepare_input(dataset, scala, cartella_lavoro, rigenera=False):
+    """Genera (o riusa) il file sorgente sintetico; restituisce (path, righe, secondi di generazione)."""
+    _, _, generatore, nome_file = DATASET[dataset]
+    cartella = os.path.join(cartella_lavoro, f"{dataset}_{scala:g}x", 'input')
+    path = os.path.join(cartella, nome_file)
+    meta = path + '.righe'
+    if not rigenera and os.path.exists(path) and os.path.exists(meta):
+        with open(meta) as f:
+            return path, int(f.read()), None
+
+    os.makedirs(cartella, exist_ok=True)
+    inizio = time.perf_counter()
+    righe = generatore(path, scala)
+    secondi = time.perf_counter() - inizio
+    with open(meta, 'w') as f:
+        f.write(str(righe))
+    return path, righe, round(secondi, 3)
+
+
+def run_suite(datasets, scale, cartella_lavoro=CARTELLA_LAVORO, ripetizioni=1, rigenera=False, log=print):
+    risultati = []
+    contesto = multiprocessing.get_context('spawn')
+    for dataset in datasets:
+        for scala in scale:
+            input_path, righe, secondi_gen = prepare_input(dataset, scala, cartella_lavoro, rigenera)
+            cartella_run = os.path.join(os.path.dirname(os.path.dirname(input_path)), 'run')
+            esecuzioni = []
+            for _ in range(ripetizioni):
+                # Un processo nuovo per ogni esecuzione: RSS e cache partono da zero
+                with ProcessPoolExecutor(max_workers=1, mp_context=contesto, max_tasks_per_child=1) as pool:
+                    esecuzioni.append(pool.submit(measure_pipeline, dataset, input_path, cartella_run).result())
+
+            steps = []
+            for i, misura in enumerate(esecuzioni[0]['steps']):
+                tutte = [e['steps'][i] for e in esecuzioni]
+                steps.append({
+                    'step': misura['step'],
+                    'ok': all(m['ok'] for m in tutte),
+                    'secondi': min(m['secondi'] for m in tutte),
+                    'secondi_mediana': round(float(np.median([m['secondi'] for m in tutte])), 4),
+                    'cpu_secondi': min(m['cpu_secondi'] for m in tutte),
+                    'rss_picco_mb': round(max(m['rss_picco_mb'] for m in tutte), 1),
+                    'righe_in': misura['righe_in'],
+                    'righe_out': misura['righe_out'],
+                    'byte_letti': misura['byte_letti'],
+                    'byte_scritti': misura['byte_scritti'],
+                })
+            risultato = {
+                'dataset': dataset,
+                'scala': scala,
+                'righe_input': righe,
+                'mb_input': round(os.path.getsize(input_path) / 1e6, 2),
+                'secondi_generazione': secondi_gen,
+                'ripetizioni': ripetizioni,
+                'rss_import_mb': esecuzioni[0]['rss_import_mb'],
+                'rss_per_step': esecuzioni[0]['rss_per_step'],
+                'secondi_totali': round(sum(s['secondi'] for s in steps), 4),
+                'steps': steps,
+            }
+            risultati.append(risultato)
+            log(format_result(risultato))
+    return risultati
+
+
+def format_result(risultato):
+    righe = [f"\n{risultato['dataset']} {risultato['scala']:g}x: {risultato['righe_input']} righe, "
+             f"{risultato['mb_input']} MB, totale {risultato['secondi_totali']:.2f}s"]
+    larghezza = max(len(s['step']) for s in risultato['steps'])
+    for s in risultato['steps']:
+        stato = '' if s['ok'] else '  FALLITO'
+        righe.append(f"  {s['step']:<{larghezza}}  {s['secondi']:9.3f}s  cpu {s['cpu_secondi']:9.3f}s  "
+                     f"rss {s['rss_picco_mb']:8.1f} MB{stato}")
+    return '\n'.join(righe)
+
+
+def machine_info():
+    info = {
+        'python': platform.python_version(),
+        'piattaforma': platform.platform(),
+        'cpu': os.cpu_count(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+    }
+    try:
+        import pyarrow
+        info['pyarrow'] = pyarrow.__version__
+    except ImportError:
+        info['pyarrow'] = None
+    return info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di scala degli step delle pipeline ETL.")
+    parser.add_argument('--dataset', default=','.join(DATASET), help=f"dataset separati da virgola ({', '.join(DATASET)})")
+    parser.add_argument('--scale', default=SCALE_DEFAULT, help=f"scale separate da virgola, 1-10000 (default: {SCALE_DEFAULT})")
+    parser.add_argument('--ripetizioni', type=int, default=1, help="esecuzioni per misura (si riporta il tempo minimo)")
+    parser.add_argument('--lavoro', default=CARTELLA_LAVORO, help=f"cartella dei file generati (default: {CARTELLA_LAVORO})")
+    parser.add_argument('--rigenera', action='store_true', help="rigenera i file sorgente anche se gia' presenti")
+    parser.add_argument('--json', default='benchmark.json', help="file dei risultati (default: benchmark.json)")
+    args = parser.parse_args(argv)
+
+    datasets = [d.strip().lower() for d in args.dataset.split(',')]
+    if any(d not in DATASET for d in datasets):
+        parser.error(f"dataset validi: {', '.join(DATASET)}")
+    try:
+        scale = [float(s) for s in args.scale.split(',')]
+    except ValueError:
+        parser.error("--scale deve essere un elenco di numeri")
+    if any(s <= 0 for s in scale) or args.ripetizioni < 1:
+        parser.error("scale e ripetizioni devono essere positive")
+
+    risultati = run_suite(datasets, scale, os.path.abspath(args.lavoro), args.ripetizioni, args.rigenera)
+    with open(args.json, 'w', encoding='utf-8') as f:
+        json.dump({'macchina': machine_info(), 'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'risultati': risultati}, f, ensure_ascii=False, indent=2)
+    print(f"\nRisultati salvati in {args.json}")
+    return 0 if all(s['ok'] for r in risultati for s in r['steps']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Moduli condivisi tra le pipeline ETL (DNF, MUR, EUROSTATS)."""
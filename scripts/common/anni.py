@@ -0,0 +1,108 @@
+"""
+Registro condiviso degli id degli anni, l'unica dimensione comune a DNF, MUR ed EUROSTATS.
+
+Le tre pipeline leggono ed estendono lo stesso file (id_anno, valore): un anno riceve
+un id una sola volta, dalla prima pipeline che lo incontra, e le altre riusano quello.
+Cosi' cod_anno ha lo stesso significato in tutte le fact table (load_sqlite.py rifiuta
+id discordanti) e nessuna pipeline assegna per conto suo id_max + 1.
+
+Le pipeline possono girare in parallelo (run_all.py): l'estensione avviene sotto un lock
+su file (<registro>.lock) e il file viene sostituito atomicamente (tmp + os.replace),
+quindi chi legge vede sempre una versione completa. Se il file configurato non esiste
+viene creato a partire dal registro del repository (ANNI_BASE).
+"""
+import contextlib
+import os
+import time
+
+import pandas as pd
+
+from common.instrument import record_read, record_write
+
+NOME_FILE = 'anno_conformato.csv'
+ANNI_BASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), NOME_FILE)
+ATTESA_LOCK_SECONDI = 60
+
+IMPOSTAZIONI = {'file': ANNI_BASE}
+
+
+def configure(path=None):
+    """Registro da usare per le esecuzioni successive (None = quello del repository)."""
+    IMPOSTAZIONI['file'] = path or ANNI_BASE
+
+
+def years_path():
+    return IMPOSTAZIONI['file']
+
+
+def missing_years():
+    """Descrizione del registro mancante se non esistono ne' quello configurato ne' ANNI_BASE, altrimenti None."""
+    if os.path.exists(years_path()) or os.path.exists(ANNI_BASE):
+        return None
+    if os.path.abspath(years_path()) == ANNI_BASE:
+        return ANNI_BASE
+    return f"{years_path()} (ne' la base {ANNI_BASE} da cui crearlo)"
+
+
+def load_years():
+    """Anni registrati (id_anno, valore interi), ordinati per id."""
+    path = years_path() if os.path.exists(years_path()) else ANNI_BASE
+    anni = pd.read_csv(path, dtype={'id_anno': 'int64', 'valore': 'int64'})
+    record_read(path, len(anni))
+    return anni.sort_values('id_anno', ignore_index=True)
+
+
+@contextlib.contextmanager
+def _lock(path):
+    """Lock tra processi: il file <path>.lock esiste finche' una pipeline sta scrivendo."""
+    lock = path + '.lock'
+    scadenza = time.monotonic() + ATTESA_LOCK_SECONDI
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.monotonic() > scadenza:
+                raise TimeoutError(f"{lock} presente da oltre {ATTESA_LOCK_SECONDI}s: eliminarlo "
+                                   "se nessuna pipeline e' in esecuzione")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock)
+
+
+def register_years(anni):
+    """
+    Aggiunge al registro gli `anni` che non contiene, in ordine crescente e con id
+    successivi al massimo. Restituisce (registro completo, anni aggiunti).
+    """
+    path = years_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with _lock(path):
+        registro = load_years()
+        nuovi = sorted(set(int(a) for a in anni) - set(registro['valore'].tolist()))
+        if nuovi or not os.path.exists(path):
+            prossimo = int(registro['id_anno'].max()) + 1 if len(registro) else 1
+            aggiunti = pd.DataFrame({'id_anno': range(prossimo, prossimo + len(nuovi)), 'valore': nuovi},
+                                    dtype='int64')
+            registro = pd.concat([registro, aggiunti], ignore_index=True)
+            temporaneo = path + '.tmp'
+            registro.to_csv(temporaneo, index=False, lineterminator='\n')
+            os.replace(temporaneo, path)
+            record_write(path, len(registro))
+    return registro, nuovi
+
+
+def conform_registry(registro, lookup=None, nome='anno'):
+    """
+    Allinea la tabella `nome` di un KeyRegistry al registro condiviso (vedi KeyRegistry.conform).
+    ValueError se un anno ha nel KeyRegistry un id diverso da quello condiviso.
+    """
+    lookup = load_years() if lookup is None else lookup
+    conflitti = registro.conform(nome, lookup, 'id_anno', ['valore'])
+    if len(conflitti):
+        coppie = ', '.join(f"{r.id_anno}={r.valore}" for r in conflitti.itertuples())
+        raise ValueError(f"anni in conflitto con il registro condiviso {os.path.normpath(years_path())} "
+                         f"({coppie}): gli id_anno devono coincidere in DNF, MUR ed EUROSTATS")
@@ -0,0 +1,76 @@
+"""
+Passaggio delle tabelle intermedie tra gli step in formato Arrow IPC (Feather).
+
+Le tabelle di lookup (anni, regioni, facolta', ...) restano esportate in CSV per
+l'import SQL, ma accanto a ogni CSV viene scritta la stessa tabella in Arrow IPC
+non compresso (regione_export.csv -> regione_export.arrow). Gli step successivi la
+aprono con memory map: nessun parsing del testo e nessuna inferenza dei tipi, e le
+colonne mantengono i dtype con cui lo step precedente le ha prodotte.
+
+Il file Arrow registra nei metadati l'impronta (mtime, dimensione) del CSV da cui
+deriva: se il CSV viene modificato o riscritto senza di lui, il file Arrow non viene
+usato e si rilegge il CSV. Senza pyarrow si usano soltanto i CSV.
+"""
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+ESTENSIONE = '.arrow'
+CHIAVE_IMPRONTA = b'impronta_csv'
+
+
+def sidecar_path(path):
+    """File Arrow associato al CSV `path` (stesso nome, estensione .arrow)."""
+    return os.path.splitext(path)[0] + ESTENSIONE
+
+
+def _impronta(path):
+    st = os.stat(path)
+    return f"{st.st_mtime_ns}:{st.st_size}".encode()
+
+
+def write_sidecar(df, path):
+    """
+    Scrive `df` in Arrow IPC accanto al CSV `path` (gia' salvato), legandolo alla sua
+    impronta. Restituisce False se pyarrow manca o la scrittura non riesce: in quel
+    caso gli step successivi leggono il CSV.
+    """
+    if not HAS_PYARROW:
+        return False
+    destinazione = sidecar_path(path)
+    temporaneo = destinazione + '.tmp'
+    try:
+        tabella = pa.Table.from_pandas(df, preserve_index=False)
+        metadati = {**(tabella.schema.metadata or {}), CHIAVE_IMPRONTA: _impronta(path)}
+        # Non compresso: il file si puo' mappare in memoria senza decompressione
+        feather.write_feather(tabella.replace_schema_metadata(metadati), temporaneo, compression='uncompressed')
+        os.replace(temporaneo, destinazione)
+    except (OSError, pa.ArrowException):
+        # Es. Windows: il file precedente e' ancora mappato da un altro step
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+        return False
+    return True
+
+
+def read_sidecar(path):
+    """
+    DataFrame dal file Arrow del CSV `path`, letto con memory map; None se il file
+    Arrow manca, non corrisponde piu' al CSV o pyarrow non e' installato.
+    """
+    destinazione = sidecar_path(path)
+    if not HAS_PYARROW or not os.path.exists(destinazione) or not os.path.exists(path):
+        return None
+    try:
+        tabella = feather.read_table(destinazione, memory_map=True)
+    except (OSError, pa.ArrowException):
+        return None
+    if (tabella.schema.metadata or {}).get(CHIAVE_IMPRONTA) != _impronta(path):
+        return None
+    return tabella.to_pandas(split_blocks=True)
+
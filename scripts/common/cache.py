@@ -0,0 +1,108 @@
+"""
+Cache in-process dei DataFrame condivisi tra gli step di una pipeline.
+
+Ogni voce e' legata all'impronta dei file da cui deriva (mtime, dimensione e hash
+del contenuto): se uno dei file cambia su disco la voce viene scartata e riletta,
+cosi' anche le esecuzioni dei singoli step dal menu restano corrette.
+"""
+import hashlib
+import os
+import threading
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path):
+    """Hash (blake2b) del contenuto del file, letto a blocchi."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for blocco in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+def file_fingerprint(path, previous=None):
+    """
+    Impronta (mtime_ns, size, digest) di un file.
+    Se mtime e dimensione coincidono con `previous` l'hash non viene ricalcolato.
+    """
+    st = os.stat(path)
+    if previous is not None and previous[:2] == (st.st_mtime_ns, st.st_size):
+        return previous
+    return (st.st_mtime_ns, st.st_size, file_digest(path))
+
+
+class StageCache:
+    """
+    Memorizza i risultati degli step (DataFrame, lookup) indicizzati per chiave.
+
+    `lock` protegge solo il dizionario delle voci; il calcolo di una voce (`load`) e'
+    serializzato per chiave, quindi step paralleli che leggono chiavi diverse non si attendono.
+    """
+
+    def __init__(self):
+        self._voci = {}
+        self._in_calcolo = {}
+        self.lock = threading.RLock()
+
+    def _is_valid(self, impronte):
+        for path, impronta in impronte.items():
+            if not os.path.exists(path):
+                return False
+            st = os.stat(path)
+            if (st.st_mtime_ns, st.st_size) == impronta[:2]:
+                continue
+            # mtime o dimensione cambiati: il file e' ancora valido solo se il contenuto e' identico
+            if st.st_size != impronta[1] or file_digest(path) != impronta[2]:
+                return False
+            impronte[path] = (st.st_mtime_ns, st.st_size, impronta[2])
+        return True
+
+    def get(self, key):
+        """Restituisce il valore in cache oppure None se assente o non piu' valido."""
+        with self.lock:
+            voce = self._voci.get(key)
+            if voce is None:
+                return None
+            valore, impronte = voce
+            if not self._is_valid(impronte):
+                del self._voci[key]
+                return None
+            return valore
+
+    def put(self, key, value, paths, impronte=None):
+        """Registra `value` legandolo ai file in `paths`."""
+        with self.lock:
+            if impronte is None:
+                impronte = {p: file_fingerprint(p) for p in paths}
+            self._voci[key] = (value, impronte)
+        return value
+
+    def load(self, key, paths, loader):
+        """
+        Restituisce il valore in cache o lo calcola con `loader()`.
+        L'impronta dei file viene presa prima della lettura, cosi' una modifica
+        concorrente invalida la voce invece di restare nascosta. Chi chiede la stessa
+        chiave durante il calcolo attende e riusa il risultato, senza rileggere i file.
+        """
+        valore = self.get(key)
+        if valore is not None:
+            return valore
+        with self.lock:
+            lock_chiave = self._in_calcolo.setdefault(key, threading.RLock())
+        with lock_chiave:
+            valore = self.get(key)
+            if valore is not None:
+                return valore
+            impronte = {p: file_fingerprint(p) for p in paths}
+            valore = loader()
+            if valore is not None:
+                self.put(key, valore, paths, impronte)
+            return valore
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self._voci.clear()
+            else:
+                self._voci.pop(key, None)
@@ -0,0 +1,171 @@
+"""
+Esecuzione non interattiva delle pipeline (cron, benchmark, CI).
+
+Ogni script accetta, al posto del menu, gli stessi argomenti:
+
+    python AnalyzeDNF.py --steps 3,4 --input DNF_2020.csv --output-dir out --jobs 4 --quiet
+
+Codici di uscita: 0 tutto ok, 1 almeno uno step fallito (o bloccato da una dipendenza
+fallita), 2 argomenti non validi, 3 file di input (o registro degli anni) mancante. Senza TTY (o con --quiet)
+i colori ANSI vengono disattivati; con --quiet l'output degli step viene trattenuto
+in memoria e scritto su stderr solo in caso di errore.
+
+Ogni esecuzione scrive anche run_report.json (tempi, memoria, righe e byte per step,
+vedi common/instrument.py); --profile aggiunge un profilo per step in <output>/profili.
+--parquet scrive anche le fact table in Parquet partizionato (common/parquet_export.py).
+--anni indica il registro degli id degli anni condiviso dalle pipeline (common/anni.py).
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+from common.anni import configure as configure_anni
+from common.anni import missing_years
+from common.dag import ESEGUITO, SALTATO
+from common.instrument import PROFILATORI, configure
+from common.parquet_export import configure as configure_parquet
+
+EXIT_OK = 0
+EXIT_FALLITO = 1
+EXIT_USO = 2
+EXIT_INPUT = 3
+
+
+def is_interactive():
+    """True se lo script e' lanciato da terminale senza argomenti: si mostra il menu."""
+    return len(sys.argv) == 1 and sys.stdin.isatty()
+
+
+def build_parser(prog, descrizione, nomi_step, input_default):
+    elenco = ', '.join(f"{i}={nome}" for i, nome in enumerate(nomi_step, 1))
+    parser = argparse.ArgumentParser(prog=prog, description=descrizione,
+                                     epilog="Codici di uscita: 0 ok, 1 step fallito, 2 argomenti non validi, "
+                                            "3 input mancante.")
+    parser.add_argument('--steps', help=f"step da eseguire separati da virgola, per numero o nome ({elenco}); "
+                                        "le dipendenze non aggiornate vengono eseguite comunque. Default: tutti")
+    parser.add_argument('--input', help=f"file sorgente (default: {input_default})")
+    parser.add_argument('--output-dir', help="cartella in cui scrivere gli output (default: cartella corrente)")
+    parser.add_argument('--jobs', type=int, default=2, help="step indipendenti eseguiti in parallelo (default: 2)")
+    parser.add_argument('--force', action='store_true', help="rigenera anche gli step gia' aggiornati")
+    parser.add_argument('--quiet', action='store_true', help="nessun output se va tutto bene (adatto a cron)")
+    parser.add_argument('--profile', choices=PROFILATORI,
+                        help="salva un profilo per step in <output>/profili (gli step vengono eseguiti uno alla volta)")
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help="registra anche il picco di memoria Python per step (tracemalloc, piu' lento)")
+    parser.add_argument('--parquet', action='store_true',
+                        help="scrive anche le fact table in Parquet, partizionate per fonte e anno "
+                             "(<output>/parquet, richiede pyarrow)")
+    parser.add_argument('--anni', help="registro degli id degli anni condiviso con le altre pipeline (default: "
+                                       "<output-dir>/anno_conformato.csv, o scripts/anno_conformato.csv)")
+    return parser
+
+
+def parse_steps(parser, valore, nomi_step):
+    """Converte '--steps 1,generate_companies' nella lista dei nomi degli step (None = tutti)."""
+    if not valore:
+        return None
+    per_numero = {str(i): nome for i, nome in enumerate(nomi_step, 1)}
+    scelti = []
+    for voce in valore.split(','):
+        voce = voce.strip()
+        nome = per_numero.get(voce, voce)
+        if nome not in nomi_step:
+            parser.error(f"step sconosciuto: {voce!r}")
+        scelti.append(nome)
+    return list(dict.fromkeys(scelti))
+
+
+def disable_colors(colors):
+    """Svuota i codici ANSI della classe Colors dello script."""
+    for nome in list(vars(colors)):
+        if nome.isupper():
+            setattr(colors, nome, '')
+
+
+def relocate(namespace, nomi, cartella):
+    """Sposta in `cartella` i file indicati dalle costanti `nomi` del modulo (dict di globals())."""
+    if not cartella:
+        return
+    os.makedirs(cartella, exist_ok=True)
+    for nome in nomi:
+        namespace[nome] = os.path.join(cartella, os.path.basename(namespace[nome]))
+
+
+def print_summary(esiti, stream):
+    if not esiti:
+        return
+    larghezza = max(len(nome) for nome in esiti)
+    for nome, (esito, secondi) in esiti.items():
+        print(f"{nome:<{larghezza}}  {esito:<9} {secondi:8.2f}s", file=stream)
+
+
+def exit_code(esiti):
+    ok = bool(esiti) and all(esito in (ESEGUITO, SALTATO) for esito, _ in esiti.values())
+    return EXIT_OK if ok else EXIT_FALLITO
+
+
+def run_cli(argv, prog, descrizione, nomi_step, input_default, colors, configura, esegui,
+            aggiungi_opzioni=None, applica_opzioni=None):
+    """
+    Entry point comune. `configura(input, output_dir)` imposta i percorsi del modulo e
+    restituisce il file di input da verificare; `esegui(steps, force, jobs)` esegue la
+    pipeline e restituisce gli esiti del DagExecutor ({step: (esito, secondi)}).
+    Opzioni proprie di uno script: `aggiungi_opzioni(parser)` le dichiara,
+    `applica_opzioni(parser, args)` le applica prima dell'esecuzione.
+    """
+    parser = build_parser(prog, descrizione, nomi_step, input_default)
+    if aggiungi_opzioni is not None:
+        aggiungi_opzioni(parser)
+    args = parser.parse_args(argv)
+    steps = parse_steps(parser, args.steps, nomi_step)
+    if args.jobs < 1:
+        parser.error("--jobs deve essere almeno 1")
+    try:
+        configure(args.profile, args.tracemalloc, os.path.join(args.output_dir or '.', 'profili'))
+    except ImportError:
+        parser.error(f"--profile {args.profile}: modulo non installato (pip install {args.profile})")
+    try:
+        configure_parquet(args.parquet)
+    except ImportError:
+        parser.error("--parquet: modulo non installato (pip install pyarrow)")
+    if applica_opzioni is not None:
+        applica_opzioni(parser, args)
+    # Un profilatore per volta: con step in parallelo i profili si sovrapporrebbero
+    jobs = 1 if args.profile else args.jobs
+
+    if args.quiet or not sys.stdout.isatty() or os.environ.get('NO_COLOR'):
+        disable_colors(colors)
+
+    input_path = configura(args.input, args.output_dir)
+    if args.anni:
+        configure_anni(args.anni)
+    if not os.path.exists(input_path):
+        print(f"{prog}: file di input non trovato: {input_path}", file=sys.stderr)
+        return EXIT_INPUT
+    # Il registro degli anni serve a tutte le pipeline: meglio fermarsi prima di scrivere output parziali
+    anni = missing_years()
+    if anni:
+        print(f"{prog}: registro degli anni non trovato: {anni}", file=sys.stderr)
+        return EXIT_INPUT
+
+    buffer = io.StringIO() if args.quiet else None
+    uscita = contextlib.redirect_stdout(buffer) if buffer is not None else contextlib.nullcontext()
+    try:
+        with uscita:
+            esiti = esegui(steps, args.force, jobs)
+    except Exception as e:
+        if buffer is not None:
+            sys.stderr.write(buffer.getvalue())
+        print(f"{prog}: errore critico durante la pipeline: {e}", file=sys.stderr)
+        return EXIT_FALLITO
+
+    codice = exit_code(esiti)
+    if buffer is None:
+        print()
+        print_summary(esiti, sys.stdout)
+    elif codice != EXIT_OK:
+        sys.stderr.write(buffer.getvalue())
+        print_summary(esiti, sys.stderr)
+    return codice
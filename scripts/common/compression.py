@@ -0,0 +1,87 @@
+"""
+Lettura trasparente dei file sorgente compressi (gzip, bz2, xz, zstd).
+
+Il formato viene riconosciuto dai primi byte del file (magic number), non
+dall'estensione: un `DNF.csv` compresso con gzip viene letto come tale. Il file
+viene decompresso in streaming mentre i parser lo leggono, senza copie
+decompresse su disco. Il supporto zstd richiede il modulo `zstandard`
+(pip install zstandard) oppure `compression.zstd` (Python >= 3.14).
+"""
+import bz2
+import gzip
+import io
+import lzma
+
+try:
+    from compression import zstd as _zstd  # Python >= 3.14
+    HAS_ZSTD = True
+except ImportError:
+    try:
+        import zstandard as _zstd
+        HAS_ZSTD = True
+    except ImportError:
+        _zstd = None
+        HAS_ZSTD = False
+
+# formato -> primi byte del file
+MAGIC = {
+    'gzip': b'\x1f\x8b',
+    'bz2': b'BZh',
+    'xz': b'\xfd7zXZ\x00',
+    'zstd': b'\x28\xb5\x2f\xfd',
+}
+BUFFER_BYTES = 1024 * 1024
+
+
+def detect_compression(path):
+    """Formato di compressione di `path` ('gzip', 'bz2', 'xz', 'zstd') o None se non compresso."""
+    with open(path, 'rb') as f:
+        inizio = f.read(max(len(m) for m in MAGIC.values()))
+    for formato, magic in MAGIC.items():
+        if inizio.startswith(magic):
+            return formato
+    return None
+
+
+def is_compressed(path):
+    return detect_compression(path) is not None
+
+
+def _open_zstd(path):
+    if not HAS_ZSTD:
+        raise ImportError(f"{path} e' compresso con zstd: installare il modulo zstandard (pip install zstandard)")
+    if hasattr(_zstd, 'ZstdDecompressor'):
+        # zstandard: lettore a flusso sul file aperto (chiuso insieme al lettore)
+        return _zstd.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return _zstd.open(path, 'rb')
+
+
+def open_source(path, mode='rb', encoding=None, newline=None):
+    """
+    Apre `path` in lettura decomprimendolo al volo se compresso.
+    mode 'rb' restituisce un flusso binario, 'r' un flusso di testo (`encoding`, `newline`
+    come in open()). Il flusso si puo' leggere una sola volta dall'inizio alla fine;
+    seek in avanti e' supportato (decomprimendo i byte saltati).
+    """
+    if mode not in ('r', 'rb'):
+        raise ValueError(f"Modalita' non supportata: {mode}")
+    formato = detect_compression(path)
+    if formato is None:
+        if mode == 'rb':
+            return open(path, 'rb')
+        return open(path, 'r', encoding=encoding, newline=newline)
+
+    if formato == 'gzip':
+        flusso = gzip.open(path, 'rb')
+    elif formato == 'bz2':
+        flusso = bz2.open(path, 'rb')
+    elif formato == 'xz':
+        flusso = lzma.open(path, 'rb')
+    else:
+        flusso = _open_zstd(path)
+    if not isinstance(flusso, io.BufferedIOBase):
+        # Il lettore di zstandard non e' bufferizzato: readline e TextIOWrapper ne hanno bisogno
+        flusso = io.BufferedReader(flusso, buffer_size=BUFFER_BYTES)
+    if mode == 'rb':
+        return flusso
+    return io.TextIOWrapper(flusso, encoding=encoding, newline=newline)
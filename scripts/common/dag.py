@@ -0,0 +1,295 @@
+"""
+Esecutore a grafo (stile make) per gli step delle pipeline.
+
+Ogni step dichiara file di input, file di output e dipendenze. Prima di eseguire si
+calcola la firma di ciascuno step: hash del codice (funzione e helper/costanti del
+modulo che richiama), hash dei file di input esterni e firme delle dipendenze.
+Uno step con output viene saltato se la firma coincide con l'ultima esecuzione
+riuscita e i suoi output sono ancora quelli prodotti allora. Gli step indipendenti
+vengono eseguiti in parallelo (thread), nel rispetto delle dipendenze; con piu' job
+l'output di ogni step viene trattenuto e stampato tutto insieme quando lo step termina,
+cosi' le stampe di step concorrenti non si mescolano.
+
+Gli step `in_memory` preparano stato in memoria (es. DataFrame sull'istanza ETL):
+non vengono mai saltati se uno step che dipende da loro deve essere eseguito.
+
+Se viene passato un `Instrumenter` (common.instrument) ogni step eseguito viene
+misurato e a fine esecuzione viene scritto il report JSON.
+"""
+import contextlib
+import hashlib
+import inspect
+import io
+import json
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from common.cache import file_fingerprint
+
+STATE_FILE = '.pipeline_state.json'
+
+ESEGUITO = 'eseguito'
+SALTATO = 'saltato'
+FALLITO = 'fallito'
+BLOCCATO = 'bloccato'
+
+_TIPI_COSTANTI = (str, int, float, bool, tuple, list, dict, type(None))
+# Impostazioni di esecuzione dei moduli common (--profile, --parquet, ...): mai nella firma
+PARAMETRI_COMUNI = frozenset({'IMPOSTAZIONI'})
+
+
+class Step:
+    """
+    `params`: variabili di modulo usate dallo step ma impostate a runtime (flag da riga di
+    comando, numero di processi): non sono codice e restano fuori dalla firma.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), deps=(), in_memory=False, params=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.in_memory = in_memory
+        self.params = list(params)
+
+
+def code_hash(func, params=()):
+    """
+    Hash del sorgente di `func` e, transitivamente, delle funzioni e costanti di
+    modulo che richiama (stesso modulo o moduli `common.*`): modificare un helper
+    invalida gli step che lo usano. I nomi in `params` (e PARAMETRI_COMUNI) non
+    vengono considerati.
+    """
+    esclusi = PARAMETRI_COMUNI | set(params)
+    h = hashlib.blake2b(digest_size=16)
+    visti = set()
+    da_visitare = [func]
+    while da_visitare:
+        f = da_visitare.pop()
+        f = getattr(f, '__func__', f)
+        if id(f) in visti:
+            continue
+        visti.add(id(f))
+        try:
+            h.update(inspect.getsource(f).encode())
+        except (OSError, TypeError):
+            h.update(repr(f).encode())
+        codice = getattr(f, '__code__', None)
+        if codice is None:
+            continue
+        moduli_ok = (f.__module__, 'common')
+        for nome in sorted(_referenced_names(codice) - esclusi):
+            valore = f.__globals__.get(nome)
+            if isinstance(valore, types.FunctionType) and valore.__module__.startswith(moduli_ok):
+                da_visitare.append(valore)
+            elif isinstance(valore, type) and valore.__module__.startswith(moduli_ok):
+                da_visitare.extend(v for v in vars(valore).values() if isinstance(v, types.FunctionType))
+            elif isinstance(valore, _TIPI_COSTANTI):
+                h.update(f"{nome}={valore!r}".encode())
+    return h.hexdigest()
+
+
+def _referenced_names(codice):
+    nomi = set(codice.co_names)
+    for costante in codice.co_consts:
+        if isinstance(costante, types.CodeType):
+            nomi |= _referenced_names(costante)
+    return nomi
+
+
+class _OutputPerStep:
+    """
+    Sostituto di sys.stdout durante l'esecuzione parallela: ogni thread di step scrive
+    nel proprio buffer, che viene riversato sullo stream originale a fine step.
+    Le stampe degli altri thread (es. il log dell'esecutore) passano direttamente.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._locale = threading.local()
+        self._lock = threading.Lock()
+
+    def write(self, testo):
+        buffer = getattr(self._locale, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(testo)
+
+    def flush(self):
+        if getattr(self._locale, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, nome):
+        return getattr(self.stream, nome)
+
+    @contextlib.contextmanager
+    def step(self):
+        self._locale.buffer = io.StringIO()
+        try:
+            yield
+        finally:
+            testo, self._locale.buffer = self._locale.buffer.getvalue(), None
+            with self._lock:
+                self.stream.write(testo)
+                self.stream.flush()
+
+
+class DagExecutor:
+    def __init__(self, steps, state_file=STATE_FILE, jobs=1, log=print, instrument=None):
+        self.steps = {s.name: s for s in steps}
+        self.state_file = state_file
+        self.jobs = max(1, jobs)
+        self.log = log
+        self.instrument = instrument
+        self._stato = self._load_state()
+        self._lock = threading.Lock()
+
+    # --- stato persistente ---
+
+    def _load_state(self):
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        return {'steps': {}, 'files': {}}
+
+    def _save_state(self):
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._stato, f, indent=2)
+        os.replace(tmp, self.state_file)
+
+    def _fingerprint(self, path):
+        """Impronta del file; l'hash viene ricalcolato solo se mtime o dimensione sono cambiati."""
+        if not os.path.exists(path):
+            return None
+        precedente = self._stato['files'].get(path)
+        impronta = list(file_fingerprint(path, tuple(precedente) if precedente else None))
+        self._stato['files'][path] = impronta
+        return impronta[2]
+
+    # --- pianificazione ---
+
+    def _topo_order(self, names):
+        ordine, visitati = [], set()
+
+        def visita(nome, percorso=()):
+            if nome in visitati:
+                return
+            if nome in percorso:
+                raise ValueError(f"Ciclo nelle dipendenze: {' -> '.join(percorso + (nome,))}")
+            for dep in self.steps[nome].deps:
+                visita(dep, percorso + (nome,))
+            visitati.add(nome)
+            ordine.append(nome)
+
+        for nome in names:
+            visita(nome)
+        return ordine
+
+    def plan(self, targets=None, force=False):
+        """Restituisce (ordine, firme, da_eseguire) per gli step richiesti e le loro dipendenze."""
+        ordine = self._topo_order(targets or list(self.steps))
+        prodotti = {o for s in self.steps.values() for o in s.outputs}
+
+        firme, obsoleti = {}, set()
+        for nome in ordine:
+            step = self.steps[nome]
+            h = hashlib.blake2b(digest_size=16)
+            h.update(code_hash(step.func, step.params).encode())
+            for path in step.inputs:
+                # I file prodotti da altri step sono gia' coperti dalla firma della dipendenza
+                if path not in prodotti:
+                    h.update(f"{path}:{self._fingerprint(path)}".encode())
+            for dep in step.deps:
+                h.update(firme[dep].encode())
+            firme[nome] = h.hexdigest()
+
+            precedente = self._stato['steps'].get(nome, {})
+            obsoleto = force or precedente.get('firma') != firme[nome] or any(d in obsoleti for d in step.deps)
+            if step.outputs and not obsoleto:
+                registrati = precedente.get('outputs', {})
+                obsoleto = any(self._fingerprint(o) is None or self._fingerprint(o) != registrati.get(o)
+                               for o in step.outputs)
+            if not step.outputs and not step.in_memory:
+                obsoleto = True
+            if obsoleto:
+                obsoleti.add(nome)
+
+        # Gli step in memoria servono a chiunque dipenda da loro e debba essere eseguito
+        da_eseguire = set(n for n in obsoleti if self.steps[n].outputs or not self.steps[n].in_memory)
+        for nome in reversed(ordine):
+            if nome in da_eseguire:
+                for dep in self.steps[nome].deps:
+                    if self.steps[dep].in_memory:
+                        da_eseguire.add(dep)
+        return ordine, firme, da_eseguire
+
+    # --- esecuzione ---
+
+    def run(self, targets=None, force=False):
+        """Esegue il grafo e restituisce {step: (esito, secondi)}."""
+        ordine, firme, da_eseguire = self.plan(targets, force)
+        esiti = {n: (SALTATO, 0.0) for n in ordine if n not in da_eseguire}
+        for nome in ordine:
+            if nome not in da_eseguire:
+                self.log(f"⏭️  {nome}: invariato, saltato")
+
+        in_attesa = [n for n in ordine if n in da_eseguire]
+        in_corso = {}
+        # Con un solo job l'output degli step resta in diretta
+        uscita = contextlib.redirect_stdout(_OutputPerStep(sys.stdout)) if self.jobs > 1 else contextlib.nullcontext()
+        with uscita, ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while in_attesa or in_corso:
+                for nome in list(in_attesa):
+                    deps = self.steps[nome].deps
+                    if any(esiti.get(d, (None,))[0] in (FALLITO, BLOCCATO) for d in deps):
+                        esiti[nome] = (BLOCCATO, 0.0)
+                        in_attesa.remove(nome)
+                        self.log(f"⛔ {nome}: non eseguito (dipendenza fallita)")
+                    elif all(d in esiti for d in deps):
+                        in_attesa.remove(nome)
+                        in_corso[pool.submit(self._run_step, nome)] = nome
+                if not in_corso:
+                    continue
+                completati, _ = wait(in_corso, return_when=FIRST_COMPLETED)
+                for futuro in completati:
+                    nome = in_corso.pop(futuro)
+                    esito, durata = futuro.result()
+                    esiti[nome] = (esito, durata)
+                    if esito == ESEGUITO:
+                        self._record(nome, firme[nome])
+
+        self._save_state()
+        esiti = {n: esiti[n] for n in ordine}
+        if self.instrument is not None:
+            self.instrument.finish(esiti)
+        return esiti
+
+    def _run_step(self, nome):
+        step = self.steps[nome]
+        misura = self.instrument.step(nome) if self.instrument is not None else contextlib.nullcontext()
+        uscita = sys.stdout.step() if isinstance(sys.stdout, _OutputPerStep) else contextlib.nullcontext()
+        inizio = time.perf_counter()
+        with uscita, misura:
+            try:
+                risultato = step.func()
+            except Exception as e:
+                self.log(f"❌ {nome}: errore {e}")
+                risultato = False
+        durata = time.perf_counter() - inizio
+        # Gli step segnalano il fallimento restituendo False
+        return (FALLITO if risultato is False else ESEGUITO), durata
+
+    def _record(self, nome, firma):
+        with self._lock:
+            step = self.steps[nome]
+            self._stato['steps'][nome] = {
+                'firma': firma,
+                'outputs': {o: self._fingerprint(o) for o in step.outputs},
+            }
@@ -0,0 +1,313 @@
+"""
+Livello di ingest per i CSV sorgente.
+
+Rileva il dialetto reale del file (delimitatore e carattere di quoting) e lo
+legge con il parser C di pandas (o pyarrow, se installato, per i file grandi).
+Le virgolette vengono rimosse dal parser stesso e le righe malformate non vengono
+scartate in silenzio: numero e linea di ogni riga rifiutata finiscono nel report.
+I file compressi (gzip, bz2, xz, zstd) vengono letti in streaming, riconoscendo il
+formato dai primi byte (common/compression.py).
+"""
+import csv
+import io
+import os
+import re
+import warnings
+
+import pandas as pd
+
+from common.compression import is_compressed, open_source
+from common.instrument import record_read
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+DELIMITATORI_CANDIDATI = ';,\t|'
+SNIFF_SAMPLE_BYTES = 64 * 1024
+# Sotto questa dimensione il parser C e' gia' piu' veloce dell'avvio di pyarrow
+PYARROW_MIN_BYTES = 32 * 1024 * 1024
+# Dimensione indicativa delle partizioni per l'elaborazione in parallelo (byte_ranges)
+PARTIZIONE_BYTES = 64 * 1024 * 1024
+
+_RE_SKIPPING = re.compile(r'Skipping line (\d+)')
+
+
+class IngestReport:
+    """Esito della lettura: dialetto rilevato, motore usato e righe rifiutate."""
+
+    def __init__(self, path, delimiter, quotechar, engine):
+        self.path = path
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.engine = engine
+        self.rows = 0
+        self.rejected = []  # lista di (numero_linea, testo) - linea None se non nota
+
+    @property
+    def rejected_count(self):
+        return len(self.rejected)
+
+    def rejected_lines(self):
+        return [n for n, _ in self.rejected if n is not None]
+
+
+def sniff_dialect(path, encoding='utf-8', candidates=DELIMITATORI_CANDIDATI, max_lines=200):
+    """
+    Restituisce (delimitatore, quotechar) rilevati su un campione iniziale del file.
+    Vince il candidato che produce lo stesso numero di campi (>1) sul maggior numero
+    di righe; a parita' quello che produce piu' campi.
+    """
+    with open_source(path, 'r', encoding=encoding, newline='') as f:
+        sample = f.read(SNIFF_SAMPLE_BYTES)
+    if len(sample) == SNIFF_SAMPLE_BYTES and '\n' in sample:
+        sample = sample[:sample.rfind('\n') + 1]
+    righe = sample.splitlines()[:max_lines]
+    if not righe:
+        return candidates[0], '"'
+
+    quotechar = '"'
+    if sum(sample.count(d + "'") for d in candidates) > sum(sample.count(d + '"') for d in candidates):
+        quotechar = "'"
+
+    migliore, punteggio_migliore = candidates[0], (0.0, 0)
+    for candidato in candidates:
+        conteggi = [len(campi) for campi in csv.reader(righe, delimiter=candidato, quotechar=quotechar)]
+        moda = max(set(conteggi), key=conteggi.count)
+        if moda < 2:
+            continue
+        punteggio = (conteggi.count(moda) / len(conteggi), moda)
+        if punteggio > punteggio_migliore:
+            migliore, punteggio_migliore = candidato, punteggio
+    return migliore, quotechar
+
+
+def _locate_lines(path, testi, encoding):
+    """Ritrova i numeri di linea (1-based) delle righe rifiutate da pyarrow, che non li riporta."""
+    cercati = {t.rstrip('\r\n') for t in testi}
+    trovati = {}
+    with open_source(path, 'r', encoding=encoding, newline='') as f:
+        for numero, linea in enumerate(f, start=1):
+            linea = linea.rstrip('\r\n')
+            if linea in cercati and linea not in trovati:
+                trovati[linea] = numero
+    return trovati
+
+
+def _choose_engine(path, engine):
+    if engine != 'auto':
+        return engine
+    if HAS_PYARROW and os.path.getsize(path) >= PYARROW_MIN_BYTES:
+        return 'pyarrow'
+    return 'c'
+
+
+def read_delimited(path, usecols=None, dtype=None, na_values=None, strip=False,
+                   encoding='utf-8', engine='auto', delimiter=None):
+    """
+    Legge un file delimitato e restituisce (DataFrame, IngestReport).
+
+    - delimiter: se None viene rilevato dal file.
+    - strip: rimuove gli spazi iniziali/finali dalle colonne testuali e ricontrolla
+      `na_values` sui valori ripuliti (es. ' N.A. ').
+    """
+    if delimiter is None:
+        delimiter, quotechar = sniff_dialect(path, encoding)
+    else:
+        quotechar = '"'
+    engine = _choose_engine(path, engine)
+    report = IngestReport(path, delimiter, quotechar, engine)
+
+    opzioni = dict(
+        sep=delimiter,
+        quotechar=quotechar,
+        encoding=encoding,
+        usecols=usecols,
+        dtype=dtype,
+        na_values=na_values,
+        engine=engine,
+    )
+
+    if engine == 'pyarrow':
+        rifiutate = []
+
+        def _on_bad_line(riga):
+            rifiutate.append(riga.text)
+            return 'skip'
+
+        with open_source(path) as f:
+            df = pd.read_csv(f, on_bad_lines=_on_bad_line, **opzioni)
+        if rifiutate:
+            linee = _locate_lines(path, rifiutate, encoding)
+            report.rejected = [(linee.get(t.rstrip('\r\n')), t) for t in rifiutate]
+    else:
+        with warnings.catch_warnings(record=True) as avvisi:
+            warnings.simplefilter('always', pd.errors.ParserWarning)
+            # index_col=False: una riga con un campo in piu' non deve diventare l'indice
+            with open_source(path) as f:
+                df = pd.read_csv(f, on_bad_lines='warn', index_col=False, **opzioni)
+        _collect_rejected(report, avvisi)
+
+    df = _postprocess(df, strip, na_values)
+    report.rows = len(df)
+    record_read(path, report.rows)
+    return df, report
+
+
+def read_typed(path, dtype, usecols=None, na_values=None, **kwargs):
+    """
+    Come read_delimited, ma con i tipi di `dtype` applicati gia' in parsing.
+    Se una colonna numerica contiene valori non convertibili (es. 'N.R.' non previsto)
+    la colonna viene riletta come testo e convertita con errors='coerce'.
+    """
+    try:
+        return read_delimited(path, usecols=usecols, dtype=dtype, na_values=na_values, **kwargs)
+    except (ValueError, TypeError):
+        numeriche = {c: t for c, t in dtype.items() if pd.api.types.is_numeric_dtype(pd.Series(dtype=t))}
+        if not numeriche:
+            raise
+        altri = {c: t for c, t in dtype.items() if c not in numeriche}
+        df, report = read_delimited(path, usecols=usecols, dtype=altri or None, na_values=na_values, **kwargs)
+        for col, tipo in numeriche.items():
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype(tipo)
+        return df, report
+
+
+def iter_delimited(path, chunksize=100_000, usecols=None, dtype=None, na_values=None,
+                   strip=False, encoding='utf-8', delimiter=None, report=None):
+    """
+    Versione a blocchi di read_delimited (sempre con il motore C, l'unico che legge a chunk).
+    Genera DataFrame di al piu' `chunksize` righe; se viene passato un IngestReport
+    questo si aggiorna man mano con righe lette e rifiutate.
+    """
+    if delimiter is None:
+        delimiter, quotechar = sniff_dialect(path, encoding)
+    else:
+        quotechar = '"'
+    if report is None:
+        report = IngestReport(path, delimiter, quotechar, 'c')
+    else:
+        report.delimiter, report.quotechar, report.engine = delimiter, quotechar, 'c'
+
+    sorgente = open_source(path)
+    reader = pd.read_csv(
+        sorgente, sep=delimiter, quotechar=quotechar, encoding=encoding, usecols=usecols,
+        dtype=dtype, na_values=na_values, engine='c', index_col=False,
+        on_bad_lines='warn', chunksize=chunksize,
+    )
+    with sorgente, reader:
+        while True:
+            # Gli avvisi vanno catturati solo attorno al parsing, non mentre il chiamante usa il chunk
+            with warnings.catch_warnings(record=True) as avvisi:
+                warnings.simplefilter('always', pd.errors.ParserWarning)
+                try:
+                    chunk = next(reader)
+                except StopIteration:
+                    chunk = None
+            _collect_rejected(report, avvisi)
+            if chunk is None:
+                record_read(path, report.rows)
+                return
+            chunk = _postprocess(chunk, strip, na_values)
+            report.rows += len(chunk)
+            yield chunk
+
+
+def byte_ranges(path, dimensione=PARTIZIONE_BYTES):
+    """
+    Divide `path` in intervalli di byte [inizio, fine) di circa `dimensione` byte,
+    allineati all'inizio di una riga e successivi all'intestazione, da leggere con
+    `read_range` anche in processi diversi. Restituisce (intestazione in byte, intervalli).
+    Richiede che nessun campo quotato contenga un a-capo (vale per i CSV MUR).
+    Un file compresso non si puo' dividere senza decomprimerlo: si restituisce un solo
+    intervallo [fine intestazione, None) che read_range legge in streaming fino alla fine.
+    """
+    if is_compressed(path):
+        with open_source(path) as f:
+            intestazione = f.readline()
+            vuoto = not f.read(1)
+        return intestazione, [] if vuoto else [(len(intestazione), None)]
+
+    totale = os.path.getsize(path)
+    intervalli = []
+    with open(path, 'rb') as f:
+        intestazione = f.readline()
+        inizio = f.tell()
+        while inizio < totale:
+            f.seek(min(inizio + dimensione, totale))
+            # Si completa la riga a cavallo del limite: appartiene a questa partizione
+            f.readline()
+            fine = f.tell()
+            intervalli.append((inizio, fine))
+            inizio = fine
+    return intestazione, intervalli
+
+
+class _Intervallo(io.RawIOBase):
+    """Flusso binario: `intestazione` seguita da al piu' `n` byte di `f` (tutti se None)."""
+
+    def __init__(self, f, intestazione, n):
+        self.f = f
+        self.intestazione = intestazione
+        self.rimanenti = n
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.intestazione:
+            n = min(len(buffer), len(self.intestazione))
+            buffer[:n] = self.intestazione[:n]
+            self.intestazione = self.intestazione[n:]
+            return n
+        richiesti = len(buffer) if self.rimanenti is None else min(len(buffer), self.rimanenti)
+        dati = self.f.read(richiesti)
+        if self.rimanenti is not None:
+            self.rimanenti -= len(dati)
+        buffer[:len(dati)] = dati
+        return len(dati)
+
+
+def read_range(path, inizio, fine, intestazione, **kwargs):
+    """
+    DataFrame delle righe di `path` nell'intervallo di byte [inizio, fine) (vedi
+    byte_ranges, `fine` None = fino alla fine del file); `kwargs` vengono passati a
+    read_csv (sep, encoding, usecols, dtype...). Le righe vengono lette in streaming,
+    senza copiare l'intervallo in memoria.
+    """
+    with open_source(path) as f:
+        f.seek(inizio)
+        sorgente = io.BufferedReader(_Intervallo(f, intestazione, None if fine is None else fine - inizio))
+        df = pd.read_csv(sorgente, engine='c', index_col=False, **kwargs)
+    return _postprocess(df, False, None)
+
+
+def _collect_rejected(report, avvisi):
+    for avviso in avvisi:
+        if not issubclass(avviso.category, pd.errors.ParserWarning):
+            continue
+        testo = str(avviso.message)
+        if testo.startswith('Length of header'):
+            # Campi in eccesso sulla prima riga dati: il parser li tronca senza numero di linea
+            report.rejected.append((None, testo.strip()))
+            continue
+        for messaggio in testo.splitlines():
+            m = _RE_SKIPPING.search(messaggio)
+            if m:
+                report.rejected.append((int(m.group(1)), messaggio.strip()))
+
+
+def _postprocess(df, strip, na_values):
+    # Intestazioni ripulite da spazi e virgolette residue
+    df.columns = df.columns.str.strip().str.strip('"')
+
+    if strip:
+        colonne_testo = df.select_dtypes(include=['object', 'string']).columns
+        for col in colonne_testo:
+            df[col] = df[col].str.strip()
+        if na_values is not None and len(colonne_testo):
+            df[colonne_testo] = df[colonne_testo].mask(df[colonne_testo].isin(na_values))
+    return df
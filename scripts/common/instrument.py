@@ -0,0 +1,264 @@
+"""
+Strumentazione degli step delle pipeline e report di esecuzione in JSON.
+
+Per ogni step eseguito dal DagExecutor si registrano tempo reale, tempo CPU, picco
+di RSS (e, se attivato, di tracemalloc), righe e byte letti/scritti. Le funzioni di
+I/O (common.ingest, KeyRegistry, save_csv degli script) chiamano `record_read` /
+`record_write`: i conteggi vanno allo step in esecuzione nel thread corrente
+(contextvar), oppure alla voce 'fuori_step' del report (es. prefetch di DNF.csv).
+
+Opzionalmente ogni step puo' essere profilato con cProfile (file .prof, apribile con
+snakeviz / flameprof) o pyinstrument, se installato (file .speedscope.json, da aprire
+su speedscope.app come flamegraph).
+
+Con piu' step in parallelo (--jobs > 1) i picchi di memoria sono del processo:
+gli step sovrapposti ad altri sono marcati con `memoria_condivisa: true`.
+"""
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILATORI = ('cprofile', 'pyinstrument')
+
+# Impostazioni di processo (da riga di comando): profilatore e tracemalloc sono costosi
+IMPOSTAZIONI = {'profilo': None, 'tracemalloc': False, 'cartella_profili': 'profili'}
+
+_corrente = contextvars.ContextVar('metriche_step', default=None)
+_fuori_step = None
+
+
+def configure(profilo=None, tracemalloc_attivo=False, cartella_profili=None):
+    """Attiva profilatore (cprofile/pyinstrument) e tracemalloc per le esecuzioni successive."""
+    if profilo not in (None,) + PROFILATORI:
+        raise ValueError(f"Profilatore non supportato: {profilo}")
+    if profilo == 'pyinstrument':
+        import pyinstrument  # noqa: F401 - errore esplicito se non installato
+    IMPOSTAZIONI['profilo'] = profilo
+    IMPOSTAZIONI['tracemalloc'] = tracemalloc_attivo
+    if cartella_profili:
+        IMPOSTAZIONI['cartella_profili'] = cartella_profili
+
+
+# --- MEMORIA ---
+
+def reset_peak_rss():
+    """Azzera il picco di RSS del processo (Linux >= 4.0); False se non supportato."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Picco di RSS del processo in MB (dall'ultimo azzeramento, se supportato)."""
+    try:
+        with open('/proc/self/status') as f:
+            for riga in f:
+                if riga.startswith('VmHWM:'):
+                    return int(riga.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss e' in kB su Linux, in byte su macOS
+    return picco / (1024 * 1024) if sys.platform == 'darwin' else picco / 1024
+
+
+# --- REGISTRAZIONE I/O ---
+
+class StepMetrics:
+    def __init__(self, nome):
+        self.nome = nome
+        self.secondi = 0.0
+        self.cpu_secondi = 0.0
+        self.rss_picco_mb = None
+        self.tracemalloc_picco_mb = None
+        self.memoria_condivisa = False
+        self.righe_in = 0
+        self.righe_out = 0
+        self.byte_letti = 0
+        self.byte_scritti = 0
+        self.file_letti = []
+        self.file_scritti = []
+        self.profilo = None
+
+    def to_dict(self):
+        return {k: (round(v, 4) if isinstance(v, float) else v) for k, v in vars(self).items() if k != 'nome'}
+
+
+def _dimensione(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def _metriche():
+    return _corrente.get() or _fuori_step
+
+
+def record_read(path, righe=None):
+    """Registra la lettura di `path` (righe lette, byte del file) nello step corrente."""
+    m = _metriche()
+    if m is None:
+        return
+    m.righe_in += righe or 0
+    m.byte_letti += _dimensione(path)
+    m.file_letti.append(os.fspath(path))
+
+
+def record_write(path, righe=None):
+    """Registra la scrittura di `path` (righe scritte, byte del file) nello step corrente."""
+    m = _metriche()
+    if m is None:
+        return
+    m.righe_out += righe or 0
+    m.byte_scritti += _dimensione(path)
+    m.file_scritti.append(os.fspath(path))
+
+
+def record_rows(righe_in=0, righe_out=0):
+    """Righe elaborate in memoria da step che non leggono/scrivono file (es. unpivot)."""
+    m = _metriche()
+    if m is not None:
+        m.righe_in += righe_in
+        m.righe_out += righe_out
+
+
+# --- STRUMENTAZIONE DI UN'ESECUZIONE ---
+
+class Instrumenter:
+    """
+    Raccoglie le metriche di un'esecuzione della pipeline `pipeline` e, al termine
+    (`finish`), scrive il report JSON in `report_file`.
+    """
+
+    def __init__(self, pipeline, report_file=None, cartella_profili=None):
+        global _fuori_step
+        self.pipeline = pipeline
+        self.report_file = report_file
+        self.profilo = IMPOSTAZIONI['profilo']
+        self.cartella_profili = cartella_profili or IMPOSTAZIONI['cartella_profili']
+        self.usa_tracemalloc = IMPOSTAZIONI['tracemalloc']
+        self.inizio = time.time()
+        self._t0 = time.perf_counter()
+        self.steps = {}
+        self.fuori_step = StepMetrics('fuori_step')
+        self._attivi = set()
+        self._lock = threading.Lock()
+        _fuori_step = self.fuori_step
+        self._tracemalloc_avviato = self.usa_tracemalloc and not tracemalloc.is_tracing()
+        if self._tracemalloc_avviato:
+            tracemalloc.start()
+
+    def _inizio_misura(self, metriche):
+        with self._lock:
+            if self._attivi:
+                # Step sovrapposti: i picchi non sono piu' attribuibili al singolo step
+                metriche.memoria_condivisa = True
+                for altro in self._attivi:
+                    altro.memoria_condivisa = True
+            else:
+                reset_peak_rss()
+                if self.usa_tracemalloc:
+                    tracemalloc.reset_peak()
+            self._attivi.add(metriche)
+
+    def _fine_misura(self, metriche):
+        with self._lock:
+            self._attivi.discard(metriche)
+            metriche.rss_picco_mb = peak_rss_mb()
+            if self.usa_tracemalloc:
+                metriche.tracemalloc_picco_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+
+    @contextlib.contextmanager
+    def step(self, nome):
+        """Misura il blocco come step `nome`; le chiamate record_* del thread vanno a questo step."""
+        metriche = StepMetrics(nome)
+        self.steps[nome] = metriche
+        token = _corrente.set(metriche)
+        self._inizio_misura(metriche)
+        profilatore = self._avvia_profilo()
+        inizio, inizio_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield metriche
+        finally:
+            metriche.secondi = time.perf_counter() - inizio
+            # CPU del thread dello step (escluso il lavoro dei thread interni di pyarrow)
+            metriche.cpu_secondi = time.thread_time() - inizio_cpu
+            metriche.profilo = self._salva_profilo(profilatore, nome)
+            self._fine_misura(metriche)
+            _corrente.reset(token)
+
+    def _avvia_profilo(self):
+        if self.profilo == 'cprofile':
+            profilatore = cProfile.Profile()
+            profilatore.enable()
+            return profilatore
+        if self.profilo == 'pyinstrument':
+            from pyinstrument import Profiler
+            profilatore = Profiler(async_mode='disabled')
+            profilatore.start()
+            return profilatore
+        return None
+
+    def _salva_profilo(self, profilatore, nome):
+        if profilatore is None:
+            return None
+        os.makedirs(self.cartella_profili, exist_ok=True)
+        base = os.path.join(self.cartella_profili, f"{self.pipeline}_{nome}")
+        if self.profilo == 'cprofile':
+            profilatore.disable()
+            path = base + '.prof'
+            profilatore.dump_stats(path)
+        else:
+            from pyinstrument.renderers import SpeedscopeRenderer
+            profilatore.stop()
+            path = base + '.speedscope.json'
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profilatore.output(renderer=SpeedscopeRenderer()))
+        return path
+
+    def report(self, esiti=None):
+        """Report dell'esecuzione; `esiti` ({step: (esito, secondi)}) dal DagExecutor."""
+        steps = {}
+        for nome, (esito, _) in (esiti or {}).items():
+            steps[nome] = {'esito': esito}
+            if nome in self.steps:
+                steps[nome].update(self.steps[nome].to_dict())
+        for nome, metriche in self.steps.items():
+            steps.setdefault(nome, metriche.to_dict())
+        return {
+            'pipeline': self.pipeline,
+            'inizio': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.inizio)),
+            'secondi': round(time.perf_counter() - self._t0, 4),
+            'rss_picco_processo_mb': round(peak_rss_mb(), 1),
+            'profilo': self.profilo,
+            'tracemalloc': self.usa_tracemalloc,
+            'steps': steps,
+            'fuori_step': self.fuori_step.to_dict(),
+        }
+
+    def finish(self, esiti=None):
+        """Chiude l'esecuzione, salva il report (se previsto) e lo restituisce."""
+        global _fuori_step
+        report = self.report(esiti)
+        if _fuori_step is self.fuori_step:
+            _fuori_step = None
+        if self._tracemalloc_avviato:
+            tracemalloc.stop()
+        if self.report_file:
+            cartella = os.path.dirname(self.report_file)
+            if cartella:
+                os.makedirs(cartella, exist_ok=True)
+            with open(self.report_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
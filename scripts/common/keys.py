@@ -0,0 +1,206 @@
+"""
+Codifica a dizionario e risoluzione delle chiavi esterne.
+
+Invece di fare merge su colonne di testo (nomi azienda, regioni, settori) i valori
+vengono codificati una sola volta in interi (pd.Categorical) e le foreign key si
+risolvono con una lookup vettoriale sui codici (`take`), senza hash-join sulle stringhe.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.instrument import record_read, record_write
+
+
+def encode(values, categories=None):
+    """Restituisce (codici int, categorie) di `values`; i valori mancanti hanno codice -1."""
+    if categories is None and isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    cat = pd.Categorical(values, categories=categories)
+    return cat.codes, cat.categories
+
+
+def lookup_ids(values, dim_values, dim_ids):
+    """
+    Per ogni elemento di `values` restituisce l'id del membro corrispondente della
+    dimensione (`dim_values` -> `dim_ids`) come array Int64 (<NA> se non trovato).
+
+    La ricerca avviene una volta per valore distinto; le righe vengono poi risolte
+    con una take sui codici. Un membro NaN della dimensione viene associato ai
+    valori mancanti, come farebbe un merge di pandas.
+    """
+    dim_values = pd.Series(dim_values).reset_index(drop=True)
+    dim_ids = pd.Series(dim_ids).reset_index(drop=True).to_numpy(dtype=np.int64)
+
+    nulli = dim_values.isna().to_numpy()
+    presenti = ~nulli & ~dim_values.duplicated().to_numpy()
+    indice = pd.Index(dim_values[presenti])
+
+    codici, categorie = encode(pd.Series(values))
+    # Tabella id per categoria (+1 posizione finale per i valori mancanti, codice -1)
+    posizioni = indice.get_indexer(categorie)
+    trovati = posizioni >= 0
+    tabella = np.zeros(len(categorie) + 1, dtype=np.int64)
+    mancanti = np.ones(len(categorie) + 1, dtype=bool)
+    tabella[:-1][trovati] = dim_ids[presenti][posizioni[trovati]]
+    mancanti[:-1] = ~trovati
+    if nulli.any():
+        # Membro NaN della dimensione (es. regione non indicata)
+        tabella[-1] = dim_ids[nulli][0]
+        mancanti[-1] = False
+
+    righe = np.where(codici >= 0, codici, len(categorie))
+    return pd.arrays.IntegerArray(tabella[righe], mancanti[righe])
+
+
+def unpivot_codes(df, value_cols, id_cols):
+    """
+    Unpivot (wide -> long) numerico: restituisce un DataFrame con le colonne `id_cols`,
+    'metrica' (Categorical sui nomi di `value_cols`) e 'valore'. Equivale a pd.melt
+    ma senza ripetere le stringhe riga per riga: le chiavi restano codici interi.
+    L'ordine e' quello di melt: prima tutte le righe della prima metrica, poi la seconda, ...
+    """
+    n = len(df)
+    righe = np.tile(np.arange(n), len(value_cols))
+    long_df = pd.DataFrame({col: df[col].array.take(righe) for col in id_cols})
+    long_df['metrica'] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(value_cols), dtype=np.int16), n), categories=list(value_cols)
+    )
+    long_df['valore'] = df[list(value_cols)].to_numpy().T.ravel()
+    return long_df
+
+
+class KeyRegistry:
+    """
+    Registro persistente delle surrogate key, salvato come un CSV per tabella in `directory`.
+
+    Gli id gia' assegnati non cambiano mai: i membri nuovi vengono accodati con
+    id successivi al massimo esistente. Per ogni chiave si possono tenere anche degli
+    attributi (es. FK dell'azienda, valore della metrica) per riconoscere le righe modificate.
+    `dtypes` ({tabella: {colonna: dtype}}) fissa i tipi alla rilettura dei CSV, ad esempio
+    per codici con zeri iniziali che read_csv convertirebbe in numeri.
+    """
+
+    NUOVO = 'nuovo'
+    MODIFICATO = 'modificato'
+    INVARIATO = 'invariato'
+
+    def __init__(self, directory, dtypes=None):
+        self.directory = directory
+        self.dtypes = dtypes or {}
+        self._tabelle = {}
+
+    def _path(self, nome):
+        return os.path.join(self.directory, f"{nome}.csv")
+
+    def table(self, nome):
+        """Tabella del registro (colonne come l'export) oppure None se mai popolata."""
+        if nome not in self._tabelle and os.path.exists(self._path(nome)):
+            self._tabelle[nome] = pd.read_csv(self._path(nome), dtype=self.dtypes.get(nome))
+            record_read(self._path(nome), len(self._tabelle[nome]))
+        return self._tabelle.get(nome)
+
+    def seed(self, nome, df):
+        """Inizializza una tabella vuota con id gia' esistenti (es. da un export precedente)."""
+        if self.table(nome) is None:
+            self._tabelle[nome] = df.reset_index(drop=True)
+
+    def conform(self, nome, lookup, id_col, key_cols):
+        """
+        Allinea la tabella `nome` a una lookup condivisa con altre pipeline (es. gli anni):
+        i membri della lookup non ancora registrati vengono aggiunti con il loro id, cosi'
+        i membri nuovi ricevono id successivi a quelli gia' usati altrove.
+        Restituisce le righe in conflitto (stesso id con chiave diversa o stessa chiave con
+        id diverso); se ce ne sono il registro non viene modificato.
+        """
+        key_cols = list(key_cols)
+        lookup = lookup[[id_col] + key_cols].reset_index(drop=True)
+        registro = self.table(nome)
+        if registro is None:
+            self._tabelle[nome] = lookup.sort_values(id_col, ignore_index=True)
+            return lookup.iloc[0:0]
+
+        per_id = registro[[id_col] + key_cols].merge(lookup, on=id_col, suffixes=('', '_lookup'))
+        diversi = np.zeros(len(per_id), dtype=bool)
+        for col in key_cols:
+            diversi |= (per_id[col] != per_id[f"{col}_lookup"]).to_numpy(dtype=bool)
+        per_chiave = registro[[id_col] + key_cols].merge(lookup, on=key_cols, suffixes=('', '_lookup'))
+        conflitti = pd.concat([per_id.loc[diversi, [id_col] + key_cols],
+                               per_chiave.loc[per_chiave[id_col] != per_chiave[f"{id_col}_lookup"], [id_col] + key_cols]],
+                              ignore_index=True).drop_duplicates()
+        if len(conflitti):
+            return conflitti
+
+        mancanti = lookup[~lookup[id_col].isin(registro[id_col])]
+        if len(mancanti):
+            self._tabelle[nome] = pd.concat([registro, mancanti], ignore_index=True).sort_values(id_col, ignore_index=True)
+        return conflitti
+
+    def upsert(self, nome, df, id_col, key_cols, attr_cols=()):
+        """
+        Assegna gli id alle righe di `df` (chiave naturale `key_cols`).
+        Restituisce (ids Int64, stato) allineati a `df`; stato vale NUOVO, MODIFICATO
+        (attributi cambiati rispetto al registro) o INVARIATO.
+        """
+        key_cols, attr_cols = list(key_cols), list(attr_cols)
+        registro = self.table(nome)
+        if registro is None:
+            registro = pd.DataFrame({c: pd.Series(dtype=df[c].dtype) for c in key_cols + attr_cols})
+            registro.insert(0, id_col, pd.Series(dtype='int64'))
+        nuovi_attributi = [c for c in attr_cols if c not in registro.columns]
+        if nuovi_attributi:
+            # Attributi aggiunti dopo la creazione del registro: i membri esistenti risultano modificati
+            registro = registro.reindex(columns=list(registro.columns) + nuovi_attributi)
+
+        dati = df[key_cols + attr_cols].reset_index(drop=True)
+        distinti = dati.drop_duplicates(subset=key_cols)
+        abbinati = distinti.merge(registro, on=key_cols, how='left', suffixes=('', '_reg'))
+
+        nuovi = abbinati[id_col].isna().to_numpy()
+        prossimo = int(registro[id_col].max()) + 1 if len(registro) else 1
+        ids = abbinati[id_col].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+        ids[nuovi] = np.arange(prossimo, prossimo + nuovi.sum())
+        abbinati[id_col] = ids.astype(np.int64)
+
+        modificati = np.zeros(len(abbinati), dtype=bool)
+        for col in attr_cols:
+            attuale = abbinati[col]
+            precedente = abbinati[f"{col}_reg"]
+            try:
+                precedente = precedente.astype(attuale.dtype)
+            except (TypeError, ValueError):
+                attuale, precedente = attuale.astype(str), precedente.astype(str)
+            uguali = (attuale == precedente).fillna(False).to_numpy(dtype=bool)
+            uguali = uguali | (attuale.isna() & precedente.isna()).to_numpy()
+            modificati |= ~uguali & ~nuovi
+
+        stato = np.where(nuovi, self.NUOVO, np.where(modificati, self.MODIFICATO, self.INVARIATO))
+        abbinati['_stato'] = stato
+
+        # Aggiornamento del registro: righe nuove accodate, attributi modificati sovrascritti
+        colonne = list(registro.columns)
+        aggiornati = abbinati.loc[nuovi | modificati, colonne]
+        if len(aggiornati):
+            restanti = registro[~registro[id_col].isin(aggiornati[id_col])]
+            parti = [p for p in (restanti, aggiornati) if len(p)]
+            self._tabelle[nome] = pd.concat(parti, ignore_index=True).sort_values(id_col, ignore_index=True)
+        else:
+            self._tabelle[nome] = registro
+
+        if len(distinti) != len(dati):
+            abbinati = dati[key_cols].merge(abbinati[key_cols + [id_col, '_stato']], on=key_cols, how='left')
+        return pd.array(abbinati[id_col].to_numpy(), dtype='Int64'), abbinati['_stato'].to_numpy()
+
+    def members(self, nome):
+        """Tutti i membri registrati, ordinati per id."""
+        return self.table(nome)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for nome, tabella in self._tabelle.items():
+            # Sostituzione atomica: una pipeline che legge gli export non vede mai un file a meta'
+            temporaneo = self._path(nome) + '.tmp'
+            tabella.to_csv(temporaneo, index=False, lineterminator='\n')
+            os.replace(temporaneo, self._path(nome))
+            record_write(self._path(nome), len(tabella))
@@ -0,0 +1,203 @@
+"""
+Export Parquet delle fact table, partizionato per fonte e anno.
+
+Con --parquet (common/cli.py, run_all.py) ogni fact table viene scritta, oltre che
+in CSV, come dataset Parquet in stile Hive:
+
+    parquet/report_dnf/fonte=DNF/anno=2019/part-0.parquet
+    parquet/observation/fonte=lfsa_ergaed/anno=2021/part-0.parquet
+    parquet/observation/_metadata
+
+I file sono compressi (zstd), con le statistiche min/max per row group e le colonne
+testuali ripetute (nomi delle metriche, flag) codificate a dizionario. Fonte e anno
+non sono colonne dei file ma cartelle: chi legge il dataset (pyarrow.dataset, DuckDB,
+Spark, pandas.read_parquet) scarta le partizioni e i row group che non servono a un
+filtro per anno, fonte o metrica senza aprirli. `_metadata` raccoglie schema e
+statistiche di tutti i file.
+
+Ogni esecuzione sostituisce le partizioni (fonte, anno) che scrive; gli altri anni
+restano, cosi' il dataset accumula la storia (es. un file DNF per anno). Richiede pyarrow.
+"""
+import glob
+import os
+import shutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+COMPRESSIONE = 'zstd'
+RIGHE_PER_GRUPPO = 256 * 1024
+NOME_PARTE = 'part-0.parquet'
+
+IMPOSTAZIONI = {'attivo': False}
+
+
+def configure(attivo=True):
+    """Attiva l'export Parquet per le esecuzioni successive (ImportError se manca pyarrow)."""
+    if attivo and not HAS_PYARROW:
+        raise ImportError("l'export Parquet richiede pyarrow (pip install pyarrow)")
+    IMPOSTAZIONI['attivo'] = bool(attivo)
+
+
+def enabled():
+    return IMPOSTAZIONI['attivo']
+
+
+def metadata_path(cartella):
+    """File `_metadata` del dataset (schema e statistiche di tutti i file)."""
+    return os.path.join(cartella, '_metadata')
+
+
+def update_metadata(cartella):
+    """Riscrive `_metadata` e `_common_metadata` di `cartella` dai footer dei file Parquet."""
+    files = sorted(glob.glob(os.path.join(cartella, '**', '*.parquet'), recursive=True))
+    if not files:
+        return
+    schema = pq.read_schema(files[0])
+    raccolti = []
+    for path in files:
+        if not pq.read_schema(path).equals(schema, check_metadata=False):
+            raise ValueError(f"{path}: colonne diverse dagli altri file di {cartella}; "
+                             f"eliminare la cartella per riscrivere il dataset")
+        metadati = pq.read_metadata(path)
+        metadati.set_file_path(os.path.relpath(path, cartella).replace(os.sep, '/'))
+        raccolti.append(metadati)
+    pq.write_metadata(schema, os.path.join(cartella, '_common_metadata'))
+    pq.write_metadata(schema, metadata_path(cartella), metadata_collector=raccolti)
+
+
+class PartitionedWriter:
+    """
+    Scrive a blocchi una fact table nel dataset `cartella`, sotto fonte=`fonte`.
+    `write(df, anni)` accoda le righe di `df` alle partizioni dei loro anni (`anni`:
+    un anno per riga o uno solo per tutto il blocco). Le partizioni vengono scritte in
+    file temporanei e sostituiscono le precedenti solo a `close()`; con
+    `sostituisci_fonte` vengono eliminati anche gli anni della fonte non riscritti.
+    `dizionario`: colonne testuali da codificare a dizionario.
+    """
+
+    def __init__(self, cartella, fonte, dizionario=(), sostituisci_fonte=False, metadati=True):
+        self.cartella = cartella
+        self.fonte = str(fonte)
+        self.dizionario = list(dizionario)
+        self.sostituisci_fonte = sostituisci_fonte
+        self.metadati = metadati
+        self.righe = 0
+        self._scrittori = {}   # anno -> (ParquetWriter, file temporaneo)
+        # Le nuove partizioni seguono lo schema del dataset esistente (es. int -> float)
+        comune = os.path.join(cartella, '_common_metadata')
+        self._schema = pq.read_schema(comune) if os.path.exists(comune) else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valore, traccia):
+        if tipo is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _cartella_fonte(self):
+        return os.path.join(self.cartella, f"fonte={self.fonte}")
+
+    def _tabella(self, df):
+        tabella = pa.Table.from_pandas(df, preserve_index=False)
+        for nome in self.dizionario:
+            if nome in tabella.column_names and not pa.types.is_dictionary(tabella.schema.field(nome).type):
+                i = tabella.column_names.index(nome)
+                tabella = tabella.set_column(i, nome, pc.dictionary_encode(tabella.column(i)))
+        if self._schema is None:
+            self._schema = tabella.schema
+        elif not tabella.schema.equals(self._schema, check_metadata=False):
+            try:
+                tabella = tabella.cast(self._schema)
+            except (ValueError, pa.ArrowException) as e:
+                raise ValueError(f"colonne diverse da quelle del dataset {self.cartella} ({e}); "
+                                 f"eliminare la cartella per riscrivere il dataset") from e
+        return tabella
+
+    def _scrittore(self, anno):
+        if anno not in self._scrittori:
+            cartella = os.path.join(self._cartella_fonte(), f"anno={anno}")
+            os.makedirs(cartella, exist_ok=True)
+            temporaneo = os.path.join(cartella, NOME_PARTE + '.tmp')
+            colonne = [n for n in self.dizionario if n in self._schema.names]
+            scrittore = pq.ParquetWriter(temporaneo, self._schema, compression=COMPRESSIONE,
+                                         use_dictionary=colonne or False, write_statistics=True)
+            self._scrittori[anno] = (scrittore, temporaneo)
+        return self._scrittori[anno][0]
+
+    def write(self, df, anni):
+        if not len(df):
+            return
+        tabella = self._tabella(df)
+        if not hasattr(anni, '__len__') or isinstance(anni, str):
+            self._scrittore(int(anni)).write_table(tabella, row_group_size=RIGHE_PER_GRUPPO)
+        else:
+            anni = pa.array(anni, type=pa.int64())
+            for anno in pc.unique(anni).to_pylist():
+                parte = tabella.filter(pc.equal(anni, anno))
+                self._scrittore(int(anno)).write_table(parte, row_group_size=RIGHE_PER_GRUPPO)
+        self.righe += len(df)
+
+    def close(self):
+        """Chiude i file, sostituisce le partizioni scritte e aggiorna `_metadata`."""
+        for anno, (scrittore, temporaneo) in self._scrittori.items():
+            scrittore.close()
+            cartella = os.path.dirname(temporaneo)
+            for vecchio in glob.glob(os.path.join(cartella, '*.parquet')):
+                os.remove(vecchio)
+            os.replace(temporaneo, os.path.join(cartella, NOME_PARTE))
+        if self.sostituisci_fonte:
+            scritti = {f"anno={anno}" for anno in self._scrittori}
+            for cartella in glob.glob(os.path.join(self._cartella_fonte(), 'anno=*')):
+                if os.path.basename(cartella) not in scritti:
+                    shutil.rmtree(cartella)
+        self._scrittori.clear()
+        if self.metadati:
+            update_metadata(self.cartella)
+
+    def abort(self):
+        """Scarta le partizioni in scrittura: il dataset resta quello precedente."""
+        for scrittore, temporaneo in self._scrittori.values():
+            scrittore.close()
+            if os.path.exists(temporaneo):
+                os.remove(temporaneo)
+        self._scrittori.clear()
+
+
+class _NessunExport:
+    """Scrittore nullo usato quando l'export Parquet non e' attivo."""
+
+    righe = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valore, traccia):
+        return False
+
+    def write(self, df, anni):
+        pass
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+def fact_writer(cartella, fonte, dizionario=(), sostituisci_fonte=False, metadati=True, attivo=None):
+    """
+    PartitionedWriter su `cartella` se l'export Parquet e' attivo, altrimenti uno scrittore
+    nullo. `attivo` sostituisce l'impostazione globale (processi del pool, che non la ereditano).
+    """
+    if not (enabled() if attivo is None else attivo):
+        return _NessunExport()
+    return PartitionedWriter(cartella, fonte, dizionario, sostituisci_fonte, metadati)
@@ -0,0 +1,271 @@
+"""
+Profilatore a passata singola per i file sorgente (DNF.csv, bdg_serie_iscritti.csv, estat.csv).
+
+Il file viene letto a blocchi e per ogni colonna si mantengono solo sketch a
+memoria limitata: conteggio dei nulli, min/max, stima dei distinti con
+HyperLogLog e categorie piu' frequenti (Misra-Gries). In questo modo si possono
+profilare export di diversi GB prima di decidere se caricarli.
+
+I file Eurostat SDMX-TSV (riconosciuti dall'intestazione '...\\TIME_PERIOD') vengono
+letti con common/sdmx.py: una colonna per dimensione della chiave composita e una per
+periodo, con ':' come valore mancante e i flag separati dai valori ('12.3 b' -> 12.3),
+profilati a parte nella colonna 'flag'. Sono file wide (una riga per serie) e vengono
+letti interi.
+
+Uso da riga di comando (dalla cartella scripts/):
+    python -m common.profiler ../csv/DNF.csv --json profilo_dnf.json
+    python -m common.profiler EUROSTATS/estat.csv
+"""
+import argparse
+import json
+import math
+import sys
+
+import numpy as np
+import pandas as pd
+
+from common.ingest import IngestReport, iter_delimited
+from common.instrument import record_write
+from common.sdmx import is_sdmx_tsv, read_sdmx_tsv
+
+HLL_PRECISIONE = 12          # 2^12 registri (~1.6% di errore standard)
+TOP_K = 10                   # categorie riportate per colonna
+TOP_K_CAPACITA = 64          # contatori mantenuti dallo sketch Misra-Gries
+SOGLIA_CATEGORIE = 10        # sotto questa cardinalita' si stampano le categorie
+
+
+class HyperLogLog:
+    """Stima della cardinalita' con registri numpy, aggiornata a blocchi di hash uint64."""
+
+    def __init__(self, p=HLL_PRECISIONE):
+        self.p = p
+        self.m = 1 << p
+        self.registri = np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        if len(hashes) == 0:
+            return
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        indici = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        resto = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        # frexp restituisce l'esponente esatto: e' la lunghezza in bit del resto (< 2^53)
+        _, lunghezza = np.frexp(resto.astype(np.float64))
+        rango = (64 - self.p - lunghezza + 1).astype(np.uint8)
+        np.maximum.at(self.registri, indici, rango)
+
+    def merge(self, altro):
+        np.maximum(self.registri, altro.registri, out=self.registri)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        stima = alpha * self.m * self.m / np.sum(np.ldexp(1.0, -self.registri.astype(np.int64)))
+        vuoti = int(np.count_nonzero(self.registri == 0))
+        if stima <= 2.5 * self.m and vuoti:
+            # Correzione per piccole cardinalita' (linear counting)
+            stima = self.m * math.log(self.m / vuoti)
+        return int(round(stima))
+
+
+class MisraGries:
+    """Heavy hitters con al piu' `capacita` contatori; i conteggi sono limiti inferiori."""
+
+    def __init__(self, capacita=TOP_K_CAPACITA):
+        self.capacita = capacita
+        self.contatori = {}
+        self.esatto = True
+
+    def add_counts(self, conteggi):
+        """Unisce i conteggi (pd.Series valore -> n) di un blocco."""
+        if len(conteggi) > self.capacita:
+            # Il blocco viene prima ridotto a `capacita` contatori (riduzione vettoriale)
+            soglia = np.partition(conteggi.to_numpy(), -(self.capacita + 1))[-(self.capacita + 1)]
+            conteggi = conteggi[conteggi > soglia] - soglia
+            self.esatto = False
+        for valore, n in conteggi.items():
+            self.contatori[valore] = self.contatori.get(valore, 0) + int(n)
+        if len(self.contatori) > self.capacita:
+            # Riduzione standard degli sketch mergeable: si sottrae il (k+1)-esimo conteggio
+            soglia = sorted(self.contatori.values(), reverse=True)[self.capacita]
+            self.contatori = {v: n - soglia for v, n in self.contatori.items() if n > soglia}
+            self.esatto = False
+
+    def top(self, k=TOP_K):
+        return sorted(self.contatori.items(), key=lambda kv: (-kv[1], str(kv[0])))[:k]
+
+
+class ColumnProfile:
+    def __init__(self, nome):
+        self.nome = nome
+        self.righe = 0
+        self.nulli = 0
+        self.numerica = True
+        self.minimo = None
+        self.massimo = None
+        self.hll = HyperLogLog()
+        self.frequenti = MisraGries()
+
+    def update(self, serie):
+        self.righe += len(serie)
+        valori = serie.dropna()
+        self.nulli += len(serie) - len(valori)
+        if valori.empty:
+            return
+
+        if self.numerica and pd.api.types.is_numeric_dtype(valori) and not pd.api.types.is_bool_dtype(valori):
+            # Hash sempre su float64: un blocco intero e uno con NaN devono dare lo stesso hash
+            valori = valori.astype(np.float64)
+            minimo, massimo = valori.min(), valori.max()
+            self.minimo = minimo if self.minimo is None else min(self.minimo, minimo)
+            self.massimo = massimo if self.massimo is None else max(self.massimo, massimo)
+        else:
+            self.numerica = False
+            valori = valori.astype(str)
+
+        self.hll.add_hashes(pd.util.hash_pandas_object(valori, index=False).to_numpy())
+        self.frequenti.add_counts(valori.value_counts(sort=False))
+
+    def to_dict(self):
+        # La stima non puo' superare il numero di valori non nulli visti
+        distinti = min(self.hll.estimate(), self.righe - self.nulli)
+        if self.frequenti.esatto:
+            # Nessuna riduzione: lo sketch contiene tutti i valori con conteggi esatti
+            distinti = len(self.frequenti.contatori)
+        profilo = {
+            'righe': self.righe,
+            'nulli': self.nulli,
+            'distinti_stimati': distinti,
+            'distinti_esatti': self.frequenti.esatto,
+            'numerica': self.numerica and self.minimo is not None,
+            'top': [{'valore': _to_json(v), 'conteggio': n} for v, n in self.frequenti.top()],
+            'top_esatto': self.frequenti.esatto,
+        }
+        if profilo['numerica']:
+            profilo['min'] = _to_json(self.minimo)
+            profilo['max'] = _to_json(self.massimo)
+        return profilo
+
+
+def _to_json(valore):
+    if isinstance(valore, np.generic):
+        valore = valore.item()
+    if isinstance(valore, float) and valore.is_integer():
+        return int(valore)
+    return valore
+
+
+class Profiler:
+    """
+    Profilo incrementale di una tabella letta a blocchi: `update(chunk)` per ogni blocco
+    (anche durante una lettura fatta per altri scopi), `to_dict` alla fine.
+    """
+
+    def __init__(self):
+        self.colonne = {}
+
+    def update(self, chunk):
+        for col in chunk.columns:
+            if col not in self.colonne:
+                self.colonne[col] = ColumnProfile(col)
+            self.colonne[col].update(chunk[col])
+
+    def to_dict(self, path, report):
+        """Profilo serializzabile; `report` (IngestReport) fornisce dialetto e righe rifiutate."""
+        return {
+            'file': path,
+            'delimitatore': report.delimiter,
+            'righe': report.rows,
+            'righe_rifiutate': report.rejected_count,
+            'linee_rifiutate': report.rejected_lines(),
+            'colonne': {nome: p.to_dict() for nome, p in self.colonne.items()},
+        }
+
+
+def profile_sdmx(tabella, path, chunksize=100_000):
+    """
+    Profilo di una SdmxTable gia' letta (common/sdmx.py): dimensioni della chiave,
+    un valore numerico per periodo (NaN per ':') e i flag delle celle che ne hanno uno.
+    """
+    profilo = Profiler()
+    for inizio in range(0, len(tabella), chunksize):
+        fine = min(inizio + chunksize, len(tabella))
+        dims = tabella.dims.iloc[inizio:fine].reset_index(drop=True)
+        valori = pd.DataFrame(tabella.valori[inizio:fine], columns=tabella.periodi)
+        profilo.update(pd.concat([dims, valori], axis=1))
+        flag = tabella.flag[inizio:fine].ravel()
+        profilo.update(pd.DataFrame({'flag': pd.Series(flag[flag != ''], dtype=object)}))
+    report = IngestReport(path, '\t', '"', 'c')
+    report.rows = len(tabella)
+    risultato = profilo.to_dict(path, report)
+    risultato['formato'] = 'sdmx-tsv'
+    risultato['valori_non_numerici'] = tabella.non_numerici
+    return risultato
+
+
+def profile_file(path, chunksize=100_000, encoding=None, na_values=None, strip=True, delimiter=None):
+    """
+    Profila `path` in una sola passata e restituisce il profilo come dict serializzabile.
+    `encoding` di default: utf-8 per i CSV, latin1 per i file SDMX-TSV.
+    """
+    if is_sdmx_tsv(path):
+        return profile_sdmx(read_sdmx_tsv(path, encoding=encoding or 'latin1'), path, chunksize)
+
+    report = IngestReport(path, delimiter, '"', 'c')
+    profilo = Profiler()
+    for chunk in iter_delimited(path, chunksize=chunksize, na_values=na_values, strip=strip,
+                                encoding=encoding or 'utf-8', delimiter=delimiter, report=report):
+        profilo.update(chunk)
+    return profilo.to_dict(path, report)
+
+
+def save_profile(profilo, filename):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(profilo, f, ensure_ascii=False, indent=2)
+    record_write(filename)
+
+
+def print_profile(profilo, bold='', endc='', ok=''):
+    """Report a console nello stesso formato dell'analisi nulli/dominio di AnalyzeDNF."""
+    colonne = profilo['colonne']
+
+    print(f"\n{bold}[Analisi NULL]{endc}")
+    nulli = sorted(((p['nulli'], n) for n, p in colonne.items() if p['nulli'] > 0), reverse=True)
+    if nulli:
+        larghezza = max(len(n) for _, n in nulli)
+        for conteggio, nome in nulli:
+            print(f"{nome:<{larghezza}}  {conteggio}")
+    else:
+        print(f"{ok}Nessun valore NULL rilevante trovato nel dataset.{endc}")
+
+    print(f"\n{bold}[Analisi Dominio e Range]{endc}")
+    for nome, p in colonne.items():
+        prefisso = '' if p['distinti_esatti'] else '~'
+        print(f"• Attributo: {bold}'{nome}'{endc} (Distinti: {prefisso}{p['distinti_stimati']})")
+        if 1 < p['distinti_stimati'] < SOGLIA_CATEGORIE and p['top_esatto']:
+            print(f"  ↪ Categorie: {[t['valore'] for t in p['top']]}")
+        elif p['numerica']:
+            print(f"  ↪ Range: [{p['min']} - {p['max']}]")
+        elif p['top']:
+            frequenti = ', '.join(f"{t['valore']} ({t['conteggio']})" for t in p['top'][:3])
+            print(f"  ↪ Piu' frequenti: {frequenti}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profilo a passata singola di un CSV sorgente.")
+    parser.add_argument('file')
+    parser.add_argument('--json', help="salva il profilo in questo file JSON")
+    parser.add_argument('--encoding', help="es. latin-1 per bdg_serie_iscritti.csv (default: utf-8, latin1 per SDMX-TSV)")
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    profilo = profile_file(args.file, chunksize=args.chunksize, encoding=args.encoding)
+    print(f"{profilo['file']}: {profilo['righe']} righe, delimitatore {profilo['delimitatore']!r}, "
+          f"{profilo['righe_rifiutate']} righe rifiutate")
+    print_profile(profilo)
+    if args.json:
+        save_profile(profilo, args.json)
+        print(f"\nProfilo salvato in {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Lettura dei file Eurostat in formato SDMX-TSV.
+
+Struttura del formato:
+
+    freq,wstatus,age,unit,geo\\TIME_PERIOD	2009 	2010 	...
+    A,EMP,Y20-64,PC_PNT,AT	10.5 	9.8 b	: 	...
+
+La prima colonna e' la chiave composita della serie (dimensioni separate da virgola,
+con i nomi nell'intestazione prima di '\\TIME_PERIOD'); ogni altra colonna e' un periodo.
+Una cella contiene il valore (':' se non disponibile) seguito da uno spazio e dagli
+eventuali flag di osservazione (b = rottura di serie, u = bassa affidabilita',
+e = stima, p = provvisorio, d = definizione diversa, c = confidenziale, ...).
+
+Virgole e spazi separano quindi dimensioni, valori e flag: durante la lettura vengono
+convertiti in tabulazioni, cosi' il parser C di pandas legge il file in un solo passaggio
+con una colonna per dimensione, una colonna numerica (float) e una di flag per periodo.
+Nessuna split o regex sulle stringhe, e i flag non vengono scartati. I file che non
+rispettano il formato (una cella senza lo spazio tra valore e flag) vengono letti
+cella per cella, piu' lentamente.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+from common.compression import open_source
+from common.instrument import record_read
+
+SEPARATORE_DIMENSIONI = ','
+MARCATORE_PERIODO = '\\TIME_PERIOD'
+VALORE_MANCANTE = ':'
+BLOCCO_LETTURA = 1024 * 1024
+
+
+class SdmxTable:
+    """
+    Tabella SDMX in forma wide: una riga per serie.
+
+    *   `dims`: DataFrame con una colonna per dimensione (freq, unit, geo, ...)
+    *   `periodi`: etichette dei periodi ripulite dagli spazi ('2009', '2010', ...)
+    *   `valori`: ndarray float64 (serie x periodi), NaN per ':' o celle vuote
+    *   `flag`: ndarray object (serie x periodi), '' se la cella non ha flag
+    *   `non_numerici`: celle con un valore diverso da ':' che non e' un numero
+    """
+
+    def __init__(self, dims, periodi, valori, flag, non_numerici=0):
+        self.dims = dims
+        self.periodi = periodi
+        self.valori = valori
+        self.flag = flag
+        self.non_numerici = non_numerici
+
+    def __len__(self):
+        return len(self.dims)
+
+    def to_wide(self):
+        """DataFrame dimensioni + una colonna numerica per periodo (come il file, senza flag)."""
+        valori = pd.DataFrame(self.valori, columns=self.periodi, index=self.dims.index)
+        return pd.concat([self.dims, valori], axis=1)
+
+
+class _SeparatoriComeTab(io.RawIOBase):
+    """Legge un file binario convertendo virgole e spazi in tabulazioni."""
+
+    TABELLA = bytes.maketrans(b', ', b'\t\t')
+
+    def __init__(self, f):
+        self.f = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        dati = self.f.read(len(buffer))
+        buffer[:len(dati)] = dati.translate(self.TABELLA)
+        return len(dati)
+
+
+def is_sdmx_tsv(path):
+    """True se l'intestazione di `path` (anche compresso) e' quella di un file SDMX-TSV ('...\\TIME_PERIOD')."""
+    with open_source(path, 'r', encoding='latin1', newline='') as f:
+        return MARCATORE_PERIODO in f.readline()
+
+
+def parse_header(riga):
+    """(nomi delle dimensioni, periodi) dalla riga di intestazione."""
+    campi = riga.rstrip('\r\n').split('\t')
+    nomi_dim = [d.strip() for d in campi[0].split(MARCATORE_PERIODO)[0].split(SEPARATORE_DIMENSIONI)]
+    periodi = [p.strip() for p in campi[1:]]
+    return nomi_dim, periodi
+
+
+def split_cells(celle):
+    """
+    Separa valori e flag di un vettore di celle SDMX ('9.8 b', ': ', '10.5 ').
+    Restituisce (valori float64, flag object con '' se assente, numero di valori non numerici).
+    """
+    parti = pd.Series(celle, dtype='str').str.strip().str.split(' ', n=1, expand=True)
+    parti = parti.reindex(columns=[0, 1])
+    testo = parti[0].fillna('')
+    valori = pd.to_numeric(testo.where(testo != VALORE_MANCANTE, ''), errors='coerce')
+    non_numerici = int((valori.isna() & (testo != '') & (testo != VALORE_MANCANTE)).sum())
+    flag = parti[1].fillna('').str.strip()
+    return valori.to_numpy(dtype=np.float64, na_value=np.nan), flag.to_numpy(dtype=object), non_numerici
+
+
+def _read_fast(path, encoding, nomi_dim, n_periodi):
+    """
+    Lettura in un solo passaggio (virgole e spazi come separatori). Restituisce
+    (dims, valori, flag) oppure None se qualche cella non rispetta il formato
+    'valore spazio flag' (colonne sfasate o valori non numerici).
+    """
+    col_valori = [f"v{i}" for i in range(n_periodi)]
+    col_flag = [f"f{i}" for i in range(n_periodi)]
+    nomi = nomi_dim + [c for coppia in zip(col_valori, col_flag) for c in coppia]
+    dtype = {**{n: 'str' for n in nomi_dim + col_flag}, **{c: 'float64' for c in col_valori}}
+    with open_source(path) as f:
+        f.readline()
+        sorgente = io.BufferedReader(_SeparatoriComeTab(f), buffer_size=BLOCCO_LETTURA)
+        try:
+            df = pd.read_csv(sorgente, sep='\t', header=None, names=nomi, dtype=dtype, encoding=encoding,
+                             na_values={c: [VALORE_MANCANTE] for c in col_valori},
+                             keep_default_na=False, index_col=False, engine='c')
+        except ValueError:
+            return None
+    # Una cella senza spazio finale sposta i campi successivi: la riga resta con meno campi
+    if n_periodi and df[col_flag[-1]].isna().any():
+        return None
+    valori = df[col_valori].to_numpy(dtype=np.float64, na_value=np.nan)
+    return df[nomi_dim], valori, df[col_flag].to_numpy(dtype=object)
+
+
+def read_sdmx_tsv(path, encoding='latin1'):
+    """
+    Legge un file SDMX-TSV Eurostat e restituisce una SdmxTable.
+    Se qualche cella non rispetta il formato (ad es. un flag senza spazio) si ripete la
+    lettura cella per cella: i valori non convertibili diventano NaN e vengono contati.
+    Il file puo' essere compresso (gzip, bz2, xz, zstd): viene decompresso in streaming.
+    """
+    with open_source(path, 'r', encoding=encoding, newline='') as f:
+        nomi_dim, periodi = parse_header(f.readline())
+
+    non_numerici = 0
+    letto = _read_fast(path, encoding, nomi_dim, len(periodi))
+    if letto is not None:
+        dims, valori, flag = letto
+    else:
+        with open_source(path) as f:
+            df = pd.read_csv(f, sep='\t', dtype=str, encoding=encoding, keep_default_na=False, engine='c')
+        dims = df.iloc[:, 0].str.split(SEPARATORE_DIMENSIONI, expand=True)
+        if dims.shape[1] != len(nomi_dim):
+            raise ValueError(f"{path}: la chiave ha {dims.shape[1]} campi, l'intestazione {len(nomi_dim)}")
+        dims.columns = nomi_dim
+        valori, flag, non_numerici = split_cells(df.iloc[:, 1:].to_numpy().ravel())
+        valori = valori.reshape(len(df), len(periodi))
+        flag = flag.reshape(len(df), len(periodi))
+    record_read(path, len(dims))
+    return SdmxTable(dims, periodi, valori, flag, non_numerici)
@@ -0,0 +1,161 @@
+"""
+Intermedi delle pipeline con un budget di memoria.
+
+Gli step depositano i risultati intermedi (DataFrame o matrici numpy 2D) in uno
+SpillStore. Finche' il totale in memoria resta sotto il budget gli oggetti restano
+in RAM; oltre il budget i piu' grandi vengono scritti su file Feather (Arrow IPC non
+compresso) in una cartella temporanea e liberati. Quando uno step successivo li
+richiede vengono riletti con memory map: una matrice viene restituita come
+MappedMatrix, che legge dal file solo le colonne e le righe indicizzate.
+
+Lo spill richiede pyarrow; senza pyarrow tutti gli intermedi restano in memoria.
+Gli oggetti rilasciati (`release`) vengono eliminati anche dal disco.
+"""
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+def size_mb(valore):
+    """Memoria occupata da un DataFrame (stringhe comprese) o da un ndarray, in MB."""
+    if isinstance(valore, pd.DataFrame):
+        return valore.memory_usage(deep=True).sum() / (1024 * 1024)
+    if isinstance(valore, np.ndarray):
+        if valore.dtype == object:
+            return pd.DataFrame(valore.reshape(len(valore), -1)).memory_usage(deep=True).sum() / (1024 * 1024)
+        return valore.nbytes / (1024 * 1024)
+    return 0.0
+
+
+class MappedMatrix:
+    """
+    Matrice 2D su file Feather memory-mapped, una colonna Arrow per colonna della matrice.
+    Supporta `m[righe, j]` (righe: slice o intero) e `to_numpy()`; i dati vengono letti
+    dal file solo quando indicizzati.
+    """
+
+    def __init__(self, path, dtype):
+        self.table = feather.read_table(path, memory_map=True)
+        self.dtype = np.dtype(dtype)
+        self.shape = (self.table.num_rows, self.table.num_columns)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _colonna(self, j, inizio=0, fine=None):
+        fine = self.shape[0] if fine is None else fine
+        colonna = self.table.column(j).slice(inizio, max(fine - inizio, 0))
+        return colonna.to_numpy().astype(self.dtype, copy=False)
+
+    def __getitem__(self, chiave):
+        righe, j = chiave
+        if isinstance(righe, slice):
+            inizio, fine, passo = righe.indices(self.shape[0])
+            if passo != 1:
+                return self._colonna(j)[righe]
+            return self._colonna(j, inizio, fine)
+        return self._colonna(j, righe, righe + 1)[0]
+
+    def to_numpy(self):
+        if not self.shape[1]:
+            return np.empty(self.shape, dtype=self.dtype)
+        return np.column_stack([self._colonna(j) for j in range(self.shape[1])])
+
+
+class SpillStore:
+    """
+    Deposito degli intermedi con budget di memoria `budget_mb` (None = nessun limite).
+    `put` deposita (e se serve scarica su disco), `get` restituisce l'oggetto in memoria
+    o lo rilegge dal disco, `release` lo elimina.
+    """
+
+    def __init__(self, budget_mb=None, directory=None):
+        self.budget_mb = budget_mb
+        self.directory = directory
+        self._cartella = None
+        self._residenti = {}   # nome -> (oggetto, MB)
+        self._su_disco = {}    # nome -> (path, tipo, dtype)
+        self._pulizia = None
+
+    def __contains__(self, nome):
+        return nome in self._residenti or nome in self._su_disco
+
+    def resident_mb(self):
+        return sum(mb for _, mb in self._residenti.values())
+
+    def spilled(self):
+        """Nomi degli intermedi scaricati su disco."""
+        return list(self._su_disco)
+
+    def put(self, nome, valore):
+        """Deposita `valore` (None equivale a release); oltre il budget scarica i piu' grandi."""
+        self.release(nome)
+        if valore is None:
+            return
+        self._residenti[nome] = (valore, size_mb(valore))
+        if self.budget_mb is None or not HAS_PYARROW:
+            return
+        while self._residenti and self.resident_mb() > self.budget_mb:
+            maggiore = max(self._residenti, key=lambda n: self._residenti[n][1])
+            self._spill(maggiore)
+
+    def get(self, nome):
+        """L'intermedio `nome` (None se assente): i DataFrame scaricati vengono riletti, le matrici mappate."""
+        if nome in self._residenti:
+            return self._residenti[nome][0]
+        if nome not in self._su_disco:
+            return None
+        path, tipo, dtype = self._su_disco[nome]
+        if tipo == 'matrice':
+            return MappedMatrix(path, dtype)
+        return feather.read_table(path, memory_map=True).to_pandas()
+
+    def release(self, *nomi):
+        for nome in nomi:
+            self._residenti.pop(nome, None)
+            if nome in self._su_disco:
+                path = self._su_disco.pop(nome)[0]
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(self):
+        """Rilascia tutto ed elimina la cartella degli spill."""
+        self._residenti.clear()
+        self._su_disco.clear()
+        if self._pulizia is not None:
+            self._pulizia()
+
+    def _path(self, nome):
+        if self._cartella is None:
+            self._cartella = tempfile.mkdtemp(prefix='spill_', dir=self.directory)
+            # La cartella viene rimossa anche se il chiamante non chiude lo store
+            self._pulizia = weakref.finalize(self, shutil.rmtree, self._cartella, True)
+        return os.path.join(self._cartella, f"{nome}.feather")
+
+    def _spill(self, nome):
+        valore, _ = self._residenti.pop(nome)
+        path = self._path(nome)
+        if isinstance(valore, np.ndarray) and valore.ndim == 2:
+            matrice = valore
+            if matrice.dtype == object:
+                colonne = [pa.array(matrice[:, j], type=pa.string()) for j in range(matrice.shape[1])]
+            else:
+                colonne = [pa.array(matrice[:, j]) for j in range(matrice.shape[1])]
+            tabella = pa.table(colonne, names=[str(j) for j in range(matrice.shape[1])])
+            self._su_disco[nome] = (path, 'matrice', matrice.dtype)
+        else:
+            tabella = pa.Table.from_pandas(valore, preserve_index=False)
+            self._su_disco[nome] = (path, 'frame', None)
+        # Non compresso: il file si puo' mappare in memoria senza decompressione
+        feather.write_feather(tabella, path, compression='uncompressed')
@@ -0,0 +1,325 @@
+"""
+Caricamento degli output delle pipeline DNF, MUR ed EUROSTATS in un database SQLite.
+
+Lo schema a stella (dimensioni anno, regione, ateco, aziende, facolta, ateneo,
+tipo_misura, metodo_aggr, geo; fatti report_dnf, analisi, analisi_ateneo, observation)
+viene creato se manca. I CSV vengono letti a blocchi e inseriti con executemany in
+un'unica transazione, con WAL e pragma da caricamento massivo (synchronous OFF,
+temp_store in memoria, cache ampia, foreign key verificate solo alla fine).
+
+Ogni riga e' un upsert sull'id (INSERT ... ON CONFLICT DO UPDATE): gli id sono stabili
+tra un'esecuzione e l'altra (registro chiavi delle pipeline), quindi un aggiornamento
+non svuota le tabelle ma inserisce le righe nuove e aggiorna quelle modificate.
+Gli indici sulle foreign key (cod_*) vengono eliminati prima del caricamento e
+ricostruiti alla fine, nella stessa transazione.
+L'anno, caricato dalle tre pipeline, viene verificato prima di scrivere: se due sorgenti
+(o il database) associano lo stesso id ad anni diversi il caricamento viene annullato.
+
+Uso (dalla cartella scripts/):
+    python load_sqlite.py                                  # output nelle cartelle delle pipeline
+    python load_sqlite.py --input-dir out --db out/genderhack.db --only DNF,MUR
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+
+from common.cli import EXIT_FALLITO, EXIT_INPUT, EXIT_OK, disable_colors
+from run_all import CARTELLA_SCRIPTS, PIPELINE
+
+FILE_DB = 'genderhack.db'
+RIGHE_PER_BATCH = 50_000
+
+# Pragma per il caricamento: il database si ricostruisce dai CSV, quindi durante il
+# caricamento non serve la sincronizzazione su disco a ogni pagina
+PRAGMA_CARICAMENTO = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': -256_000,   # KB (negativo): ~250 MB di cache delle pagine
+    'foreign_keys': 'OFF',
+}
+
+MISURE_MUR = [f"{m}_{s}" for m in ('num_iscritti', 'num_immatricolati', 'num_laureati') for s in ('m', 'f')]
+
+
+class Colors:
+    HEADER = '\033[95m'
+    GREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+
+
+class Tabella:
+    """
+    Tabella dello schema: `colonne` (nome -> tipo SQL, la prima e' la chiave primaria),
+    `sorgenti` (pipeline, file CSV) caricati nell'ordine, `fk` (colonna -> tabella).
+    `naturale`: chiave naturale delle dimensioni condivise tra le pipeline, su cui le
+    sorgenti devono assegnare gli stessi id (verificato prima del caricamento).
+    """
+
+    def __init__(self, nome, sorgenti, colonne, fk=None, naturale=None):
+        self.nome = nome
+        self.sorgenti = sorgenti
+        self.colonne = colonne
+        self.fk = fk or {}
+        self.naturale = naturale
+
+    @property
+    def chiave(self):
+        return next(iter(self.colonne))
+
+
+# Dimensioni prima dei fatti. L'anno e' conformato tra le pipeline (DNF ed EUROSTATS partono
+# dalla lookup di MUR): le tre esportazioni vengono unite sull'id, dopo aver verificato che
+# assegnino a ogni anno lo stesso id.
+SCHEMA = [
+    Tabella('anno', [('DNF', 'anno_export.csv'), ('MUR', 'anno_export.csv'), ('EUROSTATS', 'anno_import_full.csv')],
+            {'id_anno': 'INTEGER', 'valore': 'INTEGER'}, naturale=['valore']),
+    Tabella('regione', [('DNF', 'regione_export.csv')], {'id_regione': 'INTEGER', 'nome': 'TEXT'}),
+    Tabella('ateco', [('DNF', 'ateco_export.csv')], {'id_ateco': 'INTEGER', 'settore': 'TEXT'}),
+    Tabella('aziende', [('DNF', 'aziende_export.csv')],
+            {'id_azienda': 'INTEGER', 'nome': 'TEXT', 'cod_ateco': 'INTEGER', 'cod_regione': 'INTEGER'},
+            fk={'cod_ateco': 'ateco', 'cod_regione': 'regione'}),
+    Tabella('facolta', [('MUR', 'facolta_export.csv')], {'id_facolta': 'INTEGER', 'nome': 'TEXT'}),
+    Tabella('ateneo', [('MUR', 'ateneo_export.csv')], {'id_ateneo': 'INTEGER', 'codice': 'TEXT', 'nome': 'TEXT'}),
+    Tabella('tipo_misura', [('EUROSTATS', 'tipo_misura_import_full.csv')],
+            {'id_misura': 'INTEGER', 'valore': 'TEXT', 'dataset': 'TEXT'}),
+    Tabella('metodo_aggr', [('EUROSTATS', 'metodo_aggr_import_full.csv')], {'id_aggr': 'INTEGER', 'nome': 'TEXT'}),
+    Tabella('geo', [('EUROSTATS', 'geo_import_full.csv')], {'id_geo': 'INTEGER', 'codice': 'TEXT'}),
+    Tabella('report_dnf', [('DNF', 'gender_gap_dnf_filatrato.csv')],
+            {'id_report': 'INTEGER', 'nome': 'TEXT', 'cod_azienda': 'INTEGER', 'valore': 'REAL', 'cod_anno': 'INTEGER'},
+            fk={'cod_azienda': 'aziende', 'cod_anno': 'anno'}),
+    Tabella('analisi', [('MUR', 'analisi_export.csv')],
+            {'id_analisi': 'INTEGER', **{m: 'INTEGER' for m in MISURE_MUR},
+             'cod_facolta': 'INTEGER', 'cod_anno': 'INTEGER'},
+            fk={'cod_facolta': 'facolta', 'cod_anno': 'anno'}),
+    Tabella('analisi_ateneo', [('MUR', 'analisi_ateneo_export.csv')],
+            {'id_analisi_ateneo': 'INTEGER', **{m: 'INTEGER' for m in MISURE_MUR},
+             'cod_ateneo': 'INTEGER', 'cod_facolta': 'INTEGER', 'cod_anno': 'INTEGER'},
+            fk={'cod_ateneo': 'ateneo', 'cod_facolta': 'facolta', 'cod_anno': 'anno'}),
+    Tabella('observation', [('EUROSTATS', 'observation_import_full.csv')],
+            {'id_observation': 'INTEGER', 'nome': 'TEXT', 'cod_geo': 'INTEGER', 'cod_misura': 'INTEGER',
+             'cod_anno': 'INTEGER', 'cod_aggr': 'INTEGER', 'valore': 'REAL', 'flag': 'TEXT'},
+            fk={'cod_geo': 'geo', 'cod_misura': 'tipo_misura', 'cod_anno': 'anno', 'cod_aggr': 'metodo_aggr'}),
+]
+TABELLE = {t.nome: t for t in SCHEMA}
+
+# tipo SQL -> dtype pandas con cui leggere la colonna (interi nullable, testo senza conversione di 'NA')
+DTYPE_SQL = {'INTEGER': 'Int64', 'REAL': 'float64', 'TEXT': str}
+
+
+# --- SCHEMA ---
+
+def create_table_sql(tabella):
+    definizioni = []
+    for i, (colonna, tipo) in enumerate(tabella.colonne.items()):
+        if i == 0:
+            definizioni.append(f"{colonna} INTEGER PRIMARY KEY")
+        elif colonna in tabella.fk:
+            riferita = TABELLE[tabella.fk[colonna]]
+            definizioni.append(f"{colonna} {tipo} REFERENCES {riferita.nome}({riferita.chiave})")
+        else:
+            definizioni.append(f"{colonna} {tipo}")
+    return f"CREATE TABLE IF NOT EXISTS {tabella.nome} (\n    " + ",\n    ".join(definizioni) + "\n)"
+
+
+def create_schema(conn):
+    """Crea le tabelle mancanti e aggiunge alle esistenti le colonne nuove dello schema."""
+    for tabella in SCHEMA:
+        conn.execute(create_table_sql(tabella))
+        esistenti = {riga[1] for riga in conn.execute(f"PRAGMA table_info({tabella.nome})")}
+        for colonna, tipo in tabella.colonne.items():
+            if colonna not in esistenti:
+                conn.execute(f"ALTER TABLE {tabella.nome} ADD COLUMN {colonna} {tipo}")
+
+
+def index_names(tabella):
+    """Indici sulle foreign key: nome indice -> colonna."""
+    return {f"idx_{tabella.nome}_{colonna}": colonna for colonna in tabella.fk}
+
+
+# --- CARICAMENTO ---
+
+def upsert_sql(tabella, colonne):
+    segnaposti = ', '.join('?' for _ in colonne)
+    aggiornamenti = ', '.join(f"{c} = excluded.{c}" for c in colonne if c != tabella.chiave)
+    azione = f"DO UPDATE SET {aggiornamenti}" if aggiornamenti else "DO NOTHING"
+    return (f"INSERT INTO {tabella.nome} ({', '.join(colonne)}) VALUES ({segnaposti}) "
+            f"ON CONFLICT({tabella.chiave}) {azione}")
+
+
+def iter_batches(path, tabella):
+    """
+    Genera (colonne, righe) a blocchi di RIGHE_PER_BATCH: solo le colonne dello schema
+    presenti nel CSV, con None al posto dei valori mancanti.
+    """
+    intestazione = list(pd.read_csv(path, nrows=0).columns)
+    colonne = [c for c in tabella.colonne if c in intestazione]
+    if tabella.chiave not in colonne:
+        raise ValueError(f"{path}: manca la colonna {tabella.chiave}")
+    dtype = {c: DTYPE_SQL[tabella.colonne[c]] for c in colonne}
+    for blocco in pd.read_csv(path, usecols=colonne, dtype=dtype, keep_default_na=False, na_values=[''],
+                              chunksize=RIGHE_PER_BATCH):
+        # object: interi e float Python (sqlite3 non accetta gli scalari numpy)
+        blocco = blocco[colonne].astype(object)
+        yield colonne, list(blocco.where(blocco.notna(), None).itertuples(index=False, name=None))
+
+
+def source_paths(tabella, cartelle):
+    """File sorgente di `tabella` presenti, nell'ordine di caricamento."""
+    paths = []
+    for pipeline, filename in tabella.sorgenti:
+        if pipeline in cartelle and os.path.exists(os.path.join(cartelle[pipeline], filename)):
+            paths.append(os.path.join(cartelle[pipeline], filename))
+    return paths
+
+
+def check_conformed(conn, tabella, cartelle):
+    """
+    Verifica che le sorgenti di una dimensione condivisa (e le righe gia' nel database)
+    associno ogni id alla stessa chiave naturale e viceversa: altrimenti l'upsert
+    lascerebbe vincere l'ultima sorgente e i fatti delle altre pipeline punterebbero al
+    membro sbagliato. ValueError con le coppie in conflitto.
+    """
+    colonne = [tabella.chiave] + tabella.naturale
+    parti = [pd.read_sql(f"SELECT {', '.join(colonne)} FROM {tabella.nome}", conn).assign(sorgente='database')]
+    for path in source_paths(tabella, cartelle):
+        parti.append(pd.read_csv(path, usecols=colonne).assign(sorgente=path))
+    membri = pd.concat(parti, ignore_index=True).drop_duplicates(subset=colonne + ['sorgente'])
+
+    conflitti = []
+    for per in ([tabella.chiave], tabella.naturale):
+        distinti = membri.drop_duplicates(subset=colonne)
+        doppi = distinti[distinti.duplicated(subset=per, keep=False)]
+        conflitti.append(membri.merge(doppi[per], on=per))
+    conflitti = pd.concat(conflitti, ignore_index=True).drop_duplicates().sort_values(colonne)
+    if len(conflitti):
+        righe = '; '.join(f"{r[tabella.chiave]}={', '.join(str(r[c]) for c in tabella.naturale)} ({r['sorgente']})"
+                          for _, r in conflitti.iterrows())
+        raise ValueError(f"id di {tabella.nome} non conformati tra le sorgenti: {righe}")
+
+
+def load_table(conn, tabella, cartelle):
+    """Upsert di tutte le sorgenti disponibili di `tabella`; restituisce le righe caricate (None se nessuna)."""
+    righe = None
+    for path in source_paths(tabella, cartelle):
+        righe = righe or 0
+        for colonne, valori in iter_batches(path, tabella):
+            conn.executemany(upsert_sql(tabella, colonne), valori)
+            righe += len(valori)
+    return righe
+
+
+def foreign_key_violations(conn):
+    """Righe con foreign key non risolte, per tabella."""
+    violazioni = {}
+    for tabella, _, _, _ in conn.execute("PRAGMA foreign_key_check"):
+        violazioni[tabella] = violazioni.get(tabella, 0) + 1
+    return violazioni
+
+
+def load_all(db, cartelle):
+    """
+    Carica nel database `db` gli output delle pipeline (`cartelle`: pipeline -> cartella).
+    Restituisce {tabella: (righe lette, righe in tabella, secondi)} per le tabelle con
+    almeno un file sorgente, e le violazioni di foreign key per tabella.
+    """
+    if os.path.dirname(db):
+        os.makedirs(os.path.dirname(db), exist_ok=True)
+    # Transazione gestita esplicitamente (BEGIN/COMMIT)
+    conn = sqlite3.connect(db, isolation_level=None)
+    try:
+        for nome, valore in PRAGMA_CARICAMENTO.items():
+            conn.execute(f"PRAGMA {nome} = {valore}")
+        caricate = {}
+        conn.execute("BEGIN")
+        try:
+            create_schema(conn)
+            for tabella in SCHEMA:
+                # Indici ricostruiti dopo il caricamento: nessun aggiornamento riga per riga
+                for indice in index_names(tabella):
+                    conn.execute(f"DROP INDEX IF EXISTS {indice}")
+            for tabella in SCHEMA:
+                if tabella.naturale:
+                    check_conformed(conn, tabella, cartelle)
+            for tabella in SCHEMA:
+                inizio = time.perf_counter()
+                righe = load_table(conn, tabella, cartelle)
+                if righe is not None:
+                    caricate[tabella.nome] = (righe, time.perf_counter() - inizio)
+            for tabella in SCHEMA:
+                for indice, colonna in index_names(tabella).items():
+                    conn.execute(f"CREATE INDEX {indice} ON {tabella.nome}({colonna})")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Statistiche per il query planner sugli indici appena creati
+        conn.execute("PRAGMA optimize")
+        for nome, (righe, secondi) in caricate.items():
+            totale = conn.execute(f"SELECT COUNT(*) FROM {nome}").fetchone()[0]
+            caricate[nome] = (righe, totale, secondi)
+        return caricate, foreign_key_violations(conn)
+    finally:
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.close()
+
+
+def input_dirs(input_dir=None, nomi=None):
+    """Cartella degli output di ogni pipeline: <input_dir>/<pipeline> (run_all.py --output-dir) o la sua cartella."""
+    cartelle = {}
+    for nome in nomi or PIPELINE:
+        cartelle[nome] = os.path.join(input_dir, nome) if input_dir else os.path.join(CARTELLA_SCRIPTS, PIPELINE[nome][0])
+    return cartelle
+
+
+def print_summary(db, caricate, violazioni, stream=sys.stdout):
+    print(f"\n{Colors.HEADER}{Colors.BOLD}=== CARICAMENTO {db} ==={Colors.ENDC}", file=stream)
+    for nome, (righe, totale, secondi) in caricate.items():
+        print(f"  {nome:<16} {righe:>10} righe caricate  {totale:>10} in tabella  {secondi:8.2f}s", file=stream)
+    for nome, n in violazioni.items():
+        print(f"  {Colors.WARNING}⚠️  {nome}: {n} righe con foreign key non risolte{Colors.ENDC}", file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Carica gli output delle pipeline in un database SQLite (upsert sugli id).",
+                                     epilog="Codice di uscita: 0 ok, 1 caricamento fallito, 3 nessun file da caricare.")
+    parser.add_argument('--db', default=FILE_DB, help=f"database SQLite (default: {FILE_DB})")
+    parser.add_argument('--input-dir', help="cartella con gli output in <input-dir>/<pipeline> (come run_all.py "
+                                            "--output-dir); default: le cartelle delle pipeline")
+    parser.add_argument('--only', help=f"pipeline da caricare separate da virgola ({', '.join(PIPELINE)}); "
+                                       "default: tutte")
+    parser.add_argument('--quiet', action='store_true', help="nessun output se va tutto bene")
+    args = parser.parse_args(argv)
+
+    nomi = None
+    if args.only:
+        nomi = [n.strip().upper() for n in args.only.split(',')]
+        sconosciute = [n for n in nomi if n not in PIPELINE]
+        if sconosciute:
+            parser.error(f"pipeline sconosciute: {', '.join(sconosciute)}")
+
+    if args.quiet or not sys.stdout.isatty() or os.environ.get('NO_COLOR'):
+        disable_colors(Colors)
+
+    try:
+        caricate, violazioni = load_all(args.db, input_dirs(args.input_dir, nomi))
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"{Colors.FAIL}❌ Caricamento annullato (nessuna modifica al database): {e}{Colors.ENDC}", file=sys.stderr)
+        return EXIT_FALLITO
+    if not caricate:
+        print("load_sqlite.py: nessun file di output trovato da caricare", file=sys.stderr)
+        return EXIT_INPUT
+    if not args.quiet:
+        print_summary(args.db, caricate, violazioni)
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Orchestratore delle pipeline DNF, MUR ed EUROSTATS.
+
+Le tre pipeline sono indipendenti: ognuna viene eseguita in un processo separato
+(ProcessPoolExecutor), nella propria cartella, con lo stesso percorso non interattivo
+di `--quiet` (common/cli.py). Il tempo totale di un aggiornamento completo e' quello
+della pipeline piu' lenta, non la somma delle tre.
+
+L'unica dimensione comune e' l'anno (registro condiviso, common/anni.py): lo step
+degli anni di MUR viene completato prima di avviare le pipeline, cosi' gli id_anno
+assegnati non dipendono da quale pipeline arriva prima. Con --output-dir il registro
+e' <output-dir>/anno_conformato.csv.
+
+Uso (dalla cartella scripts/):
+    python run_all.py                       # tutte le pipeline
+    python run_all.py --only DNF,MUR --force --json run_all.json
+    python run_all.py --parquet             # anche le fact table in Parquet
+    python run_all.py --atenei              # anche le tabelle MUR per ateneo
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from common.anni import NOME_FILE as FILE_ANNI
+from common.anni import configure as configure_anni
+from common.anni import missing_years
+from common.cli import EXIT_FALLITO, EXIT_INPUT, EXIT_OK, disable_colors, exit_code
+from common.dag import ESEGUITO
+from common.parquet_export import HAS_PYARROW
+from common.parquet_export import configure as configure_parquet
+
+CARTELLA_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+# nome -> (cartella, modulo)
+PIPELINE = {
+    'DNF': ('DNF', 'AnalyzeDNF'),
+    'MUR': ('MUR', 'MUR'),
+    'EUROSTATS': ('EUROSTATS', 'AnalyzeESTAT'),
+}
+
+# Step che registra gli anni di MUR, eseguito prima delle pipeline
+STEP_ANNI = ('MUR', 'step_1_generazione_anni')
+
+class Colors:
+    HEADER = '\033[95m'
+    GREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+
+
+def run_pipeline(nome, force=False, jobs=2, output_dir=None, parquet=False, atenei=False, steps=None):
+    """
+    Esegue una pipeline (o i soli `steps`) nel processo corrente (chiamata dai worker del pool).
+    Restituisce un dict serializzabile con esiti per step, codice di uscita, durata e log.
+    """
+    cartella, nome_modulo = PIPELINE[nome]
+    cartella = os.path.join(CARTELLA_SCRIPTS, cartella)
+    os.chdir(cartella)
+    sys.path.insert(0, cartella)
+
+    risultato = {'pipeline': nome, 'codice': EXIT_OK, 'steps': {}, 'secondi': 0.0, 'errore': None, 'log': ''}
+    buffer = io.StringIO()
+    inizio = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(buffer):
+            configure_parquet(parquet)
+            modulo = importlib.import_module(nome_modulo)
+            disable_colors(modulo.Colors)
+            if atenei and hasattr(modulo, 'INCLUDI_ATENEI'):
+                modulo.INCLUDI_ATENEI = True
+            input_path = modulo.configura_percorsi(None, os.path.join(output_dir, nome) if output_dir else None)
+            # Un solo registro degli anni per tutte le pipeline, non uno per sottocartella
+            if output_dir:
+                configure_anni(os.path.join(output_dir, FILE_ANNI))
+            if not os.path.exists(input_path):
+                risultato['codice'] = EXIT_INPUT
+                risultato['errore'] = f"file di input non trovato: {os.path.join(cartella, input_path)}"
+            elif missing_years():
+                risultato['codice'] = EXIT_INPUT
+                risultato['errore'] = f"registro degli anni non trovato: {missing_years()}"
+            else:
+                esiti = modulo.run_batch(steps=steps, force=force, jobs=jobs)
+                risultato['steps'] = {step: {'esito': esito, 'secondi': round(secondi, 3)}
+                                      for step, (esito, secondi) in esiti.items()}
+                risultato['codice'] = exit_code(esiti)
+                # Metriche per step (memoria, righe, byte) dal report di esecuzione della pipeline
+                if os.path.exists(modulo.FILE_REPORT_ESECUZIONE):
+                    with open(modulo.FILE_REPORT_ESECUZIONE, encoding='utf-8') as f:
+                        risultato['report'] = json.load(f)
+    except Exception as e:
+        risultato['codice'] = EXIT_FALLITO
+        risultato['errore'] = f"{type(e).__name__}: {e}"
+        buffer.write(traceback.format_exc())
+    risultato['secondi'] = round(time.perf_counter() - inizio, 3)
+    risultato['log'] = buffer.getvalue()
+    return risultato
+
+
+def merge_years_run(anni, risultato):
+    """Riporta nel risultato della pipeline l'esecuzione preliminare dello step degli anni."""
+    _, step = STEP_ANNI
+    risultato['secondi'] = round(risultato['secondi'] + anni['secondi'], 3)
+    risultato['log'] = anni['log'] + risultato['log']
+    # Nell'esecuzione completa lo step risulta di norma gia' aggiornato: conta quella preliminare
+    if anni['steps'].get(step, {}).get('esito') == ESEGUITO and step in risultato['steps']:
+        risultato['steps'][step] = anni['steps'][step]
+
+
+def run_all(nomi, force=False, jobs=2, output_dir=None, parquet=False, atenei=False):
+    """Lancia le pipeline in parallelo (un processo ciascuna) e restituisce il riepilogo combinato."""
+    inizio = time.perf_counter()
+    risultati = {}
+    # 'spawn' e un processo nuovo per pipeline: nessuno stato (cwd, moduli, cache) condiviso
+    contesto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(nomi), mp_context=contesto, max_tasks_per_child=1) as pool:
+        anni = None
+        nome_anni, step_anni = STEP_ANNI
+        if nome_anni in nomi:
+            # Senza --force: se lo step e' aggiornato gli anni di MUR sono gia' nel registro.
+            # Un esito negativo ricompare nell'esecuzione completa della pipeline.
+            try:
+                anni = pool.submit(run_pipeline, nome_anni, False, jobs, output_dir, parquet, atenei,
+                                   [step_anni]).result()
+            except Exception:
+                anni = None
+        futuri = {pool.submit(run_pipeline, nome, force, jobs, output_dir, parquet, atenei): nome for nome in nomi}
+        for futuro in as_completed(futuri):
+            nome = futuri[futuro]
+            try:
+                risultati[nome] = futuro.result()
+            except Exception as e:
+                # Il worker e' terminato in modo anomalo (es. memoria esaurita)
+                risultati[nome] = {'pipeline': nome, 'codice': EXIT_FALLITO, 'steps': {}, 'secondi': 0.0,
+                                   'errore': f"processo terminato: {e}", 'log': ''}
+    if anni is not None:
+        merge_years_run(anni, risultati[nome_anni])
+
+    pipeline = [risultati[nome] for nome in nomi]
+    return {
+        'codice': max(r['codice'] for r in pipeline),
+        'secondi': round(time.perf_counter() - inizio, 3),
+        'secondi_sequenziali': round(sum(r['secondi'] for r in pipeline), 3),
+        'pipeline': pipeline,
+    }
+
+
+def print_summary(riepilogo, stream=sys.stdout):
+    print(f"\n{Colors.HEADER}{Colors.BOLD}=== RIEPILOGO ESECUZIONE ==={Colors.ENDC}", file=stream)
+    larghezza = max([len(s) for r in riepilogo['pipeline'] for s in r['steps']] + [10])
+    for r in riepilogo['pipeline']:
+        colore = Colors.GREEN if r['codice'] == EXIT_OK else Colors.FAIL
+        stato = 'ok' if r['codice'] == EXIT_OK else f"uscita {r['codice']}"
+        print(f"\n{Colors.BOLD}{r['pipeline']}{Colors.ENDC}  {colore}{stato}{Colors.ENDC}  ({r['secondi']:.2f}s)",
+              file=stream)
+        for step, esito in r['steps'].items():
+            print(f"  {step:<{larghezza}}  {esito['esito']:<9} {esito['secondi']:8.2f}s", file=stream)
+        if r['errore']:
+            print(f"  {Colors.FAIL}{r['errore']}{Colors.ENDC}", file=stream)
+    print(f"\nTempo totale: {riepilogo['secondi']:.2f}s "
+          f"(somma delle pipeline: {riepilogo['secondi_sequenziali']:.2f}s)", file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Esegue in parallelo le pipeline DNF, MUR ed EUROSTATS.",
+                                     epilog="Codice di uscita: il peggiore tra quelli delle pipeline "
+                                            "(0 ok, 1 step fallito, 3 input mancante).")
+    parser.add_argument('--only', help=f"pipeline da eseguire separate da virgola ({', '.join(PIPELINE)}); "
+                                       "default: tutte")
+    parser.add_argument('--force', action='store_true', help="rigenera anche gli step gia' aggiornati")
+    parser.add_argument('--jobs', type=int, default=2, help="step paralleli all'interno di ogni pipeline")
+    parser.add_argument('--output-dir', help="scrive gli output in <output-dir>/<pipeline> invece che "
+                                             "nelle cartelle delle pipeline")
+    parser.add_argument('--parquet', action='store_true', help="scrive anche le fact table in Parquet partizionato "
+                                                               "(richiede pyarrow)")
+    parser.add_argument('--atenei', action='store_true', help="esegue anche gli step MUR per ateneo (seconda "
+                                                              "scansione del file MUR)")
+    parser.add_argument('--json', help="salva il riepilogo (esiti, tempi, log) in questo file JSON")
+    parser.add_argument('--quiet', action='store_true', help="stampa il riepilogo solo in caso di errore")
+    args = parser.parse_args(argv)
+
+    nomi = list(PIPELINE)
+    if args.only:
+        nomi = [n.strip().upper() for n in args.only.split(',')]
+        sconosciute = [n for n in nomi if n not in PIPELINE]
+        if sconosciute:
+            parser.error(f"pipeline sconosciute: {', '.join(sconosciute)}")
+    if args.jobs < 1:
+        parser.error("--jobs deve essere almeno 1")
+    if args.parquet and not HAS_PYARROW:
+        parser.error("--parquet: modulo non installato (pip install pyarrow)")
+    output_dir = os.path.abspath(args.output_dir) if args.output_dir else None
+
+    if args.quiet or not sys.stdout.isatty() or os.environ.get('NO_COLOR'):
+        disable_colors(Colors)
+
+    riepilogo = run_all(nomi, force=args.force, jobs=args.jobs, output_dir=output_dir, parquet=args.parquet,
+                        atenei=args.atenei)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(riepilogo, f, ensure_ascii=False, indent=2)
+
+    if riepilogo['codice'] != EXIT_OK:
+        print_summary(riepilogo, sys.stderr)
+        for r in riepilogo['pipeline']:
+            if r['codice'] != EXIT_OK and r['log']:
+                print(f"\n--- log {r['pipeline']} ---\n{r['log']}", file=sys.stderr)
+    elif not args.quiet:
+        print_summary(riepilogo)
+    return riepilogo['codice']
+
+
+if __name__ == '__main__':
+    sys.exit(main())